@@ -51,6 +51,7 @@ An example::
 import logging
 from xml.etree.ElementTree import XML
 import traceback
+from collections import deque
 
 from gi.repository import Gio
 
@@ -67,7 +68,11 @@ _FIND_SIZE = './/{http://www.mozilla.org/2004/em-rdf#}updateSize'
 
 _UPDATE_PATH = 'http://activities.sugarlabs.org/services/update-aslo.php'
 
-_fetcher = None
+# Number of requests made to the server at the same time
+_MAX_PARALLEL_FETCHES = 4
+
+_fetchers = set()
+_pending_fetches = deque()
 
 
 class _UpdateFetcher(object):
@@ -92,23 +97,33 @@ class _UpdateFetcher(object):
 
         self._file.read_async(self.__file_read_async_cb)
 
+    def _complete(self, version, link, size, error_message):
+        _fetchers.discard(self)
+        # Report first, the callback may cancel the fetches that are waiting
+        try:
+            self._completion_cb(self._bundle, version, link, size,
+                                error_message)
+        finally:
+            _start_fetches()
+
     def __file_read_async_cb(self, gfile, result):
         try:
             self._stream = self._file.read_finish(result)
         except:
-            global _fetcher
-            _fetcher = None
-            self._completion_cb(None, None, None, None, traceback.format_exc())
+            self._complete(None, None, None, traceback.format_exc())
             return
 
         self._stream.read_async(self._CHUNK_SIZE, self.__stream_read_async_cb)
 
     def __stream_read_async_cb(self, stream, result):
-        xml_data = self._stream.read_finish(result)
+        try:
+            xml_data = self._stream.read_finish(result)
+        except:
+            self._complete(None, None, None, traceback.format_exc())
+            return
+
         if xml_data is None:
-            global _fetcher
-            _fetcher = None
-            self._completion_cb(self._bundle, None, None, None,
+            self._complete(None, None, None,
                     'Error reading update information for %s from '
                     'server.' % self._bundle.get_bundle_id())
             return
@@ -120,7 +135,11 @@ class _UpdateFetcher(object):
                                     self.__stream_read_async_cb)
 
     def _process_result(self):
-        document = XML(self._xml_data)
+        try:
+            document = XML(self._xml_data)
+        except SyntaxError:
+            self._complete(None, None, None, traceback.format_exc())
+            return
 
         if document.find(_FIND_DESCRIPTION) is None:
             logging.debug('Bundle %s not available in the server for the '
@@ -143,9 +162,13 @@ class _UpdateFetcher(object):
                 logging.exception('Exception occured while parsing size')
                 size = 0
 
-        global _fetcher
-        _fetcher = None
-        self._completion_cb(self._bundle, version, link, size, None)
+        self._complete(version, link, size, None)
+
+
+def _start_fetches():
+    while _pending_fetches and len(_fetchers) < _MAX_PARALLEL_FETCHES:
+        bundle, completion_cb = _pending_fetches.popleft()
+        _fetchers.add(_UpdateFetcher(bundle, completion_cb))
 
 
 def fetch_update_info(bundle, completion_cb):
@@ -155,10 +178,14 @@ def fetch_update_info(bundle, completion_cb):
        message:
 
        def completion_cb(bundle, version, link, size, error_message):
+
+       Up to _MAX_PARALLEL_FETCHES requests run at the same time, the others
+       wait for their turn, so the completions can come in any order.
     """
-    global _fetcher
+    _pending_fetches.append((bundle, completion_cb))
+    _start_fetches()
 
-    if _fetcher is not None:
-        raise RuntimeError('Multiple simultaneous requests are not supported')
 
-    _fetcher = _UpdateFetcher(bundle, completion_cb)
+def cancel_fetches():
+    """Drop the requests that did not start yet"""
+    _pending_fetches.clear()
@@ -26,6 +26,7 @@ import logging
 import tempfile
 from urlparse import urlparse
 import traceback
+from functools import partial
 
 from gi.repository import GObject
 from gi.repository import Gio
@@ -58,50 +59,73 @@ class UpdateModel(GObject.GObject):
 
         self.updates = None
         self._bundles_to_check = None
+        # Results of the checks that completed before the previous ones
+        self._check_results = {}
+        self._checks_reported = 0
+        self._check_serial = 0
         self._bundles_to_update = None
         self._total_bundles_to_update = 0
         self._downloader = None
         self._cancelling = False
 
     def check_updates(self):
+        """Check the bundles for updates, several at once
+
+        The results come back in any order, they are reported in the order
+        of the bundles so the progress only goes forward.
+
+        """
         self.updates = []
         self._bundles_to_check = list(bundleregistry.get_registry())
-        self._check_next_update()
-
-    def _check_next_update(self):
-        total = len(bundleregistry.get_registry())
-        current = total - len(self._bundles_to_check)
+        self._check_results = {}
+        self._checks_reported = 0
+        self._check_serial += 1
 
         if not self._bundles_to_check:
-            return False
+            return
 
-        bundle = self._bundles_to_check.pop()
-        self.emit('progress', UpdateModel.ACTION_CHECKING, bundle.get_name(),
-                  current, total)
+        self.emit('progress', UpdateModel.ACTION_CHECKING,
+                  self._bundles_to_check[0].get_name(), 0,
+                  len(self._bundles_to_check))
 
-        aslo.fetch_update_info(bundle, self.__check_completed_cb)
+        for index, bundle in enumerate(self._bundles_to_check):
+            aslo.fetch_update_info(bundle, partial(self.__check_completed_cb,
+                                                   self._check_serial, index))
+
+    def __check_completed_cb(self, serial, index, bundle, version, link, size,
+                             error_message):
+        if serial != self._check_serial or self._bundles_to_check is None:
+            # A check that was cancelled
+            return
 
-    def __check_completed_cb(self, bundle, version, link, size, error_message):
         if error_message is not None:
             logging.error('Error getting update information from server:\n'
                           '%s' % error_message)
 
-        if version is not None and \
-                version > NormalizedVersion(bundle.get_activity_version()):
-            self.updates.append(BundleUpdate(bundle, version, link, size))
+        self._check_results[index] = (version, link, size)
 
         if self._cancelling:
             self._cancel_checking()
-        elif self._bundles_to_check:
-            GObject.idle_add(self._check_next_update)
-        else:
-            total = len(bundleregistry.get_registry())
-            if bundle is None:
-                name = ''
+            return
+
+        total = len(self._bundles_to_check)
+        while self._checks_reported in self._check_results:
+            bundle = self._bundles_to_check[self._checks_reported]
+            version, link, size = \
+                    self._check_results.pop(self._checks_reported)
+            if version is not None and \
+                    version > NormalizedVersion(bundle.get_activity_version()):
+                self.updates.append(BundleUpdate(bundle, version, link, size))
+            self._checks_reported += 1
+
+            if self._checks_reported < total:
+                next_bundle = self._bundles_to_check[self._checks_reported]
+                self.emit('progress', UpdateModel.ACTION_CHECKING,
+                          next_bundle.get_name(), self._checks_reported,
+                          total)
             else:
-                name = bundle.get_name()
-            self.emit('progress', UpdateModel.ACTION_CHECKING, name, total,
-                      total)
+                self.emit('progress', UpdateModel.ACTION_CHECKING,
+                          bundle.get_name(), total, total)
 
     def update(self, bundle_ids):
         self._bundles_to_update = []
@@ -198,11 +222,12 @@ class UpdateModel(GObject.GObject):
 
     def _cancel_checking(self):
         logging.debug('UpdateModel._cancel_checking')
-        total = len(bundleregistry.get_registry())
-        current = total - len(self._bundles_to_check)
+        aslo.cancel_fetches()
+        current = self._checks_reported
         self.emit('progress', UpdateModel.ACTION_CHECKING, '', current,
                   current)
         self._bundles_to_check = None
+        self._check_results = {}
         self._cancelling = False
 
     def _cancel_updating(self):
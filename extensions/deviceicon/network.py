@@ -376,9 +376,7 @@ class WirelessDeviceView(ToolButton):
     def __init__(self, device):
         ToolButton.__init__(self)
 
-        self._bus = dbus.SystemBus()
         self._device = device
-        self._device_props = None
         self._flags = 0
         self._ssid = ''
         self._display_name = ''
@@ -410,73 +408,62 @@ class WirelessDeviceView(ToolButton):
         self.set_palette(self._palette)
         self._palette.set_group_id('frame')
 
-        self._device_props = dbus.Interface(self._device,
-                                            dbus.PROPERTIES_IFACE)
-        self._device_props.GetAll(network.NM_DEVICE_IFACE, byte_arrays=True,
-                              reply_handler=self.__get_device_props_reply_cb,
-                              error_handler=self.__get_device_props_error_cb)
-
-        self._device_props.Get(network.NM_WIRELESS_IFACE, 'ActiveAccessPoint',
-                               reply_handler=self.__get_active_ap_reply_cb,
-                               error_handler=self.__get_active_ap_error_cb)
+        self._state = network.get_manager_state()
+        self._state_changed_sid = self._state.connect(
+            'device-state-changed', self.__state_changed_cb)
+        self._properties_changed_sid = self._state.connect(
+            'properties-changed', self.__properties_changed_cb)
+        self._ap_added_sid = self._state.connect(
+            'access-point-added', self.__access_point_added_cb)
 
-        self._bus.add_signal_receiver(self.__state_changed_cb,
-                                      signal_name='StateChanged',
-                                      path=self._device.object_path,
-                                      dbus_interface=network.NM_DEVICE_IFACE)
+        self._device_state = self._state.get_property(
+            self._device.object_path, network.NM_DEVICE_IFACE, 'State')
+        self._update_state()
+        self._update_active_ap()
 
     def disconnect(self):
-        self._bus.remove_signal_receiver(self.__state_changed_cb,
-                                         signal_name='StateChanged',
-                                         path=self._device.object_path,
-                                         dbus_interface=network.NM_DEVICE_IFACE)
-
-    def __get_device_props_reply_cb(self, properties):
-        if 'State' in properties:
-            self._device_state = properties['State']
-            self._update_state()
-
-    def __get_device_props_error_cb(self, err):
-        logging.error('Error getting the device properties: %s', err)
-
-    def __get_active_ap_reply_cb(self, active_ap_op):
+        self._state.disconnect(self._state_changed_sid)
+        self._state.disconnect(self._properties_changed_sid)
+        self._state.disconnect(self._ap_added_sid)
+
+    def _update_active_ap(self):
+        active_ap_op = self._state.get_property(
+            self._device.object_path, network.NM_WIRELESS_IFACE,
+            'ActiveAccessPoint', '/')
         if self._active_ap_op != active_ap_op:
-            if self._active_ap_op is not None:
-                self._bus.remove_signal_receiver(
-                    self.__ap_properties_changed_cb,
-                    signal_name='PropertiesChanged',
-                    path=self._active_ap_op,
-                    dbus_interface=network.NM_ACCESSPOINT_IFACE)
             if active_ap_op == '/':
                 self._active_ap_op = None
                 return
             self._active_ap_op = active_ap_op
-            active_ap = self._bus.get_object(network.NM_SERVICE, active_ap_op)
-            props = dbus.Interface(active_ap, dbus.PROPERTIES_IFACE)
-
-            props.GetAll(network.NM_ACCESSPOINT_IFACE, byte_arrays=True,
-                         reply_handler=self.__get_all_ap_props_reply_cb,
-                         error_handler=self.__get_all_ap_props_error_cb)
-
-            self._bus.add_signal_receiver(self.__ap_properties_changed_cb,
-                                          signal_name='PropertiesChanged',
-                                          path=self._active_ap_op,
-                                          dbus_interface=network.NM_ACCESSPOINT_IFACE,
-                                          byte_arrays=True)
-
-    def __get_active_ap_error_cb(self, err):
-        logging.error('Error getting the active access point: %s', err)
-
-    def __state_changed_cb(self, new_state, old_state, reason):
+            # Unknown until the state announces the access point, see
+            # __access_point_added_cb
+            properties = self._state.get_properties(
+                active_ap_op, network.NM_ACCESSPOINT_IFACE)
+            if properties is not None:
+                self._update_properties(properties)
+
+    def __access_point_added_cb(self, state, device_o, ap_o):
+        if ap_o == self._active_ap_op:
+            self._update_properties(self._state.get_properties(
+                ap_o, network.NM_ACCESSPOINT_IFACE))
+
+    def __state_changed_cb(self, state, device_o, new_state, old_state,
+                           reason):
+        if device_o != self._device.object_path:
+            return
         self._device_state = new_state
         self._update_color()
         self._update_state()
-        self._device_props.Get(network.NM_WIRELESS_IFACE, 'ActiveAccessPoint',
-                               reply_handler=self.__get_active_ap_reply_cb,
-                               error_handler=self.__get_active_ap_error_cb)
+        self._update_active_ap()
 
-    def __ap_properties_changed_cb(self, properties):
-        self._update_properties(properties)
+    def __properties_changed_cb(self, state, path, interface, properties):
+        if path == self._device.object_path and \
+                interface == network.NM_WIRELESS_IFACE:
+            if 'ActiveAccessPoint' in properties:
+                self._update_active_ap()
+        elif path == self._active_ap_op and \
+                interface == network.NM_ACCESSPOINT_IFACE:
+            self._update_properties(properties)
 
     def _update_properties(self, properties):
         if 'Mode' in properties:
@@ -509,12 +496,6 @@ class WirelessDeviceView(ToolButton):
                                                xocolor.colors[index][1]))
         self._update()
 
-    def __get_all_ap_props_reply_cb(self, properties):
-        self._update_properties(properties)
-
-    def __get_all_ap_props_error_cb(self, err):
-        logging.error('Error getting the access point properties: %s', err)
-
     def _update(self):
         if self._flags == network.NM_802_11_AP_FLAGS_PRIVACY:
             self._icon.props.badge_name = 'emblem-locked'
@@ -561,7 +542,9 @@ class WirelessDeviceView(ToolButton):
             self._palette.set_connecting()
             self._icon.props.pulsing = True
         elif state == network.NM_DEVICE_STATE_ACTIVATED:
-            address = self._device_props.Get(network.NM_DEVICE_IFACE, 'Ip4Address')
+            address = self._state.get_property(self._device.object_path,
+                                               network.NM_DEVICE_IFACE,
+                                               'Ip4Address')
             self._palette.set_connected_with_frequency(self._frequency,
                                                        address)
             self._icon.props.pulsing = False
@@ -592,11 +575,10 @@ class OlpcMeshDeviceView(ToolButton):
     def __init__(self, device, state):
         ToolButton.__init__(self)
 
-        self._bus = dbus.SystemBus()
         self._device = device
-        self._device_props = None
         self._device_state = None
         self._channel = 0
+        self._state = network.get_manager_state()
 
         self._icon = PulsingIcon(icon_name=self._ICON_NAME)
         self._inactive_color = xocolor.XoColor(
@@ -619,37 +601,21 @@ class OlpcMeshDeviceView(ToolButton):
         self.set_palette(self._palette)
         self._palette.set_group_id('frame')
 
+        self._channel = self._state.get_property(
+            self._device.object_path, network.NM_OLPC_MESH_IFACE,
+            'ActiveChannel', 0)
         self.update_state(state)
 
-        self._device_props = dbus.Interface(self._device,
-                                            dbus.PROPERTIES_IFACE)
-        self._device_props.Get(network.NM_OLPC_MESH_IFACE, 'ActiveChannel',
-                            reply_handler=self.__get_active_channel_reply_cb,
-                            error_handler=self.__get_active_channel_error_cb)
-
-        self._bus.add_signal_receiver(self.__wireless_properties_changed_cb,
-                                      signal_name='PropertiesChanged',
-                                      path=device.object_path,
-                                      dbus_interface=network.NM_OLPC_MESH_IFACE)
+        self._properties_changed_sid = self._state.connect(
+            'properties-changed', self.__properties_changed_cb)
 
     def disconnect(self):
-        self._bus.remove_signal_receiver(self.__wireless_properties_changed_cb,
-                                         signal_name='PropertiesChanged',
-                                         path=self._device.object_path,
-                                         dbus_interface=network.NM_OLPC_MESH_IFACE)
-
-    def __get_active_channel_reply_cb(self, channel):
-        self._channel = channel
-        self._update_text()
-
-    def __get_active_channel_error_cb(self, err):
-        logging.error('Error getting the active channel: %s', err)
-
-    def __state_changed_cb(self, new_state, old_state, reason):
-        self._device_state = new_state
-        self._update()
+        self._state.disconnect(self._properties_changed_sid)
 
-    def __wireless_properties_changed_cb(self, properties):
+    def __properties_changed_cb(self, state, path, interface, properties):
+        if path != self._device.object_path or \
+                interface != network.NM_OLPC_MESH_IFACE:
+            return
         if 'ActiveChannel' in properties:
             self._channel = properties['ActiveChannel']
             self._update_text()
@@ -669,7 +635,9 @@ class OlpcMeshDeviceView(ToolButton):
             self._palette.set_connecting()
             self._icon.props.pulsing = True
         elif state == network.NM_DEVICE_STATE_ACTIVATED:
-            address = self._device_props.Get(network.NM_DEVICE_IFACE, 'Ip4Address')
+            address = self._state.get_property(self._device.object_path,
+                                               network.NM_DEVICE_IFACE,
+                                               'Ip4Address')
             self._palette.set_connected_with_channel(self._channel, address)
             self._icon.props.base_color = profile.get_color()
             self._icon.props.pulsing = False
@@ -680,27 +648,24 @@ class OlpcMeshDeviceView(ToolButton):
         self._update()
 
     def __deactivate_connection(self, palette, data=None):
-        obj = self._bus.get_object(network.NM_SERVICE, network.NM_PATH)
-        netmgr = dbus.Interface(obj, network.NM_IFACE)
-        netmgr_props = dbus.Interface(netmgr, dbus.PROPERTIES_IFACE)
-        active_connections_o = netmgr_props.Get(network.NM_IFACE,
-                                                'ActiveConnections')
-
-        for conn_o in active_connections_o:
+        for conn_o in self._state.get_active_connections():
             # The connection path for a mesh connection is the device itself.
-            obj = self._bus.get_object(network.NM_IFACE, conn_o)
-            props = dbus.Interface(obj, dbus.PROPERTIES_IFACE)
-            ap_op = props.Get(network.NM_ACTIVE_CONN_IFACE, 'SpecificObject')
+            ap_op = self._state.get_property(conn_o,
+                                             network.NM_ACTIVE_CONN_IFACE,
+                                             'SpecificObject')
+            device_type = self._state.get_device_type(ap_op)
+            if device_type == network.NM_DEVICE_TYPE_OLPC_MESH:
+                network.get_manager().DeactivateConnection(
+                    conn_o,
+                    reply_handler=self.__deactivate_reply_cb,
+                    error_handler=self.__deactivate_error_cb)
+                break
+
+    def __deactivate_reply_cb(self):
+        logging.debug('Mesh connection deactivated')
 
-            try:
-                obj = self._bus.get_object(network.NM_IFACE, ap_op)
-                props = dbus.Interface(obj, dbus.PROPERTIES_IFACE)
-                device_type = props.Get(network.NM_DEVICE_IFACE, 'DeviceType')
-                if device_type == network.NM_DEVICE_TYPE_OLPC_MESH:
-                    netmgr.DeactivateConnection(conn_o)
-                    break
-            except dbus.exceptions.DBusException:
-                pass
+    def __deactivate_error_cb(self, err):
+        logging.error('Failed to deactivate the mesh connection: %s', err)
 
 
 class WiredDeviceView(TrayIcon):
@@ -743,10 +708,9 @@ class GsmDeviceView(TrayIcon):
         self.set_palette_invoker(FrameWidgetInvoker(self))
         self.palette_invoker.props.toggle_palette = True
 
-        self._bus.add_signal_receiver(self.__state_changed_cb,
-                                      signal_name='StateChanged',
-                                      path=self._device.object_path,
-                                      dbus_interface=network.NM_DEVICE_IFACE)
+        self._state = network.get_manager_state()
+        self._state_changed_sid = self._state.connect(
+            'device-state-changed', self.__state_changed_cb)
         self._bus.add_signal_receiver(self.__ppp_stats_changed_cb,
                                       signal_name='PppStats',
                                       path=self._device.object_path,
@@ -761,10 +725,10 @@ class GsmDeviceView(TrayIcon):
 
         self._palette = palette
 
-        props = dbus.Interface(self._device, dbus.PROPERTIES_IFACE)
-        props.GetAll(network.NM_DEVICE_IFACE, byte_arrays=True,
-                     reply_handler=self.__current_state_check_cb,
-                     error_handler=self.__current_state_check_error_cb)
+        state = self._state.get_property(self._device.object_path,
+                                         network.NM_DEVICE_IFACE, 'State',
+                                         network.NM_DEVICE_STATE_UNKNOWN)
+        self._update_state(int(state), 0, 0)
 
         return palette
 
@@ -787,15 +751,11 @@ class GsmDeviceView(TrayIcon):
         raise RuntimeError('Error when connecting to gsm device, %s' % error)
 
     def __gsm_disconnect_cb(self, palette, data=None):
-        obj = self._bus.get_object(network.NM_SERVICE, network.NM_PATH)
-        netmgr = dbus.Interface(obj, network.NM_IFACE)
-        netmgr_props = dbus.Interface(netmgr, dbus.PROPERTIES_IFACE)
-        active_connections_o = netmgr_props.Get(network.NM_IFACE, 'ActiveConnections')
-
-        for conn_o in active_connections_o:
-            obj = self._bus.get_object(network.NM_IFACE, conn_o)
-            props = dbus.Interface(obj, dbus.PROPERTIES_IFACE)
-            devices = props.Get(network.NM_ACTIVE_CONN_IFACE, 'Devices')
+        netmgr = network.get_manager()
+        for conn_o in self._state.get_active_connections():
+            devices = self._state.get_property(conn_o,
+                                               network.NM_ACTIVE_CONN_IFACE,
+                                               'Devices', [])
             if self._device.object_path in devices:
                 netmgr.DeactivateConnection(
                         conn_o,
@@ -809,17 +769,14 @@ class GsmDeviceView(TrayIcon):
     def __disconnect_error_cb(self, error):
         raise RuntimeError('Error when disconnecting gsm device, %s' % error)
 
-    def __state_changed_cb(self, new_state, old_state, reason):
+    def __state_changed_cb(self, state, device_o, new_state, old_state,
+                           reason):
+        if device_o != self._device.object_path:
+            return
         logging.debug('State: %s to %s, reason %s', old_state,
                       new_state, reason)
         self._update_state(int(new_state), int(old_state), int(reason))
 
-    def __current_state_check_cb(self, properties):
-        self._update_state(int(properties['State']), 0, 0)
-
-    def __current_state_check_error_cb(self, error):
-        raise RuntimeError('Error when checking gsm device state, %s' % error)
-
     def _update_state(self, state, old_state, reason):
         gsm_state = None
 
@@ -860,10 +817,7 @@ class GsmDeviceView(TrayIcon):
             self._palette.update_state(gsm_state, reason)
 
     def disconnect(self):
-        self._bus.remove_signal_receiver(self.__state_changed_cb,
-                                         signal_name='StateChanged',
-                                         path=self._device.object_path,
-                                         dbus_interface=network.NM_DEVICE_IFACE)
+        self._state.disconnect(self._state_changed_sid)
 
     def __ppp_stats_changed_cb(self, in_bytes, out_bytes):
         self._palette.update_stats(in_bytes, out_bytes)
@@ -893,20 +847,18 @@ class WirelessDeviceObserver(object):
 
 class MeshDeviceObserver(object):
     def __init__(self, device, tray):
-        self._bus = dbus.SystemBus()
         self._device = device
         self._device_view = None
         self._tray = tray
 
-        props = dbus.Interface(self._device, dbus.PROPERTIES_IFACE)
-        props.GetAll(network.NM_DEVICE_IFACE, byte_arrays=True,
-                     reply_handler=self.__get_device_props_reply_cb,
-                     error_handler=self.__get_device_props_error_cb)
+        self._state = network.get_manager_state()
+        self._state_changed_sid = self._state.connect(
+            'device-state-changed', self.__state_changed_cb)
 
-        self._bus.add_signal_receiver(self.__state_changed_cb,
-                                      signal_name='StateChanged',
-                                      path=self._device.object_path,
-                                      dbus_interface=network.NM_DEVICE_IFACE)
+        state = self._state.get_property(self._device.object_path,
+                                         network.NM_DEVICE_IFACE, 'State')
+        if state is not None:
+            self._update_state(state)
 
     def _remove_device_view(self):
         self._device_view.disconnect()
@@ -917,20 +869,12 @@ class MeshDeviceObserver(object):
         if self._device_view is not None:
             self._remove_device_view()
 
-        self._bus.remove_signal_receiver(self.__state_changed_cb,
-                                         signal_name='StateChanged',
-                                         path=self._device.object_path,
-                                         dbus_interface=network.NM_DEVICE_IFACE)
+        self._state.disconnect(self._state_changed_sid)
 
-    def __get_device_props_reply_cb(self, properties):
-        if 'State' in properties:
-            self._update_state(properties['State'])
-
-    def __get_device_props_error_cb(self, err):
-        logging.error('Error getting the device properties: %s', err)
-
-    def __state_changed_cb(self, new_state, old_state, reason):
-        self._update_state(new_state)
+    def __state_changed_cb(self, state, device_o, new_state, old_state,
+                           reason):
+        if device_o == self._device.object_path:
+            self._update_state(new_state)
 
     def _update_state(self, state):
         if (state >= network.NM_DEVICE_STATE_PREPARE) and \
@@ -948,43 +892,36 @@ class MeshDeviceObserver(object):
 
 class WiredDeviceObserver(object):
     def __init__(self, device, tray):
-        self._bus = dbus.SystemBus()
         self._device = device
         self._device_state = None
         self._device_view = None
         self._tray = tray
 
-        props = dbus.Interface(self._device, dbus.PROPERTIES_IFACE)
-        props.GetAll(network.NM_DEVICE_IFACE, byte_arrays=True,
-                     reply_handler=self.__get_device_props_reply_cb,
-                     error_handler=self.__get_device_props_error_cb)
+        self._state = network.get_manager_state()
+        self._state_changed_sid = self._state.connect(
+            'device-state-changed', self.__state_changed_cb)
 
-        self._bus.add_signal_receiver(self.__state_changed_cb,
-                                      signal_name='StateChanged',
-                                      path=self._device.object_path,
-                                      dbus_interface=network.NM_DEVICE_IFACE)
+        state = self._state.get_property(self._device.object_path,
+                                         network.NM_DEVICE_IFACE, 'State')
+        if state is not None:
+            self._update_state(state)
 
     def disconnect(self):
-        self._bus.remove_signal_receiver(self.__state_changed_cb,
-                                         signal_name='StateChanged',
-                                         path=self._device.object_path,
-                                         dbus_interface=network.NM_DEVICE_IFACE)
-
-    def __get_device_props_reply_cb(self, properties):
-        if 'State' in properties:
-            self._update_state(properties['State'])
+        self._state.disconnect(self._state_changed_sid)
 
-    def __get_device_props_error_cb(self, err):
-        logging.error('Error getting the device properties: %s', err)
-
-    def __state_changed_cb(self, new_state, old_state, reason):
-        self._update_state(new_state)
+    def __state_changed_cb(self, state, device_o, new_state, old_state,
+                           reason):
+        if device_o == self._device.object_path:
+            self._update_state(new_state)
 
     def _update_state(self, state):
         if state == network.NM_DEVICE_STATE_ACTIVATED:
-            props = dbus.Interface(self._device, dbus.PROPERTIES_IFACE)
-            address = props.Get(network.NM_DEVICE_IFACE, 'Ip4Address')
-            speed = props.Get(network.NM_WIRED_IFACE, 'Speed')
+            device_o = self._device.object_path
+            address = self._state.get_property(device_o,
+                                               network.NM_DEVICE_IFACE,
+                                               'Ip4Address')
+            speed = self._state.get_property(device_o,
+                                             network.NM_WIRED_IFACE, 'Speed')
             self._device_view = WiredDeviceView(speed, address)
             self._tray.add_device(self._device_view)
         else:
@@ -1013,41 +950,22 @@ class NetworkManagerObserver(object):
     def __init__(self, tray):
         self._bus = dbus.SystemBus()
         self._devices = {}
-        self._netmgr = None
         self._tray = tray
 
-        try:
-            obj = self._bus.get_object(network.NM_SERVICE, network.NM_PATH)
-            self._netmgr = dbus.Interface(obj, network.NM_IFACE)
-        except dbus.DBusException:
-            logging.error('%s service not available', network.NM_SERVICE)
-            return
-
-        self._netmgr.GetDevices(reply_handler=self.__get_devices_reply_cb,
-                                error_handler=self.__get_devices_error_cb)
+        self._state = network.get_manager_state()
+        self._state.connect('device-added', self.__device_added_cb)
+        self._state.connect('device-removed', self.__device_removed_cb)
 
-        self._bus.add_signal_receiver(self.__device_added_cb,
-                                      signal_name='DeviceAdded',
-                                      dbus_interface=network.NM_IFACE)
-        self._bus.add_signal_receiver(self.__device_removed_cb,
-                                      signal_name='DeviceRemoved',
-                                      dbus_interface=network.NM_IFACE)
-
-    def __get_devices_reply_cb(self, devices):
-        for device_op in devices:
+        for device_op in self._state.get_devices():
             self._check_device(device_op)
 
-    def __get_devices_error_cb(self, err):
-        logging.error('Failed to get devices: %s', err)
-
     def _check_device(self, device_op):
         if device_op in self._devices:
             return
 
         nm_device = self._bus.get_object(network.NM_SERVICE, device_op)
-        props = dbus.Interface(nm_device, dbus.PROPERTIES_IFACE)
 
-        device_type = props.Get(network.NM_DEVICE_IFACE, 'DeviceType')
+        device_type = self._state.get_device_type(device_op)
         if device_type == network.NM_DEVICE_TYPE_ETHERNET:
             device = WiredDeviceObserver(nm_device, self._tray)
             self._devices[device_op] = device
@@ -1061,10 +979,10 @@ class NetworkManagerObserver(object):
             device = GsmDeviceObserver(nm_device, self._tray)
             self._devices[device_op] = device
 
-    def __device_added_cb(self, device_op):
+    def __device_added_cb(self, state, device_op):
         self._check_device(device_op)
 
-    def __device_removed_cb(self, device_op):
+    def __device_removed_cb(self, state, device_op):
         if device_op in self._devices:
             device = self._devices[device_op]
             device.disconnect()
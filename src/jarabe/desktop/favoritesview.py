@@ -16,6 +16,7 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import logging
+from functools import partial
 from gettext import gettext as _
 
 from gi.repository import GObject
@@ -380,7 +381,6 @@ class ActivityIcon(CanvasIcon):
     __gtype_name__ = 'SugarFavoriteActivityIcon'
 
     _BORDER_WIDTH = style.zoom(9)
-    _MAX_RESUME_ENTRIES = 5
 
     def __init__(self, activity_info):
         CanvasIcon.__init__(self, cache=True,
@@ -393,50 +393,17 @@ class ActivityIcon(CanvasIcon):
         self.connect_after('button-release-event',
                            self.__button_release_event_cb)
 
-        datastore.updated.connect(self.__datastore_listener_updated_cb)
-        datastore.deleted.connect(self.__datastore_listener_deleted_cb)
+        resume_entries = get_resume_entries()
+        resume_entries.changed.connect(self.__resume_entries_changed_cb)
+        self._journal_entries = resume_entries.get_entries(
+            activity_info.get_bundle_id())
 
-        self._refresh()
         self._update()
 
-    def _refresh(self):
-        bundle_id = self._activity_info.get_bundle_id()
-        properties = ['uid', 'title', 'icon-color', 'activity', 'activity_id',
-                      'mime_type', 'mountpoint']
-        self._get_last_activity_async(bundle_id, properties)
-
-    def __datastore_listener_updated_cb(self, **kwargs):
-        bundle_id = self._activity_info.get_bundle_id()
-        if kwargs['metadata'].get('activity', '') == bundle_id:
-            self._refresh()
-
-    def __datastore_listener_deleted_cb(self, **kwargs):
-        for entry in self._journal_entries:
-            if entry['uid'] == kwargs['object_id']:
-                self._refresh()
-                break
-
-    def _get_last_activity_async(self, bundle_id, properties):
-        query = {'activity': bundle_id}
-        datastore.find(query, sorting=['+timestamp'],
-                       limit=self._MAX_RESUME_ENTRIES,
-                       properties=properties,
-                       reply_handler=self.__get_last_activity_reply_handler_cb,
-                       error_handler=self.__get_last_activity_error_handler_cb)
-
-    def __get_last_activity_reply_handler_cb(self, entries, total_count):
-        # If there's a problem with the DS index, we may get entries not
-        # related to this activity.
-        checked_entries = []
-        for entry in entries:
-            if entry['activity'] == self.bundle_id:
-                checked_entries.append(entry)
-
-        self._journal_entries = checked_entries
-        self._update()
-
-    def __get_last_activity_error_handler_cb(self, error):
-        logging.error('Error retrieving most recent activities: %r', error)
+    def __resume_entries_changed_cb(self, **kwargs):
+        if kwargs['bundle_id'] == self._activity_info.get_bundle_id():
+            self._journal_entries = kwargs['entries']
+            self._update()
 
     def _update(self):
         self.palette = None
@@ -700,3 +667,152 @@ def get_settings():
     if _favorites_settings is None:
         _favorites_settings = FavoritesSetting()
     return _favorites_settings
+
+
+class ResumeEntries(object):
+    """Most recent journal entries of each activity
+
+    Keeps the last MAX_ENTRIES entries of every bundle asked for with
+    get_entries(). Entries of bundles asked for in a short time span are
+    fetched with a single datastore query, and kept up to date from the
+    datastore signals. The changed signal is sent with the bundle_id and
+    entries of the bundles whose entries changed.
+
+    """
+
+    MAX_ENTRIES = 5
+
+    _PROPERTIES = ['uid', 'title', 'icon-color', 'activity', 'activity_id',
+                   'mime_type', 'mountpoint', 'timestamp']
+    _BATCH_DELAY = 100
+
+    # bundles still missing entries after this many batched queries are
+    # queried one by one
+    _MAX_BATCHED_QUERIES = 3
+
+    def __init__(self):
+        self._entries = {}
+        self._pending_bundles = set()
+        self._batch_sid = None
+
+        self.changed = dispatch.Signal()
+
+        datastore.updated.connect(self.__datastore_updated_cb)
+        datastore.deleted.connect(self.__datastore_deleted_cb)
+
+    def get_entries(self, bundle_id):
+        """Return the entries known so far for bundle_id
+
+        If the entries are not known yet they get fetched and the changed
+        signal gets sent when they arrive.
+
+        """
+        if bundle_id not in self._entries:
+            self._request(bundle_id)
+        return self._entries.get(bundle_id, [])
+
+    def _request(self, bundle_id):
+        self._pending_bundles.add(bundle_id)
+        if self._batch_sid is None:
+            self._batch_sid = GObject.timeout_add(self._BATCH_DELAY,
+                                                  self.__batch_timeout_cb)
+
+    def __batch_timeout_cb(self):
+        self._batch_sid = None
+        bundle_ids = list(self._pending_bundles)
+        self._pending_bundles = set()
+        self._find(bundle_ids, 1)
+        return False
+
+    def _find(self, bundle_ids, attempt):
+        if attempt > self._MAX_BATCHED_QUERIES:
+            for bundle_id in bundle_ids:
+                self._find([bundle_id], 1)
+            return
+
+        logging.debug('ResumeEntries._find %d bundles', len(bundle_ids))
+        query = {'activity': bundle_ids}
+        datastore.find(query, sorting=['+timestamp'],
+                       limit=self.MAX_ENTRIES * len(bundle_ids),
+                       properties=self._PROPERTIES,
+                       reply_handler=partial(self.__find_reply_handler_cb,
+                                             bundle_ids, attempt),
+                       error_handler=self.__find_error_handler_cb)
+
+    def __find_reply_handler_cb(self, bundle_ids, attempt, entries,
+                                total_count):
+        found = dict([(bundle_id, []) for bundle_id in bundle_ids])
+        for entry in entries:
+            # If there's a problem with the DS index, we may get entries not
+            # related to the requested activities.
+            bundle_entries = found.get(entry.get('activity'))
+            if bundle_entries is not None and \
+                    len(bundle_entries) < self.MAX_ENTRIES:
+                bundle_entries.append(entry)
+
+        # When the limit was hit, busy activities may have crowded out the
+        # entries of the others, so ask again for those.
+        starved_bundle_ids = []
+        for bundle_id, bundle_entries in found.iteritems():
+            if total_count > len(entries) and \
+                    len(bundle_entries) < self.MAX_ENTRIES:
+                starved_bundle_ids.append(bundle_id)
+            else:
+                self._set_entries(bundle_id, bundle_entries)
+
+        if starved_bundle_ids:
+            self._find(starved_bundle_ids, attempt + 1)
+
+    def __find_error_handler_cb(self, error):
+        logging.error('Error retrieving most recent activities: %r', error)
+
+    def _set_entries(self, bundle_id, entries):
+        self._entries[bundle_id] = entries
+        self.changed.send(self, bundle_id=bundle_id, entries=entries)
+
+    def _remove_entry(self, object_id):
+        for bundle_id, entries in self._entries.items():
+            for entry in entries:
+                if entry['uid'] == object_id:
+                    entries = [e for e in entries if e['uid'] != object_id]
+                    self._set_entries(bundle_id, entries)
+                    return bundle_id
+        return None
+
+    def __datastore_updated_cb(self, **kwargs):
+        metadata = kwargs['metadata']
+        self._remove_entry(kwargs['object_id'])
+
+        bundle_id = metadata.get('activity', '')
+        if bundle_id not in self._entries:
+            return
+
+        entry = dict([(key, metadata[key]) for key in self._PROPERTIES
+                      if key in metadata])
+        entry['uid'] = kwargs['object_id']
+        entries = self._entries[bundle_id] + [entry]
+        entries.sort(key=_get_timestamp, reverse=True)
+        self._set_entries(bundle_id, entries[:self.MAX_ENTRIES])
+
+    def __datastore_deleted_cb(self, **kwargs):
+        bundle_id = self._remove_entry(kwargs['object_id'])
+        if bundle_id is not None:
+            # an older entry may now make it into the most recent ones
+            self._request(bundle_id)
+
+
+def _get_timestamp(entry):
+    try:
+        return float(entry.get('timestamp', 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+_resume_entries = None
+
+
+def get_resume_entries():
+    global _resume_entries
+    if _resume_entries is None:
+        _resume_entries = ResumeEntries()
+    return _resume_entries
@@ -16,6 +16,7 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import random
+from collections import deque
 
 from gi.repository import GObject
 from gi.repository import Gdk
@@ -28,6 +29,10 @@ _MAX_WEIGHT = 255
 _REFRESH_RATE = 200
 _MAX_COLLISIONS_PER_REFRESH = 20
 
+# Side, in grid cells, of the buckets children are hashed into to find the
+# ones that may collide with a given child; about the size of an icon
+_BUCKET_SIZE = 16
+
 
 class Grid(SugarExt.Grid):
     __gsignals__ = {
@@ -41,9 +46,13 @@ class Grid(SugarExt.Grid):
         self._children = []
         self._child_rects = {}
         self._locked_children = set()
-        self._collisions = []
+        self._collisions = deque()
+        self._collision_set = set()
         self._collisions_sid = 0
 
+        # (column, row) of a bucket -> children whose rect overlaps it
+        self._buckets = {}
+
         self.setup(width, height)
 
     def add(self, child, width, height, x=None, y=None, locked=False):
@@ -71,6 +80,7 @@ class Grid(SugarExt.Grid):
 
         self._child_rects[child] = rect
         self._children.append(child)
+        self._index_child(child)
         self.add_weight(self._child_rects[child])
         if locked:
             self._locked_children.add(child)
@@ -83,14 +93,17 @@ class Grid(SugarExt.Grid):
 
     def remove(self, child):
         self._children.remove(child)
+        self._unindex_child(child)
         self.remove_weight(self._child_rects[child])
         self._locked_children.discard(child)
         del self._child_rects[child]
 
-        if child in self._collisions:
+        if child in self._collision_set:
             self._collisions.remove(child)
+            self._collision_set.remove(child)
 
     def move(self, child, x, y, locked=False):
+        self._unindex_child(child)
         self.remove_weight(self._child_rects[child])
 
         rect = self._child_rects[child]
@@ -99,6 +112,7 @@ class Grid(SugarExt.Grid):
 
         weight = self.compute_weight(rect)
         self.add_weight(self._child_rects[child])
+        self._index_child(child)
 
         if locked:
             self._locked_children.add(child)
@@ -108,6 +122,30 @@ class Grid(SugarExt.Grid):
         if weight > 0:
             self._detect_collisions(child)
 
+    def _get_buckets(self, rect):
+        for column in range(rect.x / _BUCKET_SIZE,
+                            (rect.x + rect.width - 1) / _BUCKET_SIZE + 1):
+            for row in range(rect.y / _BUCKET_SIZE,
+                             (rect.y + rect.height - 1) / _BUCKET_SIZE + 1):
+                yield column, row
+
+    def _index_child(self, child):
+        for bucket in self._get_buckets(self._child_rects[child]):
+            self._buckets.setdefault(bucket, set()).add(child)
+
+    def _unindex_child(self, child):
+        for bucket in self._get_buckets(self._child_rects[child]):
+            children = self._buckets.get(bucket)
+            if children is not None:
+                children.discard(child)
+                if not children:
+                    del self._buckets[bucket]
+
+    def _add_collision(self, child):
+        if child not in self._collision_set:
+            self._collisions.append(child)
+            self._collision_set.add(child)
+
     def _shift_child(self, child, weight):
         rect = self._child_rects[child]
 
@@ -169,15 +207,31 @@ class Grid(SugarExt.Grid):
 
         return weight
 
-    def __solve_collisions_cb(self):
+    def is_stable(self):
+        """Return whether no child is waiting for a better position"""
+        return not self._collisions
+
+    def solve_collisions(self):
+        """Move some of the colliding children to a better position
+
+        This is done periodically while there are collisions. Returns
+        whether collisions are left.
+
+        """
         for i_ in range(_MAX_COLLISIONS_PER_REFRESH):
-            collision = self._collisions.pop(0)
+            if not self._collisions:
+                break
+
+            collision = self._collisions.popleft()
+            self._collision_set.remove(collision)
 
             old_rect = self._child_rects[collision]
+            self._unindex_child(collision)
             self.remove_weight(old_rect)
             weight = self.compute_weight(old_rect)
             weight = self._shift_child(collision, weight)
             self.add_weight(self._child_rects[collision])
+            self._index_child(collision)
 
             # TODO: we shouldn't give up the first time we failed to find a
             # better position.
@@ -185,29 +239,36 @@ class Grid(SugarExt.Grid):
                 self._detect_collisions(collision)
                 self.emit('child-changed', collision)
                 if weight > 0:
-                    self._collisions.append(collision)
+                    self._add_collision(collision)
 
-            if not self._collisions:
-                self._collisions_sid = 0
-                return False
+        return bool(self._collisions)
 
-        return True
+    def __solve_collisions_cb(self):
+        if self.solve_collisions():
+            return True
+        self._collisions_sid = 0
+        return False
 
     def _detect_collisions(self, child):
         collision_found = False
         child_rect = self._child_rects[child]
-        for c in self._children:
+
+        # Only the children sharing a bucket with this one can overlap it
+        candidates = set()
+        for bucket in self._get_buckets(child_rect):
+            candidates.update(self._buckets.get(bucket, ()))
+        candidates.discard(child)
+
+        for c in candidates:
             intersects_, intersection = Gdk.rectangle_intersect(
                 child_rect, self._child_rects[c])
-            if c != child and intersection.width > 0:
+            if intersection.width > 0:
                 collision_found = True
-                if (c not in self._locked_children and
-                    c not in self._collisions):
-                    self._collisions.append(c)
+                if c not in self._locked_children:
+                    self._add_collision(c)
 
         if collision_found:
-            if child not in self._collisions:
-                self._collisions.append(child)
+            self._add_collision(child)
 
         if self._collisions and not self._collisions_sid:
             self._collisions_sid = GObject.timeout_add(_REFRESH_RATE,
@@ -19,6 +19,7 @@
 
 from gettext import gettext as _
 import logging
+from functools import partial
 
 import dbus
 from gi.repository import GLib
@@ -52,6 +53,13 @@ from jarabe.journal import misc
 
 _FILTERED_ALPHA = 0.33
 
+# Buddy and activity icons updated per main loop iteration
+_ICONS_PER_BATCH = 50
+
+# Delay, in milliseconds, the signal strength changes of the access points
+# of a network are accumulated for before its icon is updated
+_STRENGTH_UPDATE_DELAY = 300
+
 
 class _ActivityIcon(CanvasIcon):
     def __init__(self, model, file_name, xo_color,
@@ -160,61 +168,6 @@ class ActivityView(SnowflakeLayout):
                 icon.set_filter(query)
 
 
-class DeviceObserver(GObject.GObject):
-    __gsignals__ = {
-        'access-point-added': (GObject.SignalFlags.RUN_FIRST, None,
-                               ([GObject.TYPE_PYOBJECT])),
-        'access-point-removed': (GObject.SignalFlags.RUN_FIRST, None,
-                                 ([GObject.TYPE_PYOBJECT])),
-    }
-
-    def __init__(self, device):
-        GObject.GObject.__init__(self)
-        self._bus = dbus.SystemBus()
-        self.device = device
-
-        wireless = dbus.Interface(device, network.NM_WIRELESS_IFACE)
-        wireless.GetAccessPoints(
-            reply_handler=self._get_access_points_reply_cb,
-            error_handler=self._get_access_points_error_cb)
-
-        self._bus.add_signal_receiver(self.__access_point_added_cb,
-                                      signal_name='AccessPointAdded',
-                                      path=device.object_path,
-                                      dbus_interface=network.NM_WIRELESS_IFACE)
-        self._bus.add_signal_receiver(self.__access_point_removed_cb,
-                                      signal_name='AccessPointRemoved',
-                                      path=device.object_path,
-                                      dbus_interface=network.NM_WIRELESS_IFACE)
-
-    def _get_access_points_reply_cb(self, access_points_o):
-        for ap_o in access_points_o:
-            ap = self._bus.get_object(network.NM_SERVICE, ap_o)
-            self.emit('access-point-added', ap)
-
-    def _get_access_points_error_cb(self, err):
-        logging.error('Failed to get access points: %s', err)
-
-    def __access_point_added_cb(self, access_point_o):
-        ap = self._bus.get_object(network.NM_SERVICE, access_point_o)
-        self.emit('access-point-added', ap)
-
-    def __access_point_removed_cb(self, access_point_o):
-        self.emit('access-point-removed', access_point_o)
-
-    def disconnect(self):
-        self._bus.remove_signal_receiver(
-            self.__access_point_added_cb,
-            signal_name='AccessPointAdded',
-            path=self.device.object_path,
-            dbus_interface=network.NM_WIRELESS_IFACE)
-        self._bus.remove_signal_receiver(
-            self.__access_point_removed_cb,
-            signal_name='AccessPointRemoved',
-            path=self.device.object_path,
-            dbus_interface=network.NM_WIRELESS_IFACE)
-
-
 class NetworkManagerObserver(object):
 
     _SHOW_ADHOC_GCONF_KEY = '/desktop/sugar/network/adhoc'
@@ -222,8 +175,8 @@ class NetworkManagerObserver(object):
     def __init__(self, box):
         self._box = box
         self._bus = None
+        self._state = None
         self._devices = {}
-        self._netmgr = None
         self._olpc_mesh_device_o = None
 
         client = GConf.Client.get_default()
@@ -232,92 +185,73 @@ class NetworkManagerObserver(object):
     def listen(self):
         try:
             self._bus = dbus.SystemBus()
-            self._netmgr = network.get_manager()
         except dbus.DBusException:
             logging.debug('NetworkManager not available')
             return
 
-        self._netmgr.GetDevices(reply_handler=self.__get_devices_reply_cb,
-                                error_handler=self.__get_devices_error_cb)
+        self._state = network.get_manager_state()
+        self._state.connect('device-added', self.__device_added_cb)
+        self._state.connect('device-removed', self.__device_removed_cb)
+        self._state.connect('access-point-added', self.__ap_added_cb)
+        self._state.connect('access-point-removed', self.__ap_removed_cb)
+        self._state.connect('properties-changed',
+                            self.__properties_changed_cb)
 
-        self._bus.add_signal_receiver(self.__device_added_cb,
-                                      signal_name='DeviceAdded',
-                                      dbus_interface=network.NM_IFACE)
-        self._bus.add_signal_receiver(self.__device_removed_cb,
-                                      signal_name='DeviceRemoved',
-                                      dbus_interface=network.NM_IFACE)
-        self._bus.add_signal_receiver(self.__properties_changed_cb,
-                                      signal_name='PropertiesChanged',
-                                      dbus_interface=network.NM_IFACE)
+        for device_o in self._state.get_devices():
+            self._check_device(device_o)
 
         secret_agent = network.get_secret_agent()
         if secret_agent is not None:
             secret_agent.secrets_request.connect(self.__secrets_request_cb)
 
     def __secrets_request_cb(self, **kwargs):
-        # FIXME It would be better to do all of this async, but I cannot think
-        # of a good way to. NM could really use some love here.
-
-        netmgr_props = dbus.Interface(self._netmgr, dbus.PROPERTIES_IFACE)
-        active_connections_o = netmgr_props.Get(network.NM_IFACE,
-                                                'ActiveConnections')
-
-        for conn_o in active_connections_o:
-            obj = self._bus.get_object(network.NM_IFACE, conn_o)
-            props = dbus.Interface(obj, dbus.PROPERTIES_IFACE)
-            state = props.Get(network.NM_ACTIVE_CONN_IFACE, 'State')
+        for conn_o in self._state.get_active_connections():
+            state = self._state.get_property(conn_o,
+                                             network.NM_ACTIVE_CONN_IFACE,
+                                             'State')
             if state == network.NM_ACTIVE_CONNECTION_STATE_ACTIVATING:
-                ap_o = props.Get(network.NM_ACTIVE_CONN_IFACE,
-                                 'SpecificObject')
-                found = False
+                ap_o = self._state.get_property(conn_o,
+                                                network.NM_ACTIVE_CONN_IFACE,
+                                                'SpecificObject')
+                net = None
                 if ap_o != '/':
-                    for net in self._box.wireless_networks.values():
-                        if net.find_ap(ap_o) is not None:
-                            found = True
-                            net.create_keydialog(kwargs['response'])
-                if not found:
+                    net = self._box.get_network_of_access_point(ap_o)
+                if net is not None:
+                    net.create_keydialog(kwargs['response'])
+                else:
                     raise Exception(
                         'Could not determine AP for specific object'
                         ' %s' % conn_o)
 
-    def __get_devices_reply_cb(self, devices_o):
-        for dev_o in devices_o:
-            self._check_device(dev_o)
-
-    def __get_devices_error_cb(self, err):
-        logging.error('Failed to get devices: %s', err)
-
     def _check_device(self, device_o):
-        device = self._bus.get_object(network.NM_SERVICE, device_o)
-        props = dbus.Interface(device, dbus.PROPERTIES_IFACE)
-
-        device_type = props.Get(network.NM_DEVICE_IFACE, 'DeviceType')
+        device_type = self._state.get_device_type(device_o)
         if device_type == network.NM_DEVICE_TYPE_WIFI:
             if device_o in self._devices:
                 return
-            self._devices[device_o] = DeviceObserver(device)
-            self._devices[device_o].connect('access-point-added',
-                                            self.__ap_added_cb)
-            self._devices[device_o].connect('access-point-removed',
-                                            self.__ap_removed_cb)
+            device = self._bus.get_object(network.NM_SERVICE, device_o)
+            self._devices[device_o] = device
+            # the Ad-hoc manager has to know about the device before the
+            # access points are added, to pick out the Ad-hoc networks
             if self._have_adhoc_networks:
                 self._box.add_adhoc_networks(device)
+            for ap_o in self._state.get_access_points(device_o):
+                self._add_access_point(device, ap_o)
         elif device_type == network.NM_DEVICE_TYPE_OLPC_MESH:
             if device_o == self._olpc_mesh_device_o:
                 return
             self._olpc_mesh_device_o = device_o
+            device = self._bus.get_object(network.NM_SERVICE, device_o)
             self._box.enable_olpc_mesh(device)
 
-    def _get_device_path_error_cb(self, err):
-        logging.error('Failed to get device type: %s', err)
+    def _add_access_point(self, device, ap_o):
+        ap = self._bus.get_object(network.NM_SERVICE, ap_o)
+        self._box.add_access_point(device, ap)
 
-    def __device_added_cb(self, device_o):
+    def __device_added_cb(self, state, device_o):
         self._check_device(device_o)
 
-    def __device_removed_cb(self, device_o):
+    def __device_removed_cb(self, state, device_o):
         if device_o in self._devices:
-            observer = self._devices[device_o]
-            observer.disconnect()
             del self._devices[device_o]
             if self._have_adhoc_networks:
                 self._box.remove_adhoc_networks()
@@ -327,19 +261,28 @@ class NetworkManagerObserver(object):
             self._box.disable_olpc_mesh(device_o)
             self._olpc_mesh_device_o = None
 
-    def __ap_added_cb(self, device_observer, access_point):
-        self._box.add_access_point(device_observer.device, access_point)
+    def __ap_added_cb(self, state, device_o, ap_o):
+        if device_o in self._devices:
+            self._add_access_point(self._devices[device_o], ap_o)
+
+    def __ap_removed_cb(self, state, device_o, ap_o):
+        if device_o in self._devices:
+            self._box.remove_access_point(ap_o)
 
-    def __ap_removed_cb(self, device_observer, access_point_o):
-        self._box.remove_access_point(access_point_o)
+    def __properties_changed_cb(self, state, path, interface, properties):
+        if interface == network.NM_ACCESSPOINT_IFACE:
+            self._box.update_access_point(path, properties)
+            return
+
+        if path != network.NM_PATH or interface != network.NM_IFACE:
+            return
 
-    def __properties_changed_cb(self, properties):
         if 'WirelessHardwareEnabled' in properties:
             if properties['WirelessHardwareEnabled']:
                 if not self._have_adhoc_networks:
                     self._box.remove_adhoc_networks()
             elif properties['WirelessHardwareEnabled']:
-                for device in self._devices:
+                for device in self._devices.values():
                     if self._have_adhoc_networks:
                         self._box.add_adhoc_networks(device)
 
@@ -358,17 +301,34 @@ class MeshBox(ViewContainer):
         ViewContainer.__init__(self, layout, owner_icon)
 
         self.wireless_networks = {}
+        # object path -> (AccessPoint, hash of the network it was added to,
+        # or None if it is not shown in any network)
+        self._access_points = {}
+        self._networks_to_update = set()
+        self._update_strength_sid = None
         self._adhoc_manager = None
         self._adhoc_networks = []
 
         self._model = neighborhood.get_model()
+        # Models of the buddies and activities to show, by key and id, and
+        # their icons once created. Icons are only created while the view
+        # is shown and only those matching the search query are placed
+        # in the view, so that the grid does not lay out the others.
+        self._buddy_models = {}
         self._buddies = {}
+        self._activity_models = {}
         self._activities = {}
         self._mesh = []
         self._buddy_to_activity = {}
         self._suspended = True
         self._query = ''
 
+        # Keys of the buddies and ids of the activities whose icon may
+        # have to be created, placed or taken out of the view
+        self._buddies_to_update = set()
+        self._activities_to_update = set()
+        self._update_icons_sid = None
+
         toolbar.connect('query-changed', self._toolbar_query_changed_cb)
         toolbar.search_entry.connect('icon-press',
                                      self.__clear_icon_pressed_cb)
@@ -403,53 +363,123 @@ class MeshBox(ViewContainer):
     def _add_buddy(self, buddy_model):
         buddy_model.connect('notify::current-activity',
                             self.__buddy_notify_current_activity_cb)
+        self._show_buddy(buddy_model)
+
+    def _show_buddy(self, buddy_model):
         if buddy_model.props.current_activity is not None:
             return
         if buddy_model.is_owner():
             return
-        icon = BuddyIcon(buddy_model)
-        self.add(icon)
-        icon.show()
 
-        if hasattr(icon, 'set_filter'):
-            icon.set_filter(self._query)
+        key = buddy_model.props.key
+        self._buddy_models[key] = buddy_model
+        self._queue_icons_update([key], [])
 
-        self._buddies[buddy_model.props.key] = icon
+    def _has_buddy(self, buddy_model):
+        return buddy_model.props.key in self._buddy_models
 
     def _remove_buddy(self, buddy_model):
         logging.debug('MeshBox._remove_buddy')
-        icon = self._buddies[buddy_model.props.key]
-        self.remove(icon)
-        del self._buddies[buddy_model.props.key]
+        key = buddy_model.props.key
+        # Buddies in an activity are not shown on their own
+        self._buddy_models.pop(key, None)
+        self._buddies_to_update.discard(key)
+
+        icon = self._buddies.pop(key, None)
+        if icon is not None and icon.get_parent() is not None:
+            self.remove(icon)
 
     def __buddy_notify_current_activity_cb(self, buddy_model, pspec):
         logging.debug('MeshBox.__buddy_notify_current_activity_cb %s',
                       buddy_model.props.current_activity)
         if buddy_model.props.current_activity is None:
-            if not buddy_model.props.key in self._buddies:
-                self._add_buddy(buddy_model)
-        elif buddy_model.props.key in self._buddies:
+            if not self._has_buddy(buddy_model):
+                self._show_buddy(buddy_model)
+        elif self._has_buddy(buddy_model):
             self._remove_buddy(buddy_model)
 
     def _add_activity(self, activity_model):
-        icon = ActivityView(activity_model)
-        self.add(icon)
-        icon.show()
+        activity_id = activity_model.activity_id
+        self._activity_models[activity_id] = activity_model
+        self._queue_icons_update([], [activity_id])
 
-        if hasattr(icon, 'set_filter'):
-            icon.set_filter(self._query)
+    def _remove_activity(self, activity_model):
+        activity_id = activity_model.activity_id
+        del self._activity_models[activity_id]
+        self._activities_to_update.discard(activity_id)
 
-        self._activities[activity_model.activity_id] = icon
+        icon = self._activities.pop(activity_id, None)
+        if icon is not None and icon.get_parent() is not None:
+            self.remove(icon)
 
-    def _remove_activity(self, activity_model):
-        icon = self._activities[activity_model.activity_id]
-        self.remove(icon)
-        del self._activities[activity_model.activity_id]
+    def _buddy_matches(self, buddy_model):
+        normalized_name = normalize_string(
+            buddy_model.get_nick().decode('utf-8'))
+        return normalized_name.find(self._query) != -1
+
+    def _activity_matches(self, activity_model):
+        # Shown if any of its participants matches, like it was dimmed
+        text_to_check = activity_model.bundle.get_name().lower() + \
+                activity_model.bundle.get_bundle_id().lower()
+        if text_to_check.find(self._query) != -1:
+            return True
+        for buddy_model in activity_model.props.current_buddies:
+            if self._buddy_matches(buddy_model):
+                return True
+        return False
+
+    def _queue_icons_update(self, buddy_keys, activity_ids):
+        self._buddies_to_update.update(buddy_keys)
+        self._activities_to_update.update(activity_ids)
+        if not self._suspended and self._update_icons_sid is None:
+            self._update_icons_sid = GObject.idle_add(
+                self.__update_icons_cb)
+
+    def __update_icons_cb(self):
+        if self._suspended:
+            self._update_icons_sid = None
+            return False
+
+        for i_ in range(_ICONS_PER_BATCH):
+            if self._activities_to_update:
+                activity_id = self._activities_to_update.pop()
+                activity_model = self._activity_models[activity_id]
+                self._update_icon(self._activities, activity_id,
+                                  self._activity_matches(activity_model),
+                                  partial(ActivityView, activity_model))
+            elif self._buddies_to_update:
+                key = self._buddies_to_update.pop()
+                buddy_model = self._buddy_models[key]
+                self._update_icon(self._buddies, key,
+                                  self._buddy_matches(buddy_model),
+                                  partial(BuddyIcon, buddy_model))
+            else:
+                self._update_icons_sid = None
+                return False
+
+        return True
+
+    def _update_icon(self, icons, key, visible, create_icon):
+        icon = icons.get(key)
+        if not visible:
+            # Kept out of the view and the grid until it matches again
+            if icon is not None and icon.get_parent() is not None:
+                self.remove(icon)
+            return
+
+        if icon is None:
+            icon = create_icon()
+            icons[key] = icon
+        if icon.get_parent() is None:
+            self.add(icon)
+            icon.show()
+        icon.set_filter(self._query)
 
     # add AP to its corresponding network icon on the desktop,
     # creating one if it doesn't already exist
     def _add_ap_to_network(self, ap):
         hash_value = ap.network_hash()
+        self._access_points[ap.model.object_path] = (ap, hash_value)
         if hash_value in self.wireless_networks:
             self.wireless_networks[hash_value].add_ap(ap)
         else:
@@ -467,6 +497,21 @@ class MeshBox(ViewContainer):
             net.disconnect()
             self.remove(net)
             del self.wireless_networks[hash_value]
+            self._networks_to_update.discard(hash_value)
+
+    def _queue_strength_update(self, hash_value):
+        self._networks_to_update.add(hash_value)
+        if self._update_strength_sid is None:
+            self._update_strength_sid = GObject.timeout_add(
+                _STRENGTH_UPDATE_DELAY, self.__update_strength_cb)
+
+    def __update_strength_cb(self):
+        self._update_strength_sid = None
+        for hash_value in self._networks_to_update:
+            if hash_value in self.wireless_networks:
+                self.wireless_networks[hash_value].update_strength()
+        self._networks_to_update = set()
+        return False
 
     def _ap_props_changed_cb(self, ap, old_hash_value):
         # if we have mesh hardware, ignore OLPC mesh networks that appear as
@@ -474,7 +519,7 @@ class MeshBox(ViewContainer):
         if len(self._mesh) > 0 and ap.mode == network.NM_802_11_MODE_ADHOC \
                 and ap.ssid == 'olpc-mesh':
             logging.debug('ignoring OLPC mesh IBSS')
-            ap.disconnect()
+            self._access_points.pop(ap.model.object_path, None)
             return
 
         if self._adhoc_manager is not None and \
@@ -495,7 +540,7 @@ class MeshBox(ViewContainer):
         hash_value = ap.network_hash()
         if old_hash_value == hash_value:
             # no change in network identity, so just update signal strengths
-            self.wireless_networks[hash_value].update_strength()
+            self._queue_strength_update(hash_value)
             return
 
         # properties change includes a change of the identity of the network
@@ -507,6 +552,7 @@ class MeshBox(ViewContainer):
 
     def add_access_point(self, device, ap_o):
         ap = AccessPoint(device, ap_o)
+        self._access_points[ap_o.object_path] = (ap, None)
         ap.connect('props-changed', self._ap_props_changed_cb)
         ap.initialize()
 
@@ -514,23 +560,32 @@ class MeshBox(ViewContainer):
         if self._adhoc_manager is not None:
             if self._adhoc_manager.is_sugar_adhoc_access_point(ap_o):
                 self._adhoc_manager.remove_access_point(ap_o)
+                self._access_points.pop(ap_o, None)
                 return
 
-        # we don't keep an index of ap object path to network, but since
-        # we'll only ever have a handful of networks, just try them all...
-        for net in self.wireless_networks.values():
-            ap = net.find_ap(ap_o)
-            if not ap:
-                continue
+        if ap_o not in self._access_points:
+            # it's not an error if the AP isn't found, since we might have
+            # ignored it (e.g. olpc-mesh adhoc network)
+            logging.debug('Can not remove access point %s', ap_o)
+            return
 
-            ap.disconnect()
+        ap, hash_value = self._access_points.pop(ap_o)
+        if hash_value in self.wireless_networks:
+            net = self.wireless_networks[hash_value]
             net.remove_ap(ap)
-            self._remove_net_if_empty(net, ap.network_hash())
-            return
+            self._remove_net_if_empty(net, hash_value)
+
+    def update_access_point(self, ap_o, properties):
+        if ap_o in self._access_points:
+            ap, hash_value_ = self._access_points[ap_o]
+            ap.update_properties(properties)
 
-        # it's not an error if the AP isn't found, since we might have ignored
-        # it (e.g. olpc-mesh adhoc network)
-        logging.debug('Can not remove access point %s', ap_o)
+    def get_network_of_access_point(self, ap_o):
+        """Return the network view showing an access point, if any"""
+        if ap_o not in self._access_points:
+            return None
+        ap_, hash_value = self._access_points[ap_o]
+        return self.wireless_networks.get(hash_value)
 
     def add_adhoc_networks(self, device):
         if self._adhoc_manager is None:
@@ -567,7 +622,7 @@ class MeshBox(ViewContainer):
 
         # the OLPC mesh can be recognised as a "normal" wifi network. remove
         # any such normal networks if they have been created
-        for hash_value, net in self.wireless_networks.iteritems():
+        for hash_value, net in self.wireless_networks.items():
             if not net.is_olpc_mesh():
                 continue
 
@@ -576,6 +631,11 @@ class MeshBox(ViewContainer):
             net.disconnect()
             self.remove(net)
             del self.wireless_networks[hash_value]
+            self._networks_to_update.discard(hash_value)
+
+            for ap_o, (ap_, ap_hash_value) in self._access_points.items():
+                if ap_hash_value == hash_value:
+                    del self._access_points[ap_o]
 
     def disable_olpc_mesh(self, mesh_device):
         for icon in self._mesh:
@@ -595,11 +655,15 @@ class MeshBox(ViewContainer):
             for net in self.wireless_networks.values() + self._mesh:
                 net.props.paused = False
 
+            self._queue_icons_update([], [])
+
     def _toolbar_query_changed_cb(self, toolbar, query):
         self._query = normalize_string(query.decode('utf-8'))
         for icon in self.get_children():
             if hasattr(icon, 'set_filter'):
                 icon.set_filter(self._query)
+        self._queue_icons_update(self._buddy_models.keys(),
+                                 self._activity_models.keys())
 
     def __clear_icon_pressed_cb(self, entry, icon_pos, event):
         self.grab_focus()
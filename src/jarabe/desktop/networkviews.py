@@ -55,7 +55,6 @@ class WirelessNetworkView(EventPulsingIcon):
     def __init__(self, initial_ap):
         EventPulsingIcon.__init__(self, pixel_size=style.STANDARD_ICON_SIZE,
                                   cache=True)
-        self._bus = dbus.SystemBus()
         self._access_points = {initial_ap.model.object_path: initial_ap}
         self._active_ap = None
         self._device = initial_ap.device
@@ -98,22 +97,23 @@ class WirelessNetworkView(EventPulsingIcon):
         self._palette_icon.props.xo_color = self._color
         self._update_badge()
 
-        interface_props = dbus.Interface(self._device, dbus.PROPERTIES_IFACE)
-        interface_props.Get(network.NM_WIRELESS_IFACE, 'WirelessCapabilities',
-                            reply_handler=self.__get_device_caps_reply_cb,
-                            error_handler=self.__get_device_caps_error_cb)
-        interface_props.Get(network.NM_WIRELESS_IFACE, 'ActiveAccessPoint',
-                            reply_handler=self.__get_active_ap_reply_cb,
-                            error_handler=self.__get_active_ap_error_cb)
-
-        self._bus.add_signal_receiver(self.__device_state_changed_cb,
-                                      signal_name='StateChanged',
-                                      path=self._device.object_path,
-                                      dbus_interface=network.NM_DEVICE_IFACE)
-        self._bus.add_signal_receiver(self.__wireless_properties_changed_cb,
-                                      signal_name='PropertiesChanged',
-                                      path=self._device.object_path,
-                                      dbus_interface=network.NM_WIRELESS_IFACE)
+        self._state = network.get_manager_state()
+        self._state_changed_sid = self._state.connect(
+            'device-state-changed', self.__device_state_changed_cb)
+        self._properties_changed_sid = self._state.connect(
+            'properties-changed', self.__properties_changed_cb)
+
+        device_o = self._device.object_path
+        self._device_caps = self._state.get_property(
+            device_o, network.NM_WIRELESS_IFACE, 'WirelessCapabilities', 0)
+        self.__update_active_ap(self._state.get_property(
+            device_o, network.NM_WIRELESS_IFACE, 'ActiveAccessPoint', '/'))
+        self._device_state = self._state.get_property(
+            device_o, network.NM_DEVICE_IFACE, 'State')
+        self._update_state()
+        self._update_color()
+        self._update_icon()
+        self._update_badge()
 
     def _create_palette(self):
         icon_name = get_icon_state(_AP_ICON_NAME, self._strength)
@@ -145,7 +145,10 @@ class WirelessNetworkView(EventPulsingIcon):
 
         return p
 
-    def __device_state_changed_cb(self, new_state, old_state, reason):
+    def __device_state_changed_cb(self, state, device_o, new_state, old_state,
+                                  reason):
+        if device_o != self._device.object_path:
+            return
         self._device_state = new_state
         self._update_state()
         self._update_icon()
@@ -163,36 +166,13 @@ class WirelessNetworkView(EventPulsingIcon):
             self._active_ap = None
             self.update_strength()
 
-    def __wireless_properties_changed_cb(self, properties):
+    def __properties_changed_cb(self, state, path, interface, properties):
+        if path != self._device.object_path or \
+                interface != network.NM_WIRELESS_IFACE:
+            return
         if 'ActiveAccessPoint' in properties:
             self.__update_active_ap(properties['ActiveAccessPoint'])
 
-    def __get_active_ap_reply_cb(self, ap_path):
-        self.__update_active_ap(ap_path)
-        interface_props = dbus.Interface(self._device, dbus.PROPERTIES_IFACE)
-        interface_props.Get(network.NM_DEVICE_IFACE, 'State',
-                            reply_handler=self.__get_device_state_reply_cb,
-                            error_handler=self.__get_device_state_error_cb)
-
-    def __get_active_ap_error_cb(self, err):
-        logging.error('Error getting the active access point: %s', err)
-
-    def __get_device_caps_reply_cb(self, caps):
-        self._device_caps = caps
-
-    def __get_device_caps_error_cb(self, err):
-        logging.error('Error getting the wireless device properties: %s', err)
-
-    def __get_device_state_reply_cb(self, state):
-        self._device_state = state
-        self._update_state()
-        self._update_color()
-        self._update_icon()
-        self._update_badge()
-
-    def __get_device_state_error_cb(self, err):
-        logging.error('Error getting the device state: %s', err)
-
     def _update_icon(self):
         if self._mode == network.NM_802_11_MODE_ADHOC and \
                 network.is_sugar_adhoc_network(self._ssid):
@@ -429,21 +409,13 @@ class WirelessNetworkView(EventPulsingIcon):
             and self._ssid == 'olpc-mesh'
 
     def remove_all_aps(self):
-        for ap in self._access_points.values():
-            ap.disconnect()
         self._access_points = {}
         self._active_ap = None
         self.update_strength()
 
     def disconnect(self):
-        self._bus.remove_signal_receiver(self.__device_state_changed_cb,
-                                         signal_name='StateChanged',
-                                         path=self._device.object_path,
-                                         dbus_interface=network.NM_DEVICE_IFACE)
-        self._bus.remove_signal_receiver(self.__wireless_properties_changed_cb,
-                                         signal_name='PropertiesChanged',
-                                         path=self._device.object_path,
-                                         dbus_interface=network.NM_WIRELESS_IFACE)
+        self._state.disconnect(self._state_changed_sid)
+        self._state.disconnect(self._properties_changed_sid)
 
 
 class SugarAdhocView(EventPulsingIcon):
@@ -596,7 +568,6 @@ class OlpcMeshView(EventPulsingIcon):
         EventPulsingIcon.__init__(self, icon_name=_OLPC_MESH_ICON_NAME,
                                   pixel_size=style.STANDARD_ICON_SIZE,
                                   cache=True)
-        self._bus = dbus.SystemBus()
         self._channel = channel
         self._mesh_mgr = mesh_mgr
         self._disconnect_item = None
@@ -604,24 +575,7 @@ class OlpcMeshView(EventPulsingIcon):
         self._filtered = False
         self._device_state = None
         self._active = False
-        device = mesh_mgr.mesh_device
-
-        interface_props = dbus.Interface(device, dbus.PROPERTIES_IFACE)
-        interface_props.Get(network.NM_DEVICE_IFACE, 'State',
-                            reply_handler=self.__get_device_state_reply_cb,
-                            error_handler=self.__get_device_state_error_cb)
-        interface_props.Get(network.NM_OLPC_MESH_IFACE, 'ActiveChannel',
-                            reply_handler=self.__get_active_channel_reply_cb,
-                            error_handler=self.__get_active_channel_error_cb)
-
-        self._bus.add_signal_receiver(self.__device_state_changed_cb,
-                                      signal_name='StateChanged',
-                                      path=device.object_path,
-                                      dbus_interface=network.NM_DEVICE_IFACE)
-        self._bus.add_signal_receiver(self.__wireless_properties_changed_cb,
-                                      signal_name='PropertiesChanged',
-                                      path=device.object_path,
-                                      dbus_interface=network.NM_OLPC_MESH_IFACE)
+        self._device_o = mesh_mgr.mesh_device.object_path
 
         pulse_color = XoColor('%s,%s' % (style.COLOR_BUTTON_GREY.get_svg(),
                                          style.COLOR_TRANSPARENT.get_svg()))
@@ -631,6 +585,19 @@ class OlpcMeshView(EventPulsingIcon):
         self._palette = self._create_palette()
         self.set_palette(self._palette)
 
+        self._state = network.get_manager_state()
+        self._state_changed_sid = self._state.connect(
+            'device-state-changed', self.__device_state_changed_cb)
+        self._properties_changed_sid = self._state.connect(
+            'properties-changed', self.__properties_changed_cb)
+
+        self._device_state = self._state.get_property(
+            self._device_o, network.NM_DEVICE_IFACE, 'State')
+        channel = self._state.get_property(
+            self._device_o, network.NM_OLPC_MESH_IFACE, 'ActiveChannel')
+        self._active = (channel == self._channel)
+        self._update()
+
     def _create_palette(self):
         text = _('Mesh Network %d') % (self._channel, )
         _palette = palette.Palette(GLib.markup_escape_text(text))
@@ -648,26 +615,18 @@ class OlpcMeshView(EventPulsingIcon):
 
         return _palette
 
-    def __get_device_state_reply_cb(self, state):
-        self._device_state = state
-        self._update()
-
-    def __get_device_state_error_cb(self, err):
-        logging.error('Error getting the device state: %s', err)
-
-    def __device_state_changed_cb(self, new_state, old_state, reason):
+    def __device_state_changed_cb(self, state, device_o, new_state,
+                                  old_state, reason):
+        if device_o != self._device_o:
+            return
         self._device_state = new_state
         self._update()
         self._update_color()
 
-    def __get_active_channel_reply_cb(self, channel):
-        self._active = (channel == self._channel)
-        self._update()
-
-    def __get_active_channel_error_cb(self, err):
-        logging.error('Error getting the active channel: %s', err)
-
-    def __wireless_properties_changed_cb(self, properties):
+    def __properties_changed_cb(self, state, path, interface, properties):
+        if path != self._device_o or \
+                interface != network.NM_OLPC_MESH_IFACE:
+            return
         if 'ActiveChannel' in properties:
             channel = properties['ActiveChannel']
             self._active = (channel == self._channel)
@@ -719,13 +678,5 @@ class OlpcMeshView(EventPulsingIcon):
         self._update_color()
 
     def disconnect(self):
-        device_object_path = self._mesh_mgr.mesh_device.object_path
-
-        self._bus.remove_signal_receiver(self.__device_state_changed_cb,
-                                         signal_name='StateChanged',
-                                         path=device_object_path,
-                                         dbus_interface=network.NM_DEVICE_IFACE)
-        self._bus.remove_signal_receiver(self.__wireless_properties_changed_cb,
-                                         signal_name='PropertiesChanged',
-                                         path=device_object_path,
-                                         dbus_interface=network.NM_OLPC_MESH_IFACE)
+        self._state.disconnect(self._state_changed_sid)
+        self._state.disconnect(self._properties_changed_sid)
@@ -552,8 +552,16 @@ class BaseTransferPalette(Palette):
         transferred = self._format_size(
                 self.file_transfer.props.transferred_bytes)
         total = self._format_size(self.file_transfer.file_size)
-        # TRANS: file transfer, bytes transferred, e.g. 128 of 1024
-        self.progress_label.props.label = _('%s of %s') % (transferred, total)
+        rate = self.file_transfer.props.transfer_rate
+        if rate > 0:
+            # TRANS: file transfer, bytes transferred and transfer rate,
+            # e.g. 128 of 1024 (64KB/s)
+            self.progress_label.props.label = _('%s of %s (%s/s)') % \
+                    (transferred, total, self._format_size(rate))
+        else:
+            # TRANS: file transfer, bytes transferred, e.g. 128 of 1024
+            self.progress_label.props.label = _('%s of %s') % (transferred,
+                                                               total)
 
 
 class IncomingTransferPalette(BaseTransferPalette):
@@ -661,8 +669,9 @@ class IncomingTransferPalette(BaseTransferPalette):
             self.update_progress()
 
         elif self.file_transfer.props.state == filetransfer.FT_STATE_CANCELLED:
-            if self.file_transfer.reason_last_change == \
-                    filetransfer.FT_REASON_REMOTE_STOPPED:
+            if self.file_transfer.reason_last_change in \
+                    [filetransfer.FT_REASON_REMOTE_STOPPED,
+                     filetransfer.FT_REASON_LOCAL_ERROR]:
                 menu_item = PaletteMenuItem(_('Dismiss'))
                 icon = Icon(icon_name='dialog-cancel',
                             icon_size=Gtk.IconSize.MENU)
@@ -677,7 +686,12 @@ class IncomingTransferPalette(BaseTransferPalette):
                 box.append_item(inner_box, vertical_padding=0)
                 inner_box.show()
 
-                text = _('The other participant canceled the file transfer')
+                if self.file_transfer.reason_last_change == \
+                        filetransfer.FT_REASON_LOCAL_ERROR:
+                    text = _('The file transfer failed')
+                else:
+                    text = _('The other participant canceled the file '
+                             'transfer')
                 label = Gtk.Label(label=text)
                 inner_box.add(label)
                 label.show()
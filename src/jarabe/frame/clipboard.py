@@ -16,21 +16,199 @@
 
 import logging
 import os
-import shutil
+import errno
+import fcntl
 import urlparse
 import tempfile
+import threading
+import shutil
+from collections import OrderedDict
+from functools import partial
 
+from gi.repository import GConf
 from gi.repository import GObject
 from gi.repository import Gtk
 from gi.repository import Gdk
 
 from sugar3 import mime
+from sugar3 import env
 
 from jarabe.frame.clipboardobject import ClipboardObject, Format
 
 
 _instance = None
 
+# Bytes copied at once when a file cannot be cloned or linked
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+# ioctl that makes a copy-on-write clone of a file, on btrfs and friends
+_FICLONE = 0x40049409
+
+# Kilobytes of format data kept in memory, the rest is moved to files
+_MEMORY_LIMIT_KEY = '/desktop/sugar/frame/clipboard_memory_limit'
+_DEFAULT_MEMORY_LIMIT = 16 * 1024
+
+# Megabytes the objects can take in memory and on disk together before the
+# least recently used ones are deleted
+_SIZE_LIMIT_KEY = '/desktop/sugar/frame/clipboard_size_limit'
+_DEFAULT_SIZE_LIMIT = 256
+
+# Formats bigger than this are always moved to files, smaller ones only
+# when the memory limit is reached
+_SPILL_SIZE = 1024 * 1024
+
+# Formats smaller than this stay in memory
+_MIN_SPILL_SIZE = 4 * 1024
+
+# Directory of the profile with the copies of the files and the spilled
+# format data, on the same file system as the Journal so that copies can
+# be clones or links
+_DATA_DIR = 'clipboard'
+
+
+def _fetch_from_format(source_format, format_):
+    data = source_format.get_data()
+    if not source_format.is_pending():
+        format_.set_data(data)
+    return data
+
+
+def _get_copy_path(path, data_dir):
+    directory_, file_name = os.path.split(path)
+
+    root, ext = os.path.splitext(file_name)
+    if not ext or ext == '.':
+        mime_type = mime.get_for_file(path)
+        ext = '.' + mime.get_primary_extension(mime_type)
+
+    try:
+        os.makedirs(data_dir)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+    fd, new_file_path = tempfile.mkstemp(ext, root, data_dir)
+    os.close(fd)
+    return new_file_path
+
+
+def _link_file(path, new_file_path):
+    # A hard link is only safe if nobody can change the file in place,
+    # and the owner of a file can always make it writable again
+    stat = os.stat(path)
+    if stat.st_uid != 0 or stat.st_mode & 0222:
+        return False
+    try:
+        os.unlink(new_file_path)
+        os.link(path, new_file_path)
+    except OSError, e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        open(new_file_path, 'w').close()
+        return False
+    return True
+
+
+def _copy_file_data(path, new_file_path, progress_cb):
+    source = open(path, 'rb')
+    try:
+        destination = open(new_file_path, 'wb')
+        try:
+            try:
+                fcntl.ioctl(destination.fileno(), _FICLONE, source.fileno())
+                progress_cb(os.fstat(source.fileno()).st_size)
+                return
+            except IOError:
+                # Not supported by the file system or across file systems
+                pass
+
+            while True:
+                data = source.read(_COPY_CHUNK_SIZE)
+                if not data:
+                    break
+                destination.write(data)
+                progress_cb(len(data))
+        finally:
+            destination.close()
+    finally:
+        source.close()
+
+
+class _FileCopy(object):
+    """Copy the files of the on disk formats of an object
+
+    The copies are made in a worker thread, which tries to clone or link
+    each file before copying its bytes. progress_cb(file_copy, percent) and
+    finished_cb(file_copy, results) are called in the main loop, results
+    being a list of (format, new uri or None) tuples.
+
+    """
+
+    def __init__(self, formats, data_dir, progress_cb, finished_cb):
+        self.cancelled = False
+
+        self._progress_cb = progress_cb
+        self._finished_cb = finished_cb
+        self._bytes_total = 0
+        self._bytes_copied = 0
+        self._percent = 0
+
+        sources = []
+        for format_ in formats:
+            uri = urlparse.urlparse(format_.get_data())
+            sources.append((format_, uri.path))  # pylint: disable=E1101
+
+        thread = threading.Thread(target=self._run,
+                                  args=(sources, data_dir))
+        thread.daemon = True
+        thread.start()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def _run(self, sources, data_dir):
+        """Copy the files, runs in the worker thread"""
+        for format_, path in sources:
+            try:
+                self._bytes_total += os.path.getsize(path)
+            except OSError:
+                pass
+
+        results = []
+        for format_, path in sources:
+            new_file_path = None
+            try:
+                if self.cancelled:
+                    raise IOError(errno.ECANCELED, 'Cancelled')
+                new_file_path = _get_copy_path(path, data_dir)
+                if _link_file(path, new_file_path):
+                    self._add_progress(os.path.getsize(path))
+                else:
+                    _copy_file_data(path, new_file_path, self._add_progress)
+                    os.chmod(new_file_path, 0644)
+            except EnvironmentError:
+                if not self.cancelled:
+                    logging.exception('Clipboard: could not copy %r', path)
+                if new_file_path is not None and \
+                        os.path.exists(new_file_path):
+                    os.remove(new_file_path)
+                results.append((format_, None))
+                continue
+            results.append((format_, 'file://' + new_file_path))
+
+        GObject.idle_add(self._finished_cb, self, results)
+
+    def _add_progress(self, n_bytes):
+        if self.cancelled:
+            raise IOError(errno.ECANCELED, 'Cancelled')
+
+        self._bytes_copied += n_bytes
+        if not self._bytes_total:
+            return
+        percent = min(99, self._bytes_copied * 100 / self._bytes_total)
+        if percent > self._percent:
+            self._percent = percent
+            GObject.idle_add(self._progress_cb, self, percent)
+
 
 class Clipboard(GObject.GObject):
 
@@ -43,13 +221,32 @@ class Clipboard(GObject.GObject):
                         ([long])),
         'object-state-changed': (GObject.SignalFlags.RUN_FIRST, None,
                         ([object])),
+        'usage-changed': (GObject.SignalFlags.RUN_FIRST, None, ([])),
     }
 
     def __init__(self):
         GObject.GObject.__init__(self)
 
-        self._objects = {}
+        # From the least to the most recently used
+        self._objects = OrderedDict()
         self._next_id = 0
+        # Objects whose files are being copied
+        self._file_copies = {}
+        # The object put in the X clipboard, it is never evicted
+        self._active_object_id = None
+        self._max_objects = None
+        self._usage = (0, 0)
+
+        client = GConf.Client.get_default()
+        self._memory_limit = (client.get_int(_MEMORY_LIMIT_KEY) or
+                              _DEFAULT_MEMORY_LIMIT) * 1024
+        self._size_limit = (client.get_int(_SIZE_LIMIT_KEY) or
+                            _DEFAULT_SIZE_LIMIT) * 1024 * 1024
+
+        # Files copied or spilled by a previous session
+        self._data_dir = env.get_profile_path(_DATA_DIR)
+        if os.path.exists(self._data_dir):
+            shutil.rmtree(self._data_dir, ignore_errors=True)
 
     def _get_next_object_id(self):
         self._next_id += 1
@@ -81,29 +278,142 @@ class Clipboard(GObject.GObject):
         self.emit('object-added', self._objects[object_id])
         return object_id
 
-    def add_object_format(self, object_id, format_type, data, on_disk):
+    def add_object_format(self, object_id, format_type, data, on_disk,
+                          fetch_cb=None):
+        """ Add a format to a clipboard object
+
+        A format can be added without its data (None) and a fetch_cb, to
+        be fetched on demand by Format.get_data().
+
+        """
         logging.debug('Clipboard.add_object_format')
         cb_object = self._objects[object_id]
 
-        if on_disk and cb_object.get_percent() == 100:
-            new_uri = self._copy_file(data)
-            cb_object.add_format(Format(format_type, new_uri, on_disk))
-            logging.debug('Added format of type ' + format_type
-                          + ' with path at ' + new_uri)
+        if fetch_cb is not None:
+            cb_object.add_format(Format(format_type, data, on_disk, fetch_cb))
+            logging.debug('Added pending format of type %s.', format_type)
+        elif on_disk and cb_object.get_percent() == 100:
+            cb_object.add_format(Format(format_type, data, on_disk))
+            self._copy_files(cb_object)
+            logging.debug('Copying format of type %s from %s',
+                          format_type, data)
         else:
             cb_object.add_format(Format(format_type, data, on_disk))
             logging.debug('Added in-memory format of type %s.', format_type)
 
         self.emit('object-state-changed', cb_object)
+        self._check_limits()
+
+    def set_format_data(self, object_id, format_, data):
+        """Keep the data of a format that was fetched on demand"""
+        if object_id not in self._objects:
+            return
+        format_.set_data(data)
+        self._check_limits()
+
+    def touch_object(self, object_id):
+        """Mark an object as the most recently used"""
+        cb_object = self._objects.pop(object_id, None)
+        if cb_object is not None:
+            self._objects[object_id] = cb_object
+
+    def set_active_object(self, object_id):
+        """Set the object that is in the X clipboard"""
+        self._active_object_id = object_id
+        self.touch_object(object_id)
+        self._check_limits()
+
+    def set_max_objects(self, max_objects):
+        self._max_objects = max_objects
+        self._check_limits()
+
+    def get_usage(self):
+        """Return the bytes taken by the objects in memory and on disk"""
+        return self._usage
+
+    def drop_pending_formats(self, object_id):
+        """Forget the formats of an object that were never fetched"""
+        cb_object = self._objects.get(object_id)
+        if cb_object is not None and cb_object.drop_pending_formats():
+            logging.debug('Dropped the pending formats of %r', object_id)
+            self.emit('object-state-changed', cb_object)
 
     def delete_object(self, object_id):
         cb_object = self._objects.pop(object_id)
+        file_copy = self._file_copies.pop(object_id, None)
+        if file_copy is not None:
+            file_copy.cancel()
+        if object_id == self._active_object_id:
+            self._active_object_id = None
         cb_object.destroy()
         if not self._objects:
             gtk_clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
             gtk_clipboard.clear()
         self.emit('object-deleted', object_id)
         logging.debug('Deleted object with object_id %r', object_id)
+        self._update_usage()
+
+    def _is_pinned(self, object_id):
+        return object_id == self._active_object_id or \
+                object_id in self._file_copies or \
+                self._objects[object_id].get_percent() < 100
+
+    def _check_limits(self):
+        """Spill format data to files and evict objects over the limits"""
+        memory_size = 0
+        for cb_object in self._objects.itervalues():
+            memory_size += cb_object.get_memory_size()
+
+        # Least recently used objects go first
+        for cb_object in self._objects.values():
+            for format_ in cb_object.get_formats().values():
+                size = format_.get_memory_size()
+                if size >= _SPILL_SIZE or \
+                        (memory_size > self._memory_limit and
+                         size >= _MIN_SPILL_SIZE):
+                    self._spill_format(format_)
+                    memory_size -= size - format_.get_memory_size()
+
+        # Deleting emits object-deleted, which can change the objects
+        evicted = True
+        while evicted:
+            evicted = False
+            size = 0
+            for cb_object in self._objects.itervalues():
+                size += cb_object.get_memory_size() + \
+                        cb_object.get_disk_size()
+            too_many = self._max_objects is not None and \
+                    len(self._objects) > self._max_objects
+            if not too_many and size <= self._size_limit:
+                break
+
+            for object_id in self._objects.keys():
+                if not self._is_pinned(object_id):
+                    logging.debug('Clipboard: evicting %r', object_id)
+                    self.delete_object(object_id)
+                    evicted = True
+                    break
+
+        self._update_usage()
+
+    def _spill_format(self, format_):
+        if not os.path.exists(self._data_dir):
+            os.makedirs(self._data_dir)
+        try:
+            format_.spill(self._data_dir)
+        except EnvironmentError:
+            logging.exception('Clipboard: could not move %s data to disk',
+                              format_.get_type())
+
+    def _update_usage(self):
+        memory_size = 0
+        disk_size = 0
+        for cb_object in self._objects.itervalues():
+            memory_size += cb_object.get_memory_size()
+            disk_size += cb_object.get_disk_size()
+        if (memory_size, disk_size) != self._usage:
+            self._usage = (memory_size, disk_size)
+            self.emit('usage-changed')
 
     def set_object_percent(self, object_id, percent):
         cb_object = self._objects[object_id]
@@ -115,30 +425,97 @@ class Clipboard(GObject.GObject):
             # ignore setting same percentage
             return
 
+        if percent == 100 and self._copy_files(cb_object):
+            # The object is complete once its files are copied
+            return
+
         cb_object.set_percent(percent)
 
         if percent == 100:
             self._process_object(cb_object)
 
         self.emit('object-state-changed', cb_object)
+        if percent == 100:
+            self._check_limits()
+
+    def _copy_files(self, cb_object, exclude=()):
+        """Start copying the files the object refers to
+
+        Formats in exclude are not copied. Returns whether there are files
+        being copied.
+
+        """
+        object_id = cb_object.get_id()
+        if object_id in self._file_copies:
+            return True
+
+        formats = [format_ for format_ in cb_object.get_formats().values()
+                   if format_.is_on_disk() and not format_.owns_disk_data
+                   and format_ not in exclude]
+        if not formats:
+            return False
+
+        self._file_copies[object_id] = _FileCopy(
+            formats, self._data_dir,
+            partial(self.__copy_progress_cb, object_id),
+            partial(self.__files_copied_cb, object_id))
+        return True
+
+    def __copy_progress_cb(self, object_id, file_copy, percent):
+        if self._file_copies.get(object_id) is not file_copy:
+            return False
+
+        if percent > self._objects[object_id].get_percent():
+            self.set_object_percent(object_id, percent)
+        return False
+
+    def __files_copied_cb(self, object_id, file_copy, results):
+        if self._file_copies.get(object_id) is not file_copy:
+            # The object was deleted meanwhile
+            for format_, new_uri in results:
+                if new_uri is not None:
+                    os.remove(urlparse.urlparse(new_uri).path)
+            return False
+        del self._file_copies[object_id]
+
+        for format_, new_uri in results:
+            if new_uri is not None:
+                format_.set_data(new_uri)
+                format_.owns_disk_data = True
+
+        cb_object = self._objects[object_id]
+        if cb_object.get_percent() < 100:
+            cb_object.set_percent(100)
+            self._process_object(cb_object)
+        self.emit('object-state-changed', cb_object)
+        self._check_limits()
+
+        # Formats added while copying, the failed ones keep referring to
+        # the original files
+        self._copy_files(cb_object,
+                         exclude=[format_ for format_, new_uri_ in results])
+        return False
 
     def _process_object(self, cb_object):
         formats = cb_object.get_formats()
-        for format_name, format_ in formats.iteritems():
-            if format_.is_on_disk() and not format_.owns_disk_data:
-                new_uri = self._copy_file(format_.get_data())
-                format_.set_data(new_uri)
 
         # Add a text/plain format to objects that are text but lack it
         if 'text/plain' not in formats.keys():
-            if 'UTF8_STRING' in formats.keys():
-                self.add_object_format(
-                    cb_object.get_id(), 'text/plain',
-                    data=formats['UTF8_STRING'].get_data(), on_disk=False)
-            elif 'text/unicode' in formats.keys():
-                self.add_object_format(
-                    cb_object.get_id(), 'text/plain',
-                    data=formats['UTF8_STRING'].get_data(), on_disk=False)
+            for format_type in ['UTF8_STRING', 'text/unicode']:
+                if format_type not in formats:
+                    continue
+                text_format = formats[format_type]
+                if text_format.is_pending():
+                    # fetch it together with the text format, on demand
+                    self.add_object_format(
+                        cb_object.get_id(), 'text/plain', data=None,
+                        on_disk=False,
+                        fetch_cb=partial(_fetch_from_format, text_format))
+                else:
+                    self.add_object_format(
+                        cb_object.get_id(), 'text/plain',
+                        data=text_format.get_data(), on_disk=False)
+                break
 
     def get_object(self, object_id):
         logging.debug('Clipboard.get_object')
@@ -150,23 +527,6 @@ class Clipboard(GObject.GObject):
         format_ = cb_object.get_formats()[format_type]
         return format_
 
-    def _copy_file(self, original_uri):
-        uri = urlparse.urlparse(original_uri)
-        path = uri.path  # pylint: disable=E1101
-        directory_, file_name = os.path.split(path)
-
-        root, ext = os.path.splitext(file_name)
-        if not ext or ext == '.':
-            mime_type = mime.get_for_file(path)
-            ext = '.' + mime.get_primary_extension(mime_type)
-
-        f_, new_file_path = tempfile.mkstemp(ext, root)
-        del f_
-        shutil.copyfile(path, new_file_path)
-        os.chmod(new_file_path, 0644)
-
-        return 'file://' + new_file_path
-
 
 def get_instance():
     global _instance
@@ -79,15 +79,24 @@ class ClipboardIcon(RadioToolButton):
         target_name = target_atom.name()
         logging.debug('_drag_data_get_cb: requested target %s', target_name)
         data = self._cb_object.get_formats()[target_name].get_data()
+        clipboard.get_instance().touch_object(self._cb_object.get_id())
+        if data is None:
+            logging.warning('_drag_data_get_cb: no data for target %s',
+                            target_name)
+            return
         selection.set(target_atom, 8, data)
 
-    def _put_in_clipboard(self):
-        logging.debug('ClipboardIcon._put_in_clipboard')
+    def put_in_clipboard(self):
+        logging.debug('ClipboardIcon.put_in_clipboard')
 
         if self._cb_object.get_percent() < 100:
             raise ValueError('Object is not complete, cannot be put into the'
                              ' clipboard.')
 
+        if self._cb_object.has_pending_formats():
+            # Still in the clipboard, its owner serves all the formats
+            return
+
         targets = self._get_targets()
         if targets:
             x_clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
@@ -108,6 +117,7 @@ class ClipboardIcon(RadioToolButton):
                             entries_targets)
             return
         data = self._cb_object.get_formats()[str(selection_target)].get_data()
+        clipboard.get_instance().touch_object(self._cb_object.get_id())
         selection.set(selection_target, 8, data)
 
     def _clipboard_clear_cb(self, x_clipboard, targets):
@@ -167,7 +177,9 @@ class ClipboardIcon(RadioToolButton):
 
     def _notify_active_cb(self, widget, pspec):
         if self.props.active:
-            self._put_in_clipboard()
+            self.put_in_clipboard()
+            cb_service = clipboard.get_instance()
+            cb_service.set_active_object(self._cb_object.get_id())
         else:
             self.owns_clipboard = False
 
@@ -17,6 +17,7 @@
 import os
 import logging
 import urlparse
+import tempfile
 from gi.repository import Gio
 from gi.repository import Gtk
 
@@ -97,6 +98,39 @@ class ClipboardObject(object):
     def get_formats(self):
         return self._formats
 
+    def has_pending_formats(self):
+        for format_ in self._formats.itervalues():
+            if format_.is_pending():
+                return True
+        return False
+
+    def drop_pending_formats(self):
+        """Forget the formats whose data was never fetched
+
+        Returns whether any format was dropped.
+
+        """
+        pending = [format_type
+                   for format_type, format_ in self._formats.iteritems()
+                   if format_.is_pending()]
+        for format_type in pending:
+            del self._formats[format_type]
+        return bool(pending)
+
+    def get_memory_size(self):
+        """Return the number of bytes held in memory by the formats"""
+        size = 0
+        for format_ in self._formats.itervalues():
+            size += format_.get_memory_size()
+        return size
+
+    def get_disk_size(self):
+        """Return the number of bytes of the files owned by the formats"""
+        size = 0
+        for format_ in self._formats.itervalues():
+            size += format_.get_disk_size()
+        return size
+
     def get_mime_type(self):
         if not self._formats:
             return ''
@@ -119,15 +153,24 @@ class ClipboardObject(object):
 
 class Format(object):
 
-    def __init__(self, mime_type, data, on_disk):
+    def __init__(self, mime_type, data, on_disk, fetch_cb=None):
         self.owns_disk_data = False
 
         self._type = mime_type
         self._data = data
         self._on_disk = on_disk
+        # Formats offered by the owner of the clipboard but not captured
+        # yet have no data and are fetched on demand with fetch_cb(format),
+        # which returns the data or None if it is not available anymore
+        self._fetch_cb = fetch_cb
+        # File the data was moved to, see spill()
+        self._spill_path = None
+        self._spill_size = 0
 
     def destroy(self):
-        if self._on_disk:
+        self._remove_spill_file()
+        # Until the file is copied the format refers to the original
+        if self._on_disk and self.owns_disk_data:
             uri = urlparse.urlparse(self._data)
             path = uri.path  # pylint: disable=E1101
             if os.path.isfile(path):
@@ -137,10 +180,70 @@ class Format(object):
         return self._type
 
     def get_data(self):
+        if self._spill_path is not None:
+            return self._read_spill_file()
+        if self.is_pending():
+            return self._fetch_cb(self)
         return self._data
 
     def set_data(self, data):
+        self._remove_spill_file()
         self._data = data
 
+    def is_pending(self):
+        return self._data is None and self._fetch_cb is not None and \
+                self._spill_path is None
+
+    def get_memory_size(self):
+        if self._on_disk or self._data is None:
+            return 0
+        return len(self._data)
+
+    def get_disk_size(self):
+        if self._spill_path is not None:
+            return self._spill_size
+        if self._on_disk and self.owns_disk_data:
+            path = urlparse.urlparse(self._data).path  # pylint: disable=E1101
+            try:
+                return os.path.getsize(path)
+            except OSError:
+                return 0
+        return 0
+
+    def spill(self, directory):
+        """Move the data held in memory to a file in directory"""
+        fd, path = tempfile.mkstemp(dir=directory)
+        spill_file = os.fdopen(fd, 'wb')
+        try:
+            spill_file.write(self._data)
+        finally:
+            spill_file.close()
+
+        self._spill_path = path
+        self._spill_size = len(self._data)
+        self._data = None
+
+    def is_spilled(self):
+        return self._spill_path is not None
+
+    def _read_spill_file(self):
+        # The data is only read back when it is pasted or dropped, and the
+        # caller needs all of it as a string, read it in one go
+        spill_file = open(self._spill_path, 'rb')
+        try:
+            return spill_file.read()
+        finally:
+            spill_file.close()
+
+    def _remove_spill_file(self):
+        if self._spill_path is None:
+            return
+        try:
+            os.remove(self._spill_path)
+        except OSError:
+            logging.exception('Could not remove %r', self._spill_path)
+        self._spill_path = None
+        self._spill_size = 0
+
     def is_on_disk(self):
         return self._on_disk
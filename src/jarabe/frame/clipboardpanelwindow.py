@@ -15,18 +15,77 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import logging
+import os
 from urlparse import urlparse
 import hashlib
+import threading
+from functools import partial
 
+from gi.repository import GObject
 from gi.repository import Gtk
 from gi.repository import Gdk
 
+from sugar3 import mime
+
 from jarabe.frame.framewindow import FrameWindow
 from jarabe.frame.clipboardtray import ClipboardTray
 
 from jarabe.frame import clipboard
 
 
+_IGNORED_TARGETS = ('TIMESTAMP', 'TARGETS', 'MULTIPLE', 'SAVE_TARGETS')
+
+# Bytes of the formats fetched on demand that are kept with an object
+_OBJECT_MEMORY_BUDGET = 16 * 1024 * 1024
+
+
+# Bytes read from the start, the middle and the end of a file to tell it
+# apart from other files of the same size
+_FILE_SAMPLE_SIZE = 64 * 1024
+
+
+def _get_file_key(file_name):
+    """Return a key for the content of a file without reading all of it
+
+    The key is made of the size and modification time of the file and of
+    a few sampled blocks, which is enough to recognize the same file
+    being copied again.
+
+    """
+    stat = os.stat(file_name)
+    key = hashlib.md5('%d %r' % (stat.st_size, stat.st_mtime))
+    f = open(file_name, 'rb')
+    try:
+        for offset in [0, (stat.st_size - _FILE_SAMPLE_SIZE) / 2,
+                       stat.st_size - _FILE_SAMPLE_SIZE]:
+            f.seek(max(offset, 0))
+            key.update(f.read(_FILE_SAMPLE_SIZE))
+    finally:
+        f.close()
+    return key.digest()
+
+
+def _compute_file_key(file_name, callback):
+    """Run callback(key) in the main loop, runs in a worker thread"""
+    try:
+        file_key = _get_file_key(file_name)
+    except EnvironmentError:
+        logging.exception('Could not read %r', file_name)
+        file_key = None
+    GObject.idle_add(callback, file_key)
+
+
+def _choose_most_significant_target(targets):
+    mime_type = mime.choose_most_significant(targets)
+    if mime_type in targets:
+        return mime_type
+    # mime strips the parameters some applications add to their targets
+    for target in targets:
+        if target.split(';')[0] == mime_type:
+            return target
+    return targets[0]
+
+
 class ClipboardPanelWindow(FrameWindow):
     def __init__(self, frame, orientation):
         FrameWindow.__init__(self, orientation)
@@ -38,6 +97,9 @@ class ClipboardPanelWindow(FrameWindow):
         # listening to it.
         self._clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
         self._clipboard.connect('owner-change', self._owner_change_cb)
+        self._capture_serial = 0
+        # The last object captured with formats left to be fetched
+        self._lazy_object_id = None
 
         self._clipboard_tray = ClipboardTray()
         self._clipboard_tray.show()
@@ -54,76 +116,131 @@ class ClipboardPanelWindow(FrameWindow):
     def _owner_change_cb(self, x_clipboard, event):
         logging.debug('owner_change_cb')
 
+        if self._lazy_object_id is not None:
+            # The formats that were not fetched could only be asked to
+            # the application that owned the clipboard
+            object_id = self._lazy_object_id
+            self._lazy_object_id = None
+            cb_service = clipboard.get_instance()
+            cb_service.drop_pending_formats(object_id)
+            if event.reason != Gdk.OwnerChange.NEW_OWNER:
+                # The application went away and left the clipboard empty,
+                # keep serving what we got from it
+                self._clipboard_tray.take_clipboard(object_id)
+
         if self._clipboard_tray.owns_clipboard():
             return
 
-        cb_service = clipboard.get_instance()
+        # Replies to the requests of a previous owner are ignored
+        self._capture_serial += 1
+        x_clipboard.request_targets(
+            partial(self.__targets_received_cb, self._capture_serial), None)
 
-        result, targets = x_clipboard.wait_for_targets()
-        cb_selections = []
-        if not result:
+    def __targets_received_cb(self, serial, x_clipboard, atoms, *args):
+        if serial != self._capture_serial:
             return
 
-        target_is_uri = False
-        for target in targets:
-            if target not in ('TIMESTAMP', 'TARGETS',
-                              'MULTIPLE', 'SAVE_TARGETS'):
-                logging.debug('Asking for target %s.', target)
-                if target == 'text/uri-list':
-                    target_is_uri = True
-
-                selection = x_clipboard.wait_for_contents(target)
-                if not selection:
-                    logging.warning('no data for selection target %s.', target)
-                    continue
-                cb_selections.append(selection)
-
-        if target_is_uri:
-            uri = selection.get_uris()[0]
-            filename = uri[len('file://'):].strip()
-            md5 = self._md5_for_file(filename)
-            data_hash = hash(md5)
-        else:
-            data_hash = hash(selection.get_data())
+        targets = []
+        for atom in atoms or []:
+            target = atom.name()
+            if target not in _IGNORED_TARGETS and target not in targets:
+                targets.append(target)
+        if not targets:
+            return
 
-        if len(cb_selections) > 0:
-            key = cb_service.add_object(name="", data_hash=data_hash)
-            if key is None:
-                return
-            cb_service.set_object_percent(key, percent=0)
-            for selection in cb_selections:
-                self._add_selection(key, selection)
-            cb_service.set_object_percent(key, percent=100)
-
-    def _md5_for_file(self, file_name):
-        '''Calculate md5 for file data
-
-        Calculating block wise to prevent issues with big files in memory
-        '''
-        block_size = 8192
-        md5 = hashlib.md5()
-        f = open(file_name, 'r')
-        while True:
-            data = f.read(block_size)
-            if not data:
-                break
-            md5.update(data)
-        f.close()
-        return md5.digest()
+        target = _choose_most_significant_target(targets)
+        logging.debug('Asking for target %s.', target)
+        x_clipboard.request_contents(
+            Gdk.Atom.intern(target, False),
+            partial(self.__contents_received_cb, serial, targets), None)
+
+    def __contents_received_cb(self, serial, targets, x_clipboard, selection,
+                               *args):
+        if serial != self._capture_serial:
+            return
 
-    def _add_selection(self, key, selection):
-        if not selection.get_data():
+        if not selection or not selection.get_data():
             logging.warning('no data for selection target %s.',
-                    selection.get_data_type())
+                            selection.get_target() if selection else None)
             return
 
         selection_type = str(selection.get_data_type())
+        data = selection.get_data()
+        uris = None
+        if selection_type == 'text/uri-list':
+            uris = selection.get_uris()
+            scheme = urlparse(uris[0])[0]
+            if scheme == 'file':
+                # Reading the file is left to a thread, the selection data
+                # is only valid during this callback
+                filename = uris[0][len('file://'):].strip()
+                file_key_cb = partial(self.__file_key_cb, serial, targets,
+                                      selection_type, data, uris)
+                thread = threading.Thread(target=_compute_file_key,
+                                          args=(filename, file_key_cb))
+                thread.daemon = True
+                thread.start()
+                return
+
+        self._add_object(serial, targets, hash(data), selection_type, data,
+                         uris)
+
+    def __file_key_cb(self, serial, targets, selection_type, data, uris,
+                      file_key):
+        if serial != self._capture_serial or file_key is None:
+            return False
+        self._add_object(serial, targets, hash(file_key), selection_type,
+                         data, uris)
+        return False
+
+    def _add_object(self, serial, targets, data_hash, selection_type, data,
+                    uris):
+        cb_service = clipboard.get_instance()
+        key = cb_service.add_object(name="", data_hash=data_hash)
+        if key is None:
+            return
+        cb_service.set_object_percent(key, percent=0)
+        self._add_format(key, selection_type, data, uris)
+
+        # The other formats are fetched from the owner if they are needed
+        fetch_cb = partial(self.__fetch_format_cb, serial, key)
+        for target in targets:
+            if target not in cb_service.get_object(key).get_formats():
+                cb_service.add_object_format(key, target, None,
+                                             on_disk=False, fetch_cb=fetch_cb)
+        if cb_service.get_object(key).has_pending_formats():
+            self._lazy_object_id = key
+
+        # Files are copied before the object is complete, the icon shows
+        # the progress meanwhile
+        cb_service.set_object_percent(key, percent=100)
+
+    def __fetch_format_cb(self, serial, key, format_):
+        if serial != self._capture_serial or key != self._lazy_object_id:
+            return None
+
+        format_type = format_.get_type()
+        logging.debug('Asking for target %s on demand.', format_type)
+        selection = self._clipboard.wait_for_contents(
+            Gdk.Atom.intern(format_type, False))
+        if not selection or not selection.get_data():
+            logging.warning('no data for selection target %s.', format_type)
+            return None
+        data = selection.get_data()
+
+        # Keep it for the next time only if it fits in the budget of the
+        # object, the owner can still be asked for it until it goes away
+        cb_service = clipboard.get_instance()
+        cb_object = cb_service.get_object(key)
+        if cb_object.get_memory_size() + len(data) <= _OBJECT_MEMORY_BUDGET:
+            cb_service.set_format_data(key, format_, data)
+        return data
+
+    def _add_format(self, key, selection_type, data, uris):
         logging.debug('adding type ' + selection_type + '.')
 
         cb_service = clipboard.get_instance()
         if selection_type == 'text/uri-list':
-            uris = selection.get_uris()
-
             if len(uris) > 1:
                 raise NotImplementedError('Multiple uris in text/uri-list' \
                                           ' still not supported.')
@@ -139,5 +256,5 @@ class ClipboardPanelWindow(FrameWindow):
         else:
             cb_service.add_object_format(key,
                                          selection_type,
-                                         selection.get_data(),
+                                         data,
                                          on_disk=False)
@@ -15,6 +15,7 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import logging
+from gettext import gettext as _
 
 from gi.repository import Gtk
 from gi.repository import Gdk
@@ -26,6 +27,15 @@ from jarabe.frame import clipboard
 from jarabe.frame.clipboardicon import ClipboardIcon
 
 
+def _format_size(size):
+    if size < 1024:
+        return _('%dB') % size
+    elif size < 1048576:
+        return _('%dKB') % (size / 1024)
+    else:
+        return _('%dMB') % (size / 1048576)
+
+
 class _ContextMap(object):
     """Maps a drag context to the clipboard object involved in the dragging."""
     def __init__(self):
@@ -68,6 +78,9 @@ class ClipboardTray(tray.VTray):
         cb_service = clipboard.get_instance()
         cb_service.connect('object-added', self._object_added_cb)
         cb_service.connect('object-deleted', self._object_deleted_cb)
+        cb_service.connect('usage-changed', self._usage_changed_cb)
+        # The least recently used objects are deleted past this
+        cb_service.set_max_objects(self.MAX_ITEMS)
 
     def owns_clipboard(self):
         for icon in self._icons.values():
@@ -103,6 +116,12 @@ class ClipboardTray(tray.VTray):
                                          selection_data,
                                          on_disk=False)
 
+    def take_clipboard(self, object_id):
+        """Serve the clipboard with the object if it is the active one"""
+        icon = self._icons.get(object_id)
+        if icon is not None and icon.props.active:
+            icon.put_in_clipboard()
+
     def _object_added_cb(self, cb_service, cb_object):
         if self._icons:
             group = self._icons.values()[0]
@@ -114,12 +133,6 @@ class ClipboardTray(tray.VTray):
         icon.show()
         self._icons[cb_object.get_id()] = icon
 
-        objects_to_delete = self.get_children()[:-self.MAX_ITEMS]
-        for icon in objects_to_delete:
-            logging.debug('ClipboardTray: deleting surplus object')
-            cb_service = clipboard.get_instance()
-            cb_service.delete_object(icon.get_object_id())
-
         logging.debug('ClipboardTray: %r was added', cb_object.get_id())
 
     def _object_deleted_cb(self, cb_service, object_id):
@@ -133,6 +146,13 @@ class ClipboardTray(tray.VTray):
 
         logging.debug('ClipboardTray: %r was deleted', object_id)
 
+    def _usage_changed_cb(self, cb_service):
+        memory_size, disk_size = cb_service.get_usage()
+        self.set_tooltip_text(_('Clipboard: %(memory)s in memory,'
+                                ' %(disk)s on disk') %
+                              {'memory': _format_size(memory_size),
+                               'disk': _format_size(disk_size)})
+
     def drag_motion_cb(self, widget, context, x, y, time):
         logging.debug('ClipboardTray._drag_motion_cb')
 
@@ -0,0 +1,542 @@
+# Copyright (C) 2012, One Laptop per Child
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Copy of journal entries to removable volumes
+
+A CopyJob copies any number of entries to a mounted volume. The metadata
+and the files of the entries are fetched from the datastore in the main
+loop and handed to a worker thread. The worker streams the files in large
+chunks and resolves name collisions against a listing of the volume read
+once. It writes the metadata and previews into the metadata directory in
+batches.
+
+If the volume goes away in the middle of the job, the job pauses. It
+resumes where it stopped once a volume is mounted at the same place
+again.
+
+"""
+
+import logging
+import os
+import json
+import time
+import tempfile
+import threading
+import Queue
+from collections import deque
+from datetime import datetime
+from functools import partial
+from gettext import gettext as _
+
+from gi.repository import GObject
+from gi.repository import Gio
+
+from jarabe.journal import model
+
+
+_CHUNK_SIZE = 1024 * 1024
+
+# Number of entries whose metadata is written to the volume at once
+_METADATA_BATCH_SIZE = 16
+
+# Number of entries fetched from the datastore ahead of the one being
+# copied; each holds a temporary copy of its file
+_ENTRIES_TO_FETCH_AHEAD = 2
+
+# Seconds between progress reports
+_PROGRESS_INTERVAL = 0.25
+
+# Jobs being run, they are kept alive until they finish or are cancelled
+_jobs = []
+
+
+class _VolumeGone(Exception):
+    pass
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _Entry(object):
+
+    def __init__(self, metadata, file_path, size):
+        self.uid = metadata['uid']
+        self.metadata = metadata
+        # Holding a reference keeps the temporary file of the datastore
+        self.file_path = file_path
+        self.size = size
+        self.file_name = None
+        self.offset = 0
+
+
+class CopyJob(GObject.GObject):
+    """Copy a list of entries to the volume mounted at mount_point
+
+    Progress is reported through the progress signal and the
+    get_bytes_copied(), get_bytes_total(), get_throughput() and
+    get_eta() methods.
+
+    """
+
+    __gtype_name__ = 'JournalCopyJob'
+
+    __gsignals__ = {
+        'progress': (GObject.SignalFlags.RUN_FIRST, None, ([])),
+        'entry-copied': (GObject.SignalFlags.RUN_FIRST, None,
+                         ([str, str])),
+        'entry-failed': (GObject.SignalFlags.RUN_FIRST, None,
+                         ([str, str])),
+        'paused': (GObject.SignalFlags.RUN_FIRST, None, ([])),
+        'resumed': (GObject.SignalFlags.RUN_FIRST, None, ([])),
+        'finished': (GObject.SignalFlags.RUN_FIRST, None, ([])),
+    }
+
+    def __init__(self, uids, mount_point):
+        GObject.GObject.__init__(self)
+
+        self.mount_point = mount_point
+        # Copies to the documents folder are not to a volume
+        self._is_volume = os.path.ismount(mount_point)
+
+        self._pending_uids = deque(uids)
+        self._n_entries = len(uids)
+        self._n_fetching = 0
+        self._n_queued = 0
+        self._n_done = 0
+
+        self._queue = Queue.Queue()
+        self._thread = None
+        self._interrupted_entries = []
+        self._mount_added_sid = None
+        self._running = False
+        self._cancelled = False
+
+        self._bytes_copied = 0
+        self._bytes_known = 0
+        self._n_sizes_known = 0
+        self._elapsed = 0
+        self._run_start = None
+
+    def start(self):
+        _jobs.append(self)
+        logging.debug('CopyJob: copying %d entries to %r', self._n_entries,
+                      self.mount_point)
+        self._start_worker()
+        if self._n_entries == 0:
+            self._queue.put(None)
+            self._finish()
+        else:
+            self._fetch_entries()
+
+    def cancel(self):
+        """Stop copying, the entry being copied is removed from the volume
+        """
+        self._cancelled = True
+        self._pending_uids.clear()
+        self._disconnect_volume_monitor()
+        self._interrupted_entries = []
+        while True:
+            try:
+                self._queue.get_nowait()
+            except Queue.Empty:
+                break
+        if self._running:
+            self._queue.put(None)
+        self._finish()
+
+    def is_paused(self):
+        return self._mount_added_sid is not None
+
+    def get_bytes_copied(self):
+        return self._bytes_copied
+
+    def get_bytes_total(self):
+        """Returns the number of bytes to copy
+
+        Sizes of entries not fetched yet are estimated from the average
+        of the ones that are known.
+        """
+        if self._n_sizes_known == 0:
+            return 0
+        n_unknown = self._n_entries - self._n_sizes_known
+        return self._bytes_known + \
+                n_unknown * self._bytes_known / self._n_sizes_known
+
+    def get_throughput(self):
+        """Returns the bytes copied per second, pauses excluded"""
+        elapsed = self._elapsed
+        if self._run_start is not None:
+            elapsed += time.time() - self._run_start
+        if elapsed <= 0:
+            return 0
+        return self._bytes_copied / elapsed
+
+    def get_eta(self):
+        """Returns the estimated seconds left, or -1 if not known yet"""
+        throughput = self.get_throughput()
+        if throughput <= 0:
+            return -1
+        return max(0, self.get_bytes_total() - self._bytes_copied) / \
+                throughput
+
+    def _start_worker(self):
+        self._running = True
+        self._run_start = time.time()
+
+        # Entries interrupted by a removal of the volume go first, and
+        # are still queued in the order they were copied in
+        interrupted_entries = self._interrupted_entries
+        self._interrupted_entries = []
+
+        self._thread = threading.Thread(target=self._run,
+                                        args=(interrupted_entries,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _fetch_entries(self):
+        while self._pending_uids and not self.is_paused() and \
+                self._n_fetching + self._n_queued < _ENTRIES_TO_FETCH_AHEAD:
+            uid = self._pending_uids.popleft()
+            self._n_fetching += 1
+            model.get_async(uid, partial(self.__get_reply_cb, uid),
+                            partial(self.__fetch_error_cb, uid))
+
+    def __get_reply_cb(self, uid, metadata):
+        model.get_file_async(uid,
+                             partial(self.__get_file_reply_cb, metadata),
+                             partial(self.__fetch_error_cb, uid))
+
+    def __get_file_reply_cb(self, metadata, file_path):
+        self._n_fetching -= 1
+        if self._cancelled:
+            return
+
+        if not file_path or not os.path.exists(file_path):
+            self._entry_failed(metadata['uid'],
+                               _('Entries without a file cannot be copied.'))
+            return
+
+        size = os.stat(file_path).st_size
+        self._bytes_known += size
+        self._n_sizes_known += 1
+
+        self._n_queued += 1
+        self._queue.put(_Entry(metadata, file_path, size))
+
+    def __fetch_error_cb(self, uid, error):
+        self._n_fetching -= 1
+        if self._cancelled:
+            return
+
+        logging.error('CopyJob: could not read %r: %s', uid, error)
+        self._entry_failed(uid, _('Error while reading the entry.'))
+
+    def _entry_failed(self, uid, message):
+        self.emit('entry-failed', uid, message)
+        self._entry_done()
+
+    def _entry_done(self):
+        self._n_done += 1
+        if self._n_done == self._n_entries:
+            self._queue.put(None)
+            self._finish()
+        else:
+            self._fetch_entries()
+
+    def _finish(self):
+        if self not in _jobs:
+            return
+        _jobs.remove(self)
+
+        if self._run_start is not None:
+            self._elapsed += time.time() - self._run_start
+            self._run_start = None
+        logging.debug('CopyJob: %d bytes copied to %r at %d bytes/s',
+                      self._bytes_copied, self.mount_point,
+                      self.get_throughput())
+        self.emit('finished')
+
+    def __progress_cb(self, n_bytes):
+        if self._cancelled:
+            return False
+        self._bytes_copied += n_bytes
+        self.emit('progress')
+        return False
+
+    def __entries_copied_cb(self, entries):
+        if self._cancelled:
+            return False
+        for entry in entries:
+            self._n_queued -= 1
+            object_id = os.path.join(self.mount_point, entry.file_name)
+            model.created.send(None, object_id=object_id)
+            self.emit('entry-copied', entry.uid, object_id)
+            entry.file_path = None
+            self._entry_done()
+        return False
+
+    def __entry_failed_cb(self, entry, message):
+        if self._cancelled:
+            return False
+        self._n_queued -= 1
+        entry.file_path = None
+        self._entry_failed(entry.uid, message)
+        return False
+
+    def __volume_gone_cb(self, interrupted_entries):
+        logging.debug('CopyJob: %r went away, pausing', self.mount_point)
+        self._running = False
+        self._elapsed += time.time() - self._run_start
+        self._run_start = None
+        if self._cancelled:
+            return False
+
+        self._interrupted_entries = interrupted_entries
+
+        volume_monitor = Gio.VolumeMonitor.get()
+        self._mount_added_sid = volume_monitor.connect(
+            'mount-added', self.__mount_added_cb)
+        self.emit('paused')
+        return False
+
+    def __mount_added_cb(self, volume_monitor, mount):
+        if mount.get_root().get_path() != self.mount_point:
+            return
+
+        logging.debug('CopyJob: %r is back, resuming', self.mount_point)
+        self._disconnect_volume_monitor()
+        self._start_worker()
+        self._fetch_entries()
+        self.emit('resumed')
+
+    def _disconnect_volume_monitor(self):
+        if self._mount_added_sid is not None:
+            Gio.VolumeMonitor.get().disconnect(self._mount_added_sid)
+            self._mount_added_sid = None
+
+    def _run(self, interrupted_entries):
+        """Copy the queued entries, runs in the worker thread"""
+        try:
+            file_names = set(os.listdir(self.mount_point))
+        except OSError:
+            logging.exception('CopyJob: could not list %r', self.mount_point)
+            GObject.idle_add(self.__volume_gone_cb, interrupted_entries)
+            return
+
+        batch = []
+        entry = None
+        try:
+            # The data of the interrupted entries may not have reached the
+            # volume, _copy_data checks what is there and completes it
+            for entry in interrupted_entries:
+                if self._copy_entry(entry, file_names):
+                    batch.append(entry)
+            entry = None
+
+            while not self._cancelled:
+                try:
+                    entry = self._queue.get(block=not batch)
+                except Queue.Empty:
+                    # Nothing else to copy right now, catch up with the
+                    # metadata of what has been copied
+                    self._write_metadata(batch)
+                    batch = []
+                    continue
+
+                if entry is None:
+                    self._write_metadata(batch)
+                    return
+
+                if not self._copy_entry(entry, file_names):
+                    entry = None
+                    continue
+                batch.append(entry)
+                entry = None
+
+                if len(batch) >= _METADATA_BATCH_SIZE:
+                    self._write_metadata(batch)
+                    batch = []
+        except _VolumeGone:
+            if entry is not None:
+                batch.append(entry)
+            GObject.idle_add(self.__volume_gone_cb, batch)
+        except _Cancelled:
+            destination_path = os.path.join(self.mount_point,
+                                            entry.file_name)
+            try:
+                os.remove(destination_path)
+            except OSError:
+                logging.exception('CopyJob: could not remove %r',
+                                  destination_path)
+
+    def _check_volume(self, error):
+        if not os.path.isdir(self.mount_point) or \
+                (self._is_volume and not os.path.ismount(self.mount_point)):
+            raise _VolumeGone()
+        logging.error('CopyJob: error while writing to %r: %s',
+                      self.mount_point, error)
+
+    def _copy_entry(self, entry, file_names):
+        if entry.file_name is None:
+            metadata = entry.metadata
+            if not metadata.get('title'):
+                metadata['title'] = _('Untitled')
+            file_name = model.get_file_name(metadata['title'],
+                                            metadata['mime_type'])
+            file_name = model.get_unique_file_name(self.mount_point,
+                                                   file_name, file_names)
+            file_names.add(file_name)
+            entry.file_name = file_name
+            metadata['title'] = os.path.splitext(file_name)[0]
+
+        try:
+            self._copy_data(entry)
+        except EnvironmentError, e:
+            self._check_volume(e)
+            GObject.idle_add(self.__entry_failed_cb, entry,
+                             _('Error while copying the entry. %s') %
+                             e.strerror)
+            return False
+
+        return True
+
+    def _copy_data(self, entry):
+        destination_path = os.path.join(self.mount_point, entry.file_name)
+
+        if entry.offset > 0 and os.path.exists(destination_path) and \
+                os.stat(destination_path).st_size >= entry.offset:
+            destination = open(destination_path, 'r+b')
+            destination.truncate(entry.offset)
+            destination.seek(entry.offset)
+        else:
+            GObject.idle_add(self.__progress_cb, -entry.offset)
+            entry.offset = 0
+            destination = open(destination_path, 'wb')
+
+        source = open(entry.file_path, 'rb')
+        try:
+            source.seek(entry.offset)
+            last_report = time.time()
+            n_bytes = 0
+            while True:
+                if self._cancelled:
+                    raise _Cancelled()
+                data = source.read(_CHUNK_SIZE)
+                if not data:
+                    break
+                destination.write(data)
+                entry.offset += len(data)
+                n_bytes += len(data)
+
+                if time.time() - last_report > _PROGRESS_INTERVAL:
+                    GObject.idle_add(self.__progress_cb, n_bytes)
+                    last_report = time.time()
+                    n_bytes = 0
+        finally:
+            source.close()
+            try:
+                destination.close()
+            finally:
+                GObject.idle_add(self.__progress_cb, n_bytes)
+
+    def _write_metadata(self, entries):
+        if not entries:
+            return
+
+        metadata_dir_path = os.path.join(self.mount_point,
+                                         model.JOURNAL_METADATA_DIR)
+        written_entries = []
+        try:
+            if not os.path.exists(metadata_dir_path):
+                os.mkdir(metadata_dir_path)
+
+            for entry in entries:
+                self._write_entry_metadata(entry, metadata_dir_path)
+                written_entries.append(entry)
+        except EnvironmentError, e:
+            self._check_volume(e)
+
+            # An entry without its metadata is not a copy of the entry
+            for entry in entries[len(written_entries):]:
+                self._remove_entry_data(entry)
+                GObject.idle_add(self.__entry_failed_cb, entry,
+                                 _('Error while copying the entry. %s') %
+                                 e.strerror)
+
+        if written_entries:
+            GObject.idle_add(self.__entries_copied_cb, written_entries)
+
+    def _write_entry_metadata(self, entry, metadata_dir_path):
+        metadata = entry.metadata.copy()
+        for key in ['mountpoint', 'uid', 'filesize']:
+            metadata.pop(key, None)
+        preview = metadata.pop('preview', None)
+
+        # The copy is a new entry, dated like model.write() dates them
+        metadata['mtime'] = datetime.now().isoformat()
+        metadata['timestamp'] = int(time.time())
+
+        try:
+            metadata_json = json.dumps(metadata)
+        except (UnicodeDecodeError, EnvironmentError):
+            logging.error('Could not convert metadata to json.')
+            return
+
+        _write_file(os.path.join(metadata_dir_path,
+                                 entry.file_name + '.metadata'),
+                    metadata_json, self.mount_point)
+        if preview:
+            _write_file(os.path.join(metadata_dir_path,
+                                     entry.file_name + '.preview'),
+                        preview, self.mount_point)
+
+    def _remove_entry_data(self, entry):
+        destination_path = os.path.join(self.mount_point, entry.file_name)
+        try:
+            os.remove(destination_path)
+        except OSError:
+            logging.exception('CopyJob: could not remove %r',
+                              destination_path)
+
+
+def _write_file(path, data, temp_dir):
+    fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+    try:
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        os.rename(temp_path, path)
+    except EnvironmentError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def copy_entries(uids, mount_point):
+    """Start copying the entries with the given uids to a volume
+
+    Returns the CopyJob doing it.
+    """
+    job = CopyJob(uids, mount_point)
+    job.start()
+    return job
+
+
+def get_jobs():
+    """Returns the jobs being run"""
+    return list(_jobs)
@@ -16,6 +16,7 @@
 
 import logging
 from gettext import gettext as _
+from functools import partial
 
 from gi.repository import GObject
 from gi.repository import Gtk
@@ -65,9 +66,20 @@ class DetailView(Gtk.VBox):
 
     def refresh(self):
         logging.debug('DetailView.refresh')
-        self._metadata = model.get(self._metadata['uid'])
+        uid = self._metadata['uid']
+        model.get_async(uid, partial(self.__get_reply_cb, uid),
+                        self.__get_error_cb)
+
+    def __get_reply_cb(self, uid, metadata):
+        if uid != self._metadata['uid']:
+            # another entry got shown meanwhile
+            return
+        self._metadata = metadata
         self._update_view()
 
+    def __get_error_cb(self, error):
+        logging.error('Could not refresh the entry: %s', error)
+
     def get_metadata(self):
         return self._metadata
 
@@ -20,6 +20,7 @@ from gettext import gettext as _
 import StringIO
 import time
 import os
+from functools import partial
 
 import cairo
 from gi.repository import GObject
@@ -415,12 +416,16 @@ class ExpandedEntry(Gtk.EventBox):
         vbox = Gtk.VBox()
         vbox.props.spacing = style.DEFAULT_SPACING
 
+        filesize = model.get_filesize_property(self._metadata)
+        if filesize is None:
+            size = _('Unknown')
+        else:
+            size = format_size(filesize)
+
         lines = [
             _('Kind: %s') % (self._metadata.get('mime_type') or _('Unknown'),),
             _('Date: %s') % (self._format_date(),),
-            _('Size: %s') % (format_size(int(self._metadata.get(
-                        'filesize',
-                        model.get_file_size(self._metadata['uid'])))))
+            _('Size: %s') % (size,)
             ]
 
         for line in lines:
@@ -428,12 +433,28 @@ class ExpandedEntry(Gtk.EventBox):
             vbox.pack_start(linebox, False, False, 0)
 
             text = Gtk.Label()
-            text.set_markup('<span foreground="%s">%s</span>' % (
-                    style.COLOR_BUTTON_GREY.get_html(), line))
+            self._set_technical_line(text, line)
             linebox.pack_start(text, False, False, 0)
 
+        if filesize is None:
+            model.get_file_size_async(self._metadata['uid'],
+                                      partial(self.__file_size_reply_cb,
+                                              self._metadata['uid'], text),
+                                      self.__file_size_error_cb)
+
         return vbox
 
+    def _set_technical_line(self, label, line):
+        label.set_markup('<span foreground="%s">%s</span>' % (
+                style.COLOR_BUTTON_GREY.get_html(), line))
+
+    def __file_size_reply_cb(self, uid, label, size):
+        if uid == self._metadata['uid']:
+            self._set_technical_line(label, _('Size: %s') % format_size(size))
+
+    def __file_size_error_cb(self, error):
+        logging.error('Could not get the size of the entry: %s', error)
+
     def _format_date(self):
         if 'timestamp' in self._metadata:
             try:
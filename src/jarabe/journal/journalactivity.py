@@ -138,9 +138,7 @@ class JournalActivity(JournalWindow):
         self.connect('key-press-event', self._key_press_event_cb)
         self.connect('focus-in-event', self._focus_in_event_cb)
 
-        model.created.connect(self.__model_created_cb)
-        model.updated.connect(self.__model_updated_cb)
-        model.deleted.connect(self.__model_deleted_cb)
+        model.changes.connect(self.__model_changes_cb)
 
         self._dbus_service = JournalActivityDBusService(self)
 
@@ -277,24 +275,21 @@ class JournalActivity(JournalWindow):
         logging.debug('Selected volume: %r.', mount_point)
         self._main_toolbox.set_mount_point(mount_point)
 
-    def __model_created_cb(self, sender, **kwargs):
-        self._check_for_bundle(kwargs['object_id'])
-        self._main_toolbox.refresh_filters()
-        self._check_available_space()
-
-    def __model_updated_cb(self, sender, **kwargs):
-        self._check_for_bundle(kwargs['object_id'])
-
-        if self.canvas == self._secondary_view and \
-                kwargs['object_id'] == self._detail_view.props.metadata['uid']:
-            self._detail_view.refresh()
-
-        self._check_available_space()
-
-    def __model_deleted_cb(self, sender, **kwargs):
-        if self.canvas == self._secondary_view and \
-                kwargs['object_id'] == self._detail_view.props.metadata['uid']:
-            self.show_main_view()
+    def __model_changes_cb(self, sender, **kwargs):
+        for object_id in kwargs['created'] + kwargs['updated']:
+            self._check_for_bundle(object_id)
+
+        if self.canvas == self._secondary_view:
+            uid = self._detail_view.props.metadata['uid']
+            if uid in kwargs['deleted']:
+                self.show_main_view()
+            elif uid in kwargs['updated']:
+                self._detail_view.refresh()
+
+        if kwargs['created']:
+            self._main_toolbox.refresh_filters()
+        if kwargs['created'] or kwargs['updated']:
+            self._check_available_space()
 
     def _focus_in_event_cb(self, window, event):
         self._list_view.update_dates()
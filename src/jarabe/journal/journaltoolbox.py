@@ -21,6 +21,7 @@ from datetime import datetime, timedelta
 import os
 from gi.repository import GConf
 import time
+from functools import partial
 
 from gi.repository import GObject
 from gi.repository import Gio
@@ -119,8 +120,13 @@ class MainToolbox(ToolbarBox):
         #self.insert(tool_item, -1)
         #tool_item.show()
 
+        # The activity filtered by while the activities are looked up
+        self._what_value_to_restore = None
         self._query = self._build_query()
 
+        self._filters_generation = 0
+        self._loading_activities = False
+        self._pending_what_filter = None
         self.refresh_filters()
 
     def _get_when_search_combo(self):
@@ -174,14 +180,14 @@ class MainToolbox(ToolbarBox):
         if self._favorite_button.props.active:
             query['keep'] = 1
 
-        if self._what_search_combo.props.value:
-            value = self._what_search_combo.props.value
+        value = self._get_what_value()
+        if value:
             generic_type = mime.get_generic_type(value)
             if generic_type:
                 mime_types = generic_type.mime_types
                 query['mime_type'] = mime_types
             else:
-                query['activity'] = self._what_search_combo.props.value
+                query['activity'] = value
 
         if self._when_search_combo.props.value:
             date_from, date_to = self._get_date_range()
@@ -219,7 +225,15 @@ class MainToolbox(ToolbarBox):
         return (time.mktime(date_range[0].timetuple()),
                 time.mktime(date_range[1].timetuple()))
 
+    def _get_what_value(self):
+        if self._what_value_to_restore is not None:
+            return self._what_value_to_restore
+        return self._what_search_combo.props.value
+
     def _combo_changed_cb(self, combo):
+        if combo == self._what_search_combo:
+            # The user chose another filter meanwhile
+            self._what_value_to_restore = None
         self._update_if_needed()
 
     def __sort_changed_cb(self, button):
@@ -271,13 +285,21 @@ class MainToolbox(ToolbarBox):
                 break
 
         if what_filter_index == -1:
-            logging.warning('what_filter %r not known', what_filter)
+            if self._loading_activities:
+                # it might be one of the activities still being looked up
+                self._pending_what_filter = what_filter
+            else:
+                logging.warning('what_filter %r not known', what_filter)
         else:
             self._what_search_combo.set_active(what_filter_index)
 
     def refresh_filters(self):
-        current_value = self._what_search_combo.props.value
+        current_value = self._get_what_value()
         current_value_index = 0
+        # Activities are only known once the datastore answers, keep
+        # filtering by the activity until it is back in the combo
+        if current_value and mime.get_generic_type(current_value) is None:
+            self._what_value_to_restore = current_value
 
         self._what_search_combo.handler_block(self._what_combo_changed_sid)
         try:
@@ -286,7 +308,6 @@ class MainToolbox(ToolbarBox):
             self._what_search_combo.append_item(_ACTION_ANYTHING,
                                                 _('Anything'))
 
-            registry = bundleregistry.get_registry()
             appended_separator = False
 
             types = mime.get_all_generic_types()
@@ -300,11 +321,39 @@ class MainToolbox(ToolbarBox):
                     current_value_index = \
                             len(self._what_search_combo.get_model()) - 1
 
+            if self._what_value_to_restore is None:
                 self._what_search_combo.set_active(current_value_index)
 
             self._what_search_combo.append_separator()
 
-            for service_name in model.get_unique_values('activity'):
+        finally:
+            self._what_search_combo.handler_unblock(
+                    self._what_combo_changed_sid)
+
+        # The activities are appended once the datastore answers
+        self._filters_generation += 1
+        self._loading_activities = True
+        model.get_unique_values_async('activity',
+                partial(self.__unique_values_reply_cb,
+                        self._filters_generation, current_value),
+                partial(self.__unique_values_error_cb,
+                        self._filters_generation))
+
+    def __unique_values_reply_cb(self, generation, current_value,
+                                 service_names):
+        if generation != self._filters_generation:
+            return
+        self._loading_activities = False
+
+        registry = bundleregistry.get_registry()
+        current_value_index = -1
+        # Unless the user chose another filter in the meantime
+        restore = self._what_value_to_restore is not None and \
+                self._what_value_to_restore == current_value
+
+        self._what_search_combo.handler_block(self._what_combo_changed_sid)
+        try:
+            for service_name in service_names:
                 activity_info = registry.get_bundle(service_name)
                 if activity_info is None:
                     continue
@@ -333,14 +382,50 @@ class MainToolbox(ToolbarBox):
                         activity_info.get_name(),
                         icon_name='application-octet-stream')
 
+            if restore and current_value_index != -1:
+                self._what_search_combo.set_active(current_value_index)
+
+        finally:
+            self._what_search_combo.handler_unblock(
+                    self._what_combo_changed_sid)
+
+        if restore:
+            if current_value_index == -1:
+                # No entries of that activity anymore
+                self._drop_what_value_to_restore()
+            else:
+                self._what_value_to_restore = None
+
+        if self._pending_what_filter is not None:
+            what_filter = self._pending_what_filter
+            self._pending_what_filter = None
+            self.set_what_filter(what_filter)
+
+    def __unique_values_error_cb(self, generation, error):
+        logging.error('Could not get the activities of the entries: %s',
+                      error)
+        if generation == self._filters_generation:
+            self._loading_activities = False
+            self._pending_what_filter = None
+            if self._what_value_to_restore is not None:
+                self._drop_what_value_to_restore()
+
+    def _drop_what_value_to_restore(self):
+        """Stop filtering by an activity that is not in the combo"""
+        self._what_value_to_restore = None
+        self._what_search_combo.handler_block(self._what_combo_changed_sid)
+        try:
+            self._what_search_combo.set_active(0)
         finally:
             self._what_search_combo.handler_unblock(
                     self._what_combo_changed_sid)
+        self._update_if_needed()
 
     def __favorite_button_toggled_cb(self, favorite_button):
         self._update_if_needed()
 
     def clear_query(self):
+        self._what_value_to_restore = None
         self.search_entry.props.text = ''
         self._what_search_combo.set_active(0)
         self._when_search_combo.set_active(0)
@@ -405,7 +490,6 @@ class DetailToolbox(ToolbarBox):
         button.palette.popup(immediate=True, state=Palette.SECONDARY)
 
     def _duplicate_clicked_cb(self, button):
-        file_path = model.get_file(self._metadata['uid'])
         try:
             model.copy(self._metadata, '/')
         except IOError, e:
@@ -437,7 +521,16 @@ class DetailToolbox(ToolbarBox):
             bundle = misc.get_bundle(self._metadata)
             if bundle is not None and registry.is_installed(bundle):
                 registry.uninstall(bundle)
-            model.delete(self._metadata['uid'])
+            model.delete_async(self._metadata['uid'], self.__delete_reply_cb,
+                               self.__delete_error_cb)
+
+    def __delete_reply_cb(self):
+        logging.debug('Erased %r', self._metadata['uid'])
+
+    def __delete_error_cb(self, error):
+        logging.error('Could not erase %r: %s', self._metadata['uid'], error)
+        self.emit('volume-error', _('Error while erasing the entry.'),
+                  _('Error'))
 
     def _resume_menu_item_activate_cb(self, menu_item, service_name):
         misc.resume(self._metadata, service_name)
@@ -15,6 +15,7 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import logging
+from collections import OrderedDict
 
 import json
 from gi.repository import GObject
@@ -34,6 +35,137 @@ DS_DBUS_INTERFACE = 'org.laptop.sugar.DataStore'
 DS_DBUS_PATH = '/org/laptop/sugar/DataStore'
 
 
+_MAX_CACHED_ROWS = 500
+
+_row_cache = None
+
+
+def _get_row_cache():
+    global _row_cache
+    if _row_cache is None:
+        _row_cache = _RowCache(_MAX_CACHED_ROWS)
+        model.created.connect(_row_cache.model_changed_cb)
+        model.updated.connect(_row_cache.model_changed_cb)
+        model.deleted.connect(_row_cache.model_changed_cb)
+    return _row_cache
+
+
+def _format_date(value):
+    try:
+        timestamp = float(value)
+    except (TypeError, ValueError):
+        return _('Unknown')
+    else:
+        return util.timestamp_to_elapsed_string(timestamp)
+
+
+class _RowCache(object):
+    """Least recently used cache of the rows computed for each entry
+
+    Computing a row means looking up icons and parsing the buddies, so the
+    rows are kept around by uid, across ListModel instances. An entry is
+    dropped when the datastore reports it as updated or deleted, and is
+    recomputed when its timestamp or size changed. The elapsed time
+    columns are recomputed alone after update_dates(). Entries written to
+    removable devices are reported as created, so that drops them too.
+
+    """
+
+    def __init__(self, max_rows):
+        self._max_rows = max_rows
+        self._rows = OrderedDict()
+        self._dates_generation = 0
+
+    def get_row(self, metadata):
+        uid = metadata['uid']
+        validity = (metadata.get('timestamp'), metadata.get('filesize'))
+
+        cached = self._rows.pop(uid, None)
+        if cached is None or cached[0] != validity:
+            row = _compute_row(metadata)
+            cached = [validity, row, self._dates_generation]
+        elif cached[2] != self._dates_generation:
+            row = cached[1]
+            row[ListModel.COLUMN_TIMESTAMP] = \
+                _format_date(metadata.get('timestamp', 0))
+            row[ListModel.COLUMN_CREATION_TIME] = \
+                _format_date(metadata.get('creation_time'))
+            cached[2] = self._dates_generation
+
+        self._rows[uid] = cached
+        while len(self._rows) > self._max_rows:
+            self._rows.popitem(last=False)
+
+        return cached[1]
+
+    def update_dates(self):
+        self._dates_generation += 1
+
+    def model_changed_cb(self, sender, signal, object_id):
+        self._rows.pop(object_id, None)
+
+
+def _compute_row(metadata):
+    row = []
+    row.append(metadata['uid'])
+    row.append(metadata.get('keep', '0') == '1')
+    row.append(misc.get_icon_name(metadata))
+
+    if misc.is_activity_bundle(metadata):
+        xo_color = XoColor('%s,%s' % (style.COLOR_BUTTON_GREY.get_svg(),
+                                      style.COLOR_TRANSPARENT.get_svg()))
+    else:
+        xo_color = misc.get_icon_color(metadata)
+    row.append(xo_color)
+
+    title = GObject.markup_escape_text(metadata.get('title',
+                                       _('Untitled')))
+    row.append('<b>%s</b>' % (title, ))
+
+    row.append(_format_date(metadata.get('timestamp', 0)))
+    row.append(_format_date(metadata.get('creation_time')))
+
+    try:
+        size = int(metadata.get('filesize'))
+    except (TypeError, ValueError):
+        size = None
+    row.append(util.format_size(size))
+
+    try:
+        progress = int(float(metadata.get('progress', 100)))
+    except (TypeError, ValueError):
+        progress = 100
+    row.append(progress)
+
+    buddies = []
+    if metadata.get('buddies'):
+        try:
+            buddies = json.loads(metadata['buddies']).values()
+        except json.decoder.JSONDecodeError, exception:
+            logging.warning('Cannot decode buddies for %r: %s',
+                            metadata['uid'], exception)
+
+    if not isinstance(buddies, list):
+        logging.warning('Content of buddies for %r is not a list: %r',
+                        metadata['uid'], buddies)
+        buddies = []
+
+    for n_ in xrange(0, 3):
+        if buddies:
+            try:
+                nick, color = buddies.pop(0)
+            except (AttributeError, ValueError), exception:
+                logging.warning('Malformed buddies for %r: %s',
+                                metadata['uid'], exception)
+            else:
+                row.append((nick, XoColor(color)))
+                continue
+
+        row.append(None)
+
+    return row
+
+
 class ListModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeDragSource):
     __gtype_name__ = 'JournalListModel'
 
@@ -86,6 +218,10 @@ class ListModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeDragSource):
 
         self._result_set.ready.connect(self.__result_set_ready_cb)
         self._result_set.progress.connect(self.__result_set_progress_cb)
+        self._result_set.entry_inserted.connect(
+            self.__result_set_entry_inserted_cb)
+        self._result_set.entry_deleted.connect(
+            self.__result_set_entry_deleted_cb)
 
     def __result_set_ready_cb(self, **kwargs):
         self.emit('ready')
@@ -93,12 +229,36 @@ class ListModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeDragSource):
     def __result_set_progress_cb(self, **kwargs):
         self.emit('progress')
 
+    def __result_set_entry_inserted_cb(self, position, **kwargs):
+        self._last_requested_index = None
+        self._cached_row = None
+
+        iterator = Gtk.TreeIter()
+        iterator.user_data = position
+        self.row_inserted(Gtk.TreePath((position,)), iterator)
+
+    def __result_set_entry_deleted_cb(self, position, **kwargs):
+        self._last_requested_index = None
+        self._cached_row = None
+
+        self.row_deleted(Gtk.TreePath((position,)))
+
     def setup(self):
         self._result_set.setup()
 
     def stop(self):
         self._result_set.stop()
 
+    def is_monitored(self):
+        return self._result_set.is_monitored()
+
+    def update_dates(self):
+        """Make the elapsed time columns get recomputed
+        """
+        self._last_requested_index = None
+        self._cached_row = None
+        _get_row_cache().update_dates()
+
     def get_metadata(self, path):
         return model.get(self[path][ListModel.COLUMN_UID])
 
@@ -129,76 +289,7 @@ class ListModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeDragSource):
         metadata = self._result_set.read()
 
         self._last_requested_index = index
-        self._cached_row = []
-        self._cached_row.append(metadata['uid'])
-        self._cached_row.append(metadata.get('keep', '0') == '1')
-        self._cached_row.append(misc.get_icon_name(metadata))
-
-        if misc.is_activity_bundle(metadata):
-            xo_color = XoColor('%s,%s' % (style.COLOR_BUTTON_GREY.get_svg(),
-                                          style.COLOR_TRANSPARENT.get_svg()))
-        else:
-            xo_color = misc.get_icon_color(metadata)
-        self._cached_row.append(xo_color)
-
-        title = GObject.markup_escape_text(metadata.get('title',
-                                           _('Untitled')))
-        self._cached_row.append('<b>%s</b>' % (title, ))
-
-        try:
-            timestamp = float(metadata.get('timestamp', 0))
-        except (TypeError, ValueError):
-            timestamp_content = _('Unknown')
-        else:
-            timestamp_content = util.timestamp_to_elapsed_string(timestamp)
-        self._cached_row.append(timestamp_content)
-
-        try:
-            creation_time = float(metadata.get('creation_time'))
-        except (TypeError, ValueError):
-            self._cached_row.append(_('Unknown'))
-        else:
-            self._cached_row.append(
-                util.timestamp_to_elapsed_string(float(creation_time)))
-
-        try:
-            size = int(metadata.get('filesize'))
-        except (TypeError, ValueError):
-            size = None
-        self._cached_row.append(util.format_size(size))
-
-        try:
-            progress = int(float(metadata.get('progress', 100)))
-        except (TypeError, ValueError):
-            progress = 100
-        self._cached_row.append(progress)
-
-        buddies = []
-        if metadata.get('buddies'):
-            try:
-                buddies = json.loads(metadata['buddies']).values()
-            except json.decoder.JSONDecodeError, exception:
-                logging.warning('Cannot decode buddies for %r: %s',
-                                metadata['uid'], exception)
-
-        if not isinstance(buddies, list):
-            logging.warning('Content of buddies for %r is not a list: %r',
-                            metadata['uid'], buddies)
-            buddies = []
-
-        for n_ in xrange(0, 3):
-            if buddies:
-                try:
-                    nick, color = buddies.pop(0)
-                except (AttributeError, ValueError), exception:
-                    logging.warning('Malformed buddies for %r: %s',
-                                    metadata['uid'], exception)
-                else:
-                    self._cached_row.append((nick, XoColor(color)))
-                    continue
-
-            self._cached_row.append(None)
-
+        self._cached_row = _get_row_cache().get_row(metadata)
         return self._cached_row[column]
 
     def do_iter_nth_child(self, parent_iter, n):
@@ -17,6 +17,7 @@
 import logging
 from gettext import gettext as _
 import time
+from functools import partial
 
 from gi.repository import GLib
 from gi.repository import GObject
@@ -39,6 +40,14 @@ from jarabe.journal import misc
 UPDATE_INTERVAL = 300
 
 
+def _ignore_model_reply_cb(*args):
+    pass
+
+
+def _log_model_error_cb(error):
+    logging.error('Journal datastore request failed: %s', error)
+
+
 class TreeView(Gtk.TreeView):
     __gtype_name__ = 'JournalTreeView'
 
@@ -113,24 +122,20 @@ class BaseListView(Gtk.Bin):
         self._refresh_idle_handler = None
         self._update_dates_timer = None
 
-        model.created.connect(self.__model_created_cb)
-        model.updated.connect(self.__model_updated_cb)
-        model.deleted.connect(self.__model_deleted_cb)
+        model.changes.connect(self.__model_changes_cb)
 
-    def __model_created_cb(self, sender, signal, object_id):
-        if self._is_new_item_visible(object_id):
-            self._set_dirty()
-
-    def __model_updated_cb(self, sender, signal, object_id):
-        if self._is_new_item_visible(object_id):
-            self._set_dirty()
-
-    def __model_deleted_cb(self, sender, signal, object_id):
-        if self._is_new_item_visible(object_id):
-            self._set_dirty()
+    def __model_changes_cb(self, sender, signal, created, updated, deleted):
+        for object_id in created + updated + deleted:
+            if self._is_new_item_visible(object_id):
+                self._set_dirty()
+                return
 
     def _is_new_item_visible(self, object_id):
         """Check if the created item is part of the currently selected view"""
+        if self._model is not None and self._model.is_monitored():
+            # the model will update itself
+            return False
+
         if self._query['mountpoints'] == ['/']:
             return not object_id.startswith('/')
         else:
@@ -272,14 +277,18 @@ class BaseListView(Gtk.Bin):
 
     def __favorite_clicked_cb(self, cell, path):
         row = self._model[path]
-        metadata = model.get(row[ListModel.COLUMN_UID])
+        model.get_async(row[ListModel.COLUMN_UID],
+                        self.__favorite_get_reply_cb, _log_model_error_cb)
+
+    def __favorite_get_reply_cb(self, metadata):
         if not model.is_editable(metadata):
             return
         if metadata.get('keep', 0) == '1':
             metadata['keep'] = '0'
         else:
             metadata['keep'] = '1'
-        model.write(metadata, update_mtime=False)
+        model.write_async(metadata, _ignore_model_reply_cb,
+                          _log_model_error_cb, update_mtime=False)
 
     def update_with_query(self, query_dict):
         logging.debug('ListView.update_with_query')
@@ -452,6 +461,7 @@ class BaseListView(Gtk.Bin):
 
         path, end_path = visible_range
         tree_model = self.tree_view.get_model()
+        tree_model.update_dates()
 
         while True:
             cel_rect = self.tree_view.get_cell_area(path,
@@ -555,13 +565,17 @@ class ListView(BaseListView):
             return
 
         row = self.tree_view.get_model()[path]
-        metadata = model.get(row[ListModel.COLUMN_UID])
+        model.get_async(row[ListModel.COLUMN_UID],
+                        partial(self.__title_get_reply_cb, path, column),
+                        _log_model_error_cb)
+
+    def __title_get_reply_cb(self, path, column, metadata):
         self.cell_title.props.editable = model.is_editable(metadata)
         if self.cell_title.props.editable:
             self.emit('title-edit-started')
 
-        tree_view.set_cursor_on_cell(path, column, self.cell_title,
-                                     start_editing=True)
+        self.tree_view.set_cursor_on_cell(path, column, self.cell_title,
+                                          start_editing=True)
 
     def __detail_cell_clicked_cb(self, cell, path):
         row = self.tree_view.get_model()[path]
@@ -575,17 +589,22 @@ class ListView(BaseListView):
 
     def __icon_clicked_cb(self, cell, path):
         row = self.tree_view.get_model()[path]
-        metadata = model.get(row[ListModel.COLUMN_UID])
-        misc.resume(metadata)
+        model.get_async(row[ListModel.COLUMN_UID], misc.resume,
+                        _log_model_error_cb)
 
     def __cell_title_edited_cb(self, cell, path, new_text):
         row = self._model[path]
-        metadata = model.get(row[ListModel.COLUMN_UID])
-        metadata['title'] = new_text
-        model.write(metadata, update_mtime=False)
+        model.get_async(row[ListModel.COLUMN_UID],
+                        partial(self.__title_edited_get_reply_cb, new_text),
+                        _log_model_error_cb)
         self.cell_title.props.editable = False
         self.emit('title-edit-finished')
 
+    def __title_edited_get_reply_cb(self, new_text, metadata):
+        metadata['title'] = new_text
+        model.write_async(metadata, _ignore_model_reply_cb,
+                          _log_model_error_cb, update_mtime=False)
+
     def __editing_canceled_cb(self, cell):
         self.cell_title.props.editable = False
         self.emit('title-edit-finished')
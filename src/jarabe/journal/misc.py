@@ -17,6 +17,7 @@
 import logging
 import time
 import os
+from collections import OrderedDict
 from gettext import gettext as _
 
 from gi.repository import Gio
@@ -41,7 +42,46 @@ from jarabe.journal import model
 from jarabe.journal import journalwindow
 
 
+# Icon file names resolved so far, by mime type, by bundle id and, for
+# activity bundles stored in the journal, by (uid, timestamp)
+_mime_icons = {}
+_bundle_icons = {}
+_journal_bundle_icons = OrderedDict()
+_MAX_JOURNAL_BUNDLE_ICONS = 100
+_icon_caches_connected = False
+
+
+def _connect_icon_caches():
+    global _icon_caches_connected
+    if _icon_caches_connected:
+        return
+    _icon_caches_connected = True
+
+    Gtk.IconTheme.get_default().connect('changed',
+                                        _icon_theme_changed_cb)
+
+    registry = bundleregistry.get_registry()
+    registry.connect('bundle-added', _bundle_registry_changed_cb)
+    registry.connect('bundle-removed', _bundle_registry_changed_cb)
+    registry.connect('bundle-changed', _bundle_registry_changed_cb)
+
+
+def _icon_theme_changed_cb(icon_theme):
+    _mime_icons.clear()
+    _bundle_icons.clear()
+
+
+def _bundle_registry_changed_cb(registry, bundle):
+    _bundle_icons.clear()
+
+
 def _get_icon_for_mime(mime_type):
+    if mime_type not in _mime_icons:
+        _mime_icons[mime_type] = _find_icon_for_mime(mime_type)
+    return _mime_icons[mime_type]
+
+
+def _find_icon_for_mime(mime_type):
     generic_types = mime.get_all_generic_types()
     for generic_type in generic_types:
         if mime_type in generic_type.mime_types:
@@ -57,7 +97,40 @@ def _get_icon_for_mime(mime_type):
             return file_name
 
 
+def _get_icon_for_bundle_id(bundle_id):
+    if bundle_id not in _bundle_icons:
+        file_name = None
+        activity_info = bundleregistry.get_registry().get_bundle(bundle_id)
+        if activity_info:
+            file_name = activity_info.get_icon()
+        _bundle_icons[bundle_id] = file_name
+    return _bundle_icons[bundle_id]
+
+
+def _get_icon_for_journal_bundle(metadata):
+    key = (metadata['uid'], metadata.get('timestamp'))
+    if key in _journal_bundle_icons:
+        return _journal_bundle_icons[key]
+
+    file_name = None
+    file_path = model.get_file(metadata['uid'])
+    if file_path is not None and os.path.exists(file_path):
+        try:
+            bundle = ActivityBundle(file_path)
+            # the icon of a zipped bundle is a TempFilePath, keeping it
+            # here keeps the file around
+            file_name = bundle.get_icon()
+        except Exception:
+            logging.exception('Could not read bundle')
+
+    _journal_bundle_icons[key] = file_name
+    while len(_journal_bundle_icons) > _MAX_JOURNAL_BUNDLE_ICONS:
+        _journal_bundle_icons.popitem(last=False)
+    return file_name
+
+
 def get_icon_name(metadata):
+    _connect_icon_caches()
     file_name = None
 
     bundle_id = metadata.get('activity', '')
@@ -65,18 +138,10 @@ def get_icon_name(metadata):
         bundle_id = metadata.get('bundle_id', '')
 
     if bundle_id:
-        activity_info = bundleregistry.get_registry().get_bundle(bundle_id)
-        if activity_info:
-            file_name = activity_info.get_icon()
+        file_name = _get_icon_for_bundle_id(bundle_id)
 
     if file_name is None and is_activity_bundle(metadata):
-        file_path = model.get_file(metadata['uid'])
-        if file_path is not None and os.path.exists(file_path):
-            try:
-                bundle = ActivityBundle(file_path)
-                file_name = bundle.get_icon()
-            except Exception:
-                logging.exception('Could not read bundle')
+        file_name = _get_icon_for_journal_bundle(metadata)
 
     if file_name is None:
         file_name = _get_icon_for_mime(metadata.get('mime_type', ''))
@@ -22,20 +22,28 @@ from datetime import datetime
 import time
 import shutil
 import tempfile
+import threading
+import Queue
 from stat import S_IFLNK, S_IFMT, S_IFDIR, S_IFREG
 import re
-from operator import itemgetter
+from collections import deque, OrderedDict
+import bisect
+from functools import partial
 import json
 from gettext import gettext as _
 
 from gi.repository import GObject
 import dbus
 from gi.repository import Gio
+from gi.repository import GLib
 from gi.repository import GConf
 
 from sugar3 import dispatch
 from sugar3 import mime
 from sugar3 import util
+from sugar3 import env
+
+from jarabe.journal import volumeindex
 
 
 DS_DBUS_SERVICE = 'org.laptop.sugar.DataStore'
@@ -47,57 +55,111 @@ PROPERTIES = ['activity', 'activity_id', 'buddies', 'bundle_id',
               'creation_time', 'filesize', 'icon-color', 'keep', 'mime_type',
               'mountpoint', 'mtime', 'progress', 'timestamp', 'title', 'uid']
 
-MIN_PAGES_TO_CACHE = 3
-MAX_PAGES_TO_CACHE = 5
+MAX_PAGES_TO_CACHE = 50
+
+# Time in seconds InplaceResultSet scans before yielding to the main loop
+_SCAN_TIME_SLICE = 0.02
+
+# Directories above this number are not watched for changes, to stay well
+# below the inotify limits
+_MAX_MONITORED_DIRECTORIES = 2000
+
+# Scan mounted volumes in worker threads instead of the main loop
+_THREADED_SCAN_KEY = '/desktop/sugar/journal/threaded_scan'
+_SCAN_THREADS = 4
+_SCAN_BATCH_SIZE = 500
+
+# Time in milliseconds change notifications are gathered before being
+# delivered as one batch on the changes signal
+_CHANGES_BATCH_DELAY = 200
+
+# Seconds an asynchronous datastore call may take before failing
+_DATASTORE_TIMEOUT_KEY = '/desktop/sugar/journal/datastore_timeout'
+_DEFAULT_DATASTORE_TIMEOUT = 30
 
 JOURNAL_METADATA_DIR = '.Sugar-Metadata'
 
 _datastore = None
+_datastore_page_cache = None
+_datastore_timeout = None
+_gets_in_flight = {}
 created = dispatch.Signal()
 updated = dispatch.Signal()
 deleted = dispatch.Signal()
+changes = dispatch.Signal()
 
 
-class _Cache(object):
+class _PageCache(object):
+    """Least recently used cache of result pages
 
-    __gtype_name__ = 'model_Cache'
+    Pages are keyed by (query key, page number); the total number of
+    entries of each query is cached alongside. Clearing the cache bumps
+    its generation, so that replies to requests made before can be told
+    apart and dropped.
 
-    def __init__(self, entries=None):
-        self._array = []
-        if entries is not None:
-            self.append_all(entries)
+    """
 
-    def prepend_all(self, entries):
-        self._array[0:0] = entries
+    __gtype_name__ = 'model_PageCache'
 
-    def append_all(self, entries):
-        self._array += entries
+    def __init__(self, max_pages):
+        self._max_pages = max_pages
+        self._pages = OrderedDict()
+        self._counts = {}
+        self.generation = 0
 
-    def __len__(self):
-        return len(self._array)
+    def get_count(self, query_key):
+        return self._counts.get(query_key, -1)
 
-    def __getitem__(self, key):
-        return self._array[key]
+    def set_count(self, query_key, count):
+        self._counts[query_key] = count
 
-    def __delitem__(self, key):
-        del self._array[key]
+    def get(self, key):
+        entries = self._pages.pop(key, None)
+        if entries is not None:
+            self._pages[key] = entries
+        return entries
+
+    def put(self, key, entries):
+        self._pages.pop(key, None)
+        self._pages[key] = entries
+        while len(self._pages) > self._max_pages:
+            self._pages.popitem(last=False)
+
+    def clear(self):
+        self._pages.clear()
+        self._counts.clear()
+        self.generation += 1
+
+    def __contains__(self, key):
+        return key in self._pages
+
+    def __len__(self):
+        return len(self._pages)
 
 
 class BaseResultSet(object):
     """Encapsulates the result of a query
     """
 
+    # Number of pages fetched asynchronously ahead of the one being read
+    _PAGES_TO_READ_AHEAD = 0
+
     def __init__(self, query, page_size):
         self._total_count = -1
         self._position = -1
         self._query = query
+        self._query_key = repr(sorted(query.items()))
         self._page_size = page_size
 
-        self._offset = 0
-        self._cache = _Cache()
+        self._cache = _PageCache(MAX_PAGES_TO_CACHE)
+        self._last_page = 0
+        self._read_ahead_direction = 1
+        self._pages_in_flight = set()
 
         self.ready = dispatch.Signal()
         self.progress = dispatch.Signal()
+        self.entry_inserted = dispatch.Signal()
+        self.entry_deleted = dispatch.Signal()
 
     def setup(self):
         self.ready.send(self)
@@ -105,13 +167,24 @@ class BaseResultSet(object):
     def stop(self):
         pass
 
+    def is_monitored(self):
+        """Whether the result set keeps itself up to date
+
+        Monitored result sets emit entry_inserted and entry_deleted when
+        entries change, so they don't need to be recreated.
+
+        """
+        return False
+
+    def _invalidate_cache(self):
+        self._cache.clear()
+
     def get_length(self):
         if self._total_count == -1:
-            query = self._query.copy()
-            query['limit'] = self._page_size * MIN_PAGES_TO_CACHE
-            entries, self._total_count = self.find(query)
-            self._cache.append_all(entries)
-            self._offset = 0
+            self._total_count = self._cache.get_count(self._query_key)
+        if self._total_count == -1:
+            self._total_count = self.find_count(self._query)
+            self._cache.set_count(self._query_key, self._total_count)
         return self._total_count
 
     length = property(get_length)
@@ -119,6 +192,17 @@ class BaseResultSet(object):
     def find(self, query):
         raise NotImplementedError()
 
+    def find_count(self, query):
+        """Return the number of entries matching the query
+        """
+        query = query.copy()
+        query['limit'] = 0
+        entries_, total_count = self.find(query)
+        return total_count
+
+    def find_async(self, query, reply_cb, error_cb):
+        raise NotImplementedError()
+
     def seek(self, position):
         self._position = position
 
@@ -126,85 +210,63 @@ class BaseResultSet(object):
         if self._position == -1:
             self.seek(0)
 
-        if self._position < self._offset:
-            remaining_forward_entries = 0
-        else:
-            remaining_forward_entries = self._offset + len(self._cache) - \
-                                        self._position
-
-        if self._position > self._offset + len(self._cache):
-            remaining_backwards_entries = 0
-        else:
-            remaining_backwards_entries = self._position - self._offset
-
-        last_cached_entry = self._offset + len(self._cache)
-
-        if remaining_forward_entries <= 0 and remaining_backwards_entries <= 0:
-
-            # Total cache miss: remake it
-            limit = self._page_size * MIN_PAGES_TO_CACHE
-            offset = max(0, self._position - limit / 2)
-            logging.debug('remaking cache, offset: %r limit: %r', offset,
-                limit)
-            query = self._query.copy()
-            query['limit'] = limit
-            query['offset'] = offset
-            entries, self._total_count = self.find(query)
-
-            del self._cache[:]
-            self._cache.append_all(entries)
-            self._offset = offset
-
-        elif (remaining_forward_entries <= 0 and
-              remaining_backwards_entries > 0):
-
-            # Add one page to the end of cache
-            logging.debug('appending one more page, offset: %r',
-                last_cached_entry)
+        page = self._position / self._page_size
+        entries = self._cache.get((self._query_key, page))
+        if entries is None:
+            logging.debug('fetching page %r', page)
             query = self._query.copy()
             query['limit'] = self._page_size
-            query['offset'] = last_cached_entry
+            query['offset'] = page * self._page_size
             entries, self._total_count = self.find(query)
+            self._cache.put((self._query_key, page), entries)
+
+        if page != self._last_page:
+            if page > self._last_page:
+                self._read_ahead_direction = 1
+            else:
+                self._read_ahead_direction = -1
+            self._last_page = page
+        self._read_ahead(page)
+
+        return entries[self._position - page * self._page_size]
+
+    def _read_ahead(self, page):
+        for i in range(1, self._PAGES_TO_READ_AHEAD + 1):
+            next_page = page + i * self._read_ahead_direction
+            if next_page < 0 or \
+                    next_page * self._page_size >= self._total_count:
+                break
 
-            # update cache
-            self._cache.append_all(entries)
-
-            # apply the cache limit
-            cache_limit = self._page_size * MAX_PAGES_TO_CACHE
-            objects_excess = len(self._cache) - cache_limit
-            if objects_excess > 0:
-                self._offset += objects_excess
-                del self._cache[:objects_excess]
-
-        elif remaining_forward_entries > 0 and \
-                remaining_backwards_entries <= 0 and self._offset > 0:
-
-            # Add one page to the beginning of cache
-            limit = min(self._offset, self._page_size)
-            self._offset = max(0, self._offset - limit)
+            key = (self._query_key, next_page)
+            if key in self._cache or key in self._pages_in_flight:
+                continue
 
-            logging.debug('prepending one more page, offset: %r limit: %r',
-                self._offset, limit)
+            logging.debug('reading ahead page %r', next_page)
             query = self._query.copy()
-            query['limit'] = limit
-            query['offset'] = self._offset
-            entries, self._total_count = self.find(query)
-
-            # update cache
-            self._cache.prepend_all(entries)
+            query['limit'] = self._page_size
+            query['offset'] = next_page * self._page_size
+            self._pages_in_flight.add(key)
+            self.find_async(query,
+                            partial(self.__read_ahead_reply_cb, key,
+                                    self._cache.generation),
+                            partial(self.__read_ahead_error_cb, key))
 
-            # apply the cache limit
-            cache_limit = self._page_size * MAX_PAGES_TO_CACHE
-            objects_excess = len(self._cache) - cache_limit
-            if objects_excess > 0:
-                del self._cache[-objects_excess:]
+    def __read_ahead_reply_cb(self, key, generation, entries, total_count):
+        self._pages_in_flight.discard(key)
+        if generation == self._cache.generation:
+            self._cache.put(key, entries)
 
-        return self._cache[self._position - self._offset]
+    def __read_ahead_error_cb(self, key, error):
+        self._pages_in_flight.discard(key)
+        logging.error('Error reading ahead page %r: %s', key[1], error)
 
 
 class DatastoreResultSet(BaseResultSet):
     """Encapsulates the result of a query on the datastore
     """
+
+    _PAGES_TO_READ_AHEAD = 2
+
     def __init__(self, query, page_size):
 
         if query.get('query', '') and not query['query'].startswith('"'):
@@ -220,6 +282,45 @@ class DatastoreResultSet(BaseResultSet):
 
         BaseResultSet.__init__(self, query, page_size)
 
+        # Pages of the datastore are shared by all the result sets and
+        # survive a refresh with the same query
+        global _datastore_page_cache
+        if _datastore_page_cache is None:
+            _datastore_page_cache = _PageCache(MAX_PAGES_TO_CACHE)
+        self._cache = _datastore_page_cache
+        self._stopped = False
+
+    def setup(self):
+        if self._cache.get_count(self._query_key) != -1:
+            self.ready.send(self)
+            return
+
+        # Fetch the first page together with the number of entries, so
+        # that the view does not block on the datastore when it is shown
+        key = (self._query_key, 0)
+        query = self._query.copy()
+        query['limit'] = self._page_size
+        query['offset'] = 0
+        self.find_async(query,
+                        partial(self.__setup_reply_cb, key,
+                                self._cache.generation),
+                        self.__setup_error_cb)
+
+    def __setup_reply_cb(self, key, generation, entries, total_count):
+        if generation == self._cache.generation:
+            self._cache.put(key, entries)
+            self._cache.set_count(self._query_key, total_count)
+        if not self._stopped:
+            self.ready.send(self)
+
+    def __setup_error_cb(self, error):
+        logging.error('Error querying the datastore: %s', error)
+        if not self._stopped:
+            self.ready.send(self)
+
+    def stop(self):
+        self._stopped = True
+
     def find(self, query):
         entries, total_count = _get_datastore().find(query, PROPERTIES,
                                                      byte_arrays=True)
@@ -229,6 +330,24 @@ class DatastoreResultSet(BaseResultSet):
 
         return entries, total_count
 
+    def find_count(self, query):
+        query = query.copy()
+        query['limit'] = 0
+        entries_, total_count = _get_datastore().find(query, ['uid'],
+                                                      byte_arrays=True)
+        return total_count
+
+    def find_async(self, query, reply_cb, error_cb):
+        def find_reply_cb(entries, total_count):
+            for entry in entries:
+                entry['mountpoint'] = '/'
+            reply_cb(entries, total_count)
+
+        _get_datastore().find(query, PROPERTIES, byte_arrays=True,
+                              timeout=_get_datastore_timeout(),
+                              reply_handler=find_reply_cb,
+                              error_handler=error_cb)
+
 
 class InplaceResultSet(BaseResultSet):
     """Encapsulates the result of a query on a mount point
@@ -237,10 +356,19 @@ class InplaceResultSet(BaseResultSet):
         BaseResultSet.__init__(self, query, page_size)
         self._mount_point = mount_point
         self._file_list = None
-        self._pending_directories = []
-        self._visited_directories = []
-        self._pending_files = []
+        self._pending_directories = deque()
+        self._visited_directories = set()
+        self._pending_files = deque()
+        self._index = None
+        self._lock = threading.Lock()
         self._stopped = False
+        self._scanned_directories = []
+        self._sort_keys = []
+        self._file_infos = {}
+        self._monitors = {}
+        self._pending_changes = deque()
+        self._pending_changes_set = set()
+        self._changes_sid = None
 
         query_text = query.get('query', '')
         if query_text.startswith('"') and query_text.endswith('"'):
@@ -266,24 +394,175 @@ class InplaceResultSet(BaseResultSet):
 
     def setup(self):
         self._file_list = []
-        self._pending_directories = [self._mount_point]
-        self._visited_directories = []
-        self._pending_files = []
-        GObject.idle_add(self._scan)
+        self._visited_directories = set()
+        self._index = volumeindex.VolumeIndex(self._mount_point,
+                                              JOURNAL_METADATA_DIR)
+
+        client = GConf.Client.get_default()
+        if client.get_bool(_THREADED_SCAN_KEY):
+            thread = threading.Thread(target=self._scan_in_threads)
+            thread.daemon = True
+            thread.start()
+        else:
+            self._index.load()
+            self._pending_directories = deque([self._mount_point])
+            self._pending_files = deque()
+            GObject.idle_add(self._scan)
 
     def stop(self):
         self._stopped = True
+        self._stop_monitoring()
+
+    def is_monitored(self):
+        return bool(self._monitors)
 
     def setup_ready(self):
+        self._file_list.sort(key=self._get_sort_key)
+        self._sort_keys = [self._get_sort_key(file_info)
+                           for file_info in self._file_list]
+        self._file_infos = dict([(file_info[0], file_info)
+                                 for file_info in self._file_list])
+        self._start_monitoring()
+        self.ready.send(self)
+
+    def _get_sort_key(self, file_info):
         if self._sort[1:] == 'filesize':
-            keygetter = itemgetter(3)
+            value = file_info[3]
         else:
             # timestamp
-            keygetter = itemgetter(2)
-        self._file_list.sort(lambda a, b: cmp(b, a),
-                             key=keygetter,
-                             reverse=(self._sort[0] == '-'))
-        self.ready.send(self)
+            value = file_info[2]
+
+        # '+' sorts from newest (biggest) to oldest (smallest)
+        if self._sort[0] == '+':
+            return -value
+        else:
+            return value
+
+    def _start_monitoring(self):
+        if len(self._scanned_directories) > _MAX_MONITORED_DIRECTORIES:
+            logging.debug('Not monitoring %r, too many directories (%d)',
+                          self._mount_point, len(self._scanned_directories))
+            return
+
+        for dir_path, id_tuple in self._scanned_directories:
+            self._monitor_directory(dir_path, id_tuple)
+        self._scanned_directories = []
+
+        updated.connect(self.__model_updated_cb)
+
+    def _stop_monitoring(self):
+        updated.disconnect(self.__model_updated_cb)
+        for monitor, id_tuple_ in self._monitors.values():
+            monitor.cancel()
+        self._monitors = {}
+
+        if self._changes_sid is not None:
+            GObject.source_remove(self._changes_sid)
+            self._changes_sid = None
+
+    def _monitor_directory(self, dir_path, id_tuple):
+        if dir_path in self._monitors:
+            return
+        try:
+            monitor = Gio.File.new_for_path(dir_path).monitor_directory(
+                Gio.FileMonitorFlags.NONE, None)
+        except GLib.GError:
+            logging.exception('Could not monitor directory %r', dir_path)
+            return
+        monitor.connect('changed', self.__directory_changed_cb)
+        self._monitors[dir_path] = (monitor, id_tuple)
+
+    def __directory_changed_cb(self, monitor, file_, other_file, event_type):
+        if event_type in (Gio.FileMonitorEvent.CREATED,
+                          Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+                          Gio.FileMonitorEvent.DELETED):
+            self._queue_change(file_.get_path())
+
+    def __model_updated_cb(self, sender, signal, object_id):
+        if object_id.startswith(self._mount_point + '/'):
+            self._queue_change(object_id)
+
+    def _queue_change(self, path):
+        if path in self._pending_changes_set:
+            return
+        self._pending_changes.append(path)
+        self._pending_changes_set.add(path)
+
+        if self._changes_sid is None:
+            self._changes_sid = GObject.idle_add(self._apply_changes)
+
+    def _apply_changes(self):
+        deadline = time.time() + _SCAN_TIME_SLICE
+        while self._pending_changes and time.time() < deadline:
+            path = self._pending_changes.popleft()
+            self._pending_changes_set.discard(path)
+            self._apply_change(path)
+
+        if self._pending_changes:
+            return True
+
+        self._changes_sid = None
+        return False
+
+    def _apply_change(self, path):
+        """Bring the entry of a changed path up to date
+        """
+        self._remove_file(path)
+        if path in self._monitors and not os.path.isdir(path):
+            self._remove_directory(path)
+
+        if os.path.basename(path).startswith('.'):
+            return
+
+        file_info, dir_path = self._scan_a_file(path, None)
+        if dir_path is not None:
+            for child_path, cached_entry_ in self._scan_a_directory(dir_path):
+                self._queue_change(child_path)
+            for dir_path, id_tuple in self._scanned_directories:
+                self._monitor_directory(dir_path, id_tuple)
+            self._scanned_directories = []
+        elif file_info is not None:
+            self._insert_file(file_info)
+
+    def _insert_file(self, file_info):
+        key = self._get_sort_key(file_info)
+        position = bisect.bisect_right(self._sort_keys, key)
+        self._sort_keys.insert(position, key)
+        self._file_list.insert(position, file_info)
+        self._file_infos[file_info[0]] = file_info
+
+        self._total_count = len(self._file_list)
+        self._invalidate_cache()
+        self.entry_inserted.send(self, position=position)
+
+    def _remove_file(self, path):
+        file_info = self._file_infos.pop(path, None)
+        if file_info is None:
+            return
+
+        key = self._get_sort_key(file_info)
+        position = bisect.bisect_left(self._sort_keys, key)
+        while self._file_list[position][0] != path:
+            position += 1
+        del self._sort_keys[position]
+        del self._file_list[position]
+
+        self._total_count = len(self._file_list)
+        self._invalidate_cache()
+        self.entry_deleted.send(self, position=position)
+
+    def _remove_directory(self, dir_path):
+        prefix = dir_path + '/'
+        for path in self._file_infos.keys():
+            if path.startswith(prefix):
+                self._remove_file(path)
+
+        for path in self._monitors.keys():
+            if path == dir_path or path.startswith(prefix):
+                monitor, id_tuple = self._monitors.pop(path)
+                monitor.cancel()
+                with self._lock:
+                    self._visited_directories.discard(id_tuple)
 
     def find(self, query):
         if self._file_list is None:
@@ -317,66 +596,144 @@ class InplaceResultSet(BaseResultSet):
 
         self.progress.send(self)
 
-        if self._pending_files:
-            self._scan_a_file()
-            return True
+        deadline = time.time() + _SCAN_TIME_SLICE
+        while time.time() < deadline:
+            if self._pending_files:
+                full_path, cached_entry = self._pending_files.popleft()
+                file_info, dir_path = self._scan_a_file(full_path,
+                                                        cached_entry)
+                if dir_path is not None:
+                    self._pending_directories.append(dir_path)
+                elif file_info is not None:
+                    self._file_list.append(file_info)
+            elif self._pending_directories:
+                dir_path = self._pending_directories.popleft()
+                self._pending_files.extend(self._scan_a_directory(dir_path))
+            else:
+                self._index.save()
+                self.setup_ready()
+                return False
 
-        if self._pending_directories:
-            self._scan_a_directory()
-            return True
+        return True
 
-        self.setup_ready()
-        self._visited_directories = []
-        return False
+    def _scan_in_threads(self):
+        """Scan the mount point using a pool of worker threads
 
-    def _scan_a_file(self):
-        full_path = self._pending_files.pop(0)
-        metadata = None
+        Runs in its own thread; the workers hand the files they find to the
+        main loop in batches and setup_ready() gets called from the main
+        loop once all directories have been scanned.
 
-        try:
-            stat = os.lstat(full_path)
-        except OSError, e:
-            if e.errno != errno.ENOENT:
-                logging.exception(
-                    'Error reading metadata of file %r', full_path)
+        """
+        self._index.load()
+
+        directories = Queue.Queue()
+        directories.put(self._mount_point)
+
+        for i_ in range(_SCAN_THREADS):
+            worker = threading.Thread(target=self._scan_worker,
+                                      args=(directories, ))
+            worker.daemon = True
+            worker.start()
+
+        directories.join()
+        for i_ in range(_SCAN_THREADS):
+            directories.put(None)
+
+        if self._stopped:
             return
 
-        if S_IFMT(stat.st_mode) == S_IFLNK:
+        self._index.save()
+        GObject.idle_add(self._finish_scan)
+
+    def _scan_worker(self, directories):
+        while True:
+            dir_path = directories.get()
+            if dir_path is None:
+                return
             try:
-                link = os.readlink(full_path)
-            except OSError, e:
-                logging.exception(
-                    'Error reading target of link %r', full_path)
+                if not self._stopped:
+                    self._scan_directory_in_thread(dir_path, directories)
+            except Exception:
+                logging.exception('Error scanning directory %r', dir_path)
+            finally:
+                directories.task_done()
+
+    def _scan_directory_in_thread(self, dir_path, directories):
+        batch = []
+        for full_path, cached_entry in self._scan_a_directory(dir_path):
+            if self._stopped:
                 return
 
-            if not os.path.abspath(link).startswith(self._mount_point):
-                return
+            file_info, sub_dir_path = self._scan_a_file(full_path,
+                                                        cached_entry)
+            if sub_dir_path is not None:
+                directories.put(sub_dir_path)
+            elif file_info is not None:
+                batch.append(file_info)
 
-            try:
-                stat = os.stat(full_path)
+            if len(batch) >= _SCAN_BATCH_SIZE:
+                GObject.idle_add(self._add_scan_batch, batch)
+                batch = []
 
-            except OSError, e:
-                if e.errno != errno.ENOENT:
-                    logging.exception(
-                        'Error reading metadata of linked file %r', full_path)
-                return
+        if batch:
+            GObject.idle_add(self._add_scan_batch, batch)
+
+    def _add_scan_batch(self, batch):
+        if not self._stopped:
+            self._file_list.extend(batch)
+            self.progress.send(self)
+        return False
+
+    def _finish_scan(self):
+        if not self._stopped:
+            self.setup_ready()
+        return False
+
+    def _scan_a_file(self, full_path, cached_entry):
+        """Check a file found while scanning
+
+        Returns a (file_info, dir_path) tuple: file_info is set for files
+        matching the query and dir_path for directories still to be
+        scanned.
+
+        """
+        if cached_entry is not None:
+            stat, mime_type, metadata = cached_entry
+            if stat is None:
+                return None, None
+        else:
+            stat = self._stat_a_file(full_path)
+            mime_type = None
+            metadata = None
+            if stat is not None and S_IFMT(stat.st_mode) == S_IFREG:
+                mime_type, uncertain_result_ = \
+                        Gio.content_type_guess(filename=full_path, data=None)
+                metadata = _get_file_metadata_from_json(
+                    os.path.dirname(full_path), os.path.basename(full_path),
+                    fetch_preview=False)
+            with self._lock:
+                self._index.add_entry(full_path, stat, mime_type, metadata)
+            if stat is None:
+                return None, None
 
         if S_IFMT(stat.st_mode) == S_IFDIR:
             id_tuple = stat.st_ino, stat.st_dev
-            if not id_tuple in self._visited_directories:
-                self._visited_directories.append(id_tuple)
-                self._pending_directories.append(full_path)
-            return
+            with self._lock:
+                if id_tuple in self._visited_directories:
+                    return None, None
+                self._visited_directories.add(id_tuple)
+            return None, full_path
 
         if S_IFMT(stat.st_mode) != S_IFREG:
-            return
+            return None, None
 
         if self._regex is not None and \
                 not self._regex.match(full_path):
-            metadata = _get_file_metadata(full_path, stat,
-                                          fetch_preview=False)
-            if not metadata:
-                return
+            if metadata is None:
+                metadata = _get_file_metadata_from_stat(full_path, stat,
+                                                        mime_type)
+            elif 'filesize' not in metadata:
+                metadata['filesize'] = stat.st_size
             add_to_list = False
             for f in ['fulltext', 'title',
                       'description', 'tags']:
@@ -385,41 +742,90 @@ class InplaceResultSet(BaseResultSet):
                     add_to_list = True
                     break
             if not add_to_list:
-                return
+                return None, None
+        else:
+            metadata = None
 
         if self._date_start is not None and stat.st_mtime < self._date_start:
-            return
+            return None, None
 
         if self._date_end is not None and stat.st_mtime > self._date_end:
-            return
+            return None, None
 
-        if self._mime_types:
-            mime_type, uncertain_result_ = \
-                    Gio.content_type_guess(filename=full_path, data=None)
-            if mime_type not in self._mime_types:
-                return
+        if self._mime_types and mime_type not in self._mime_types:
+            return None, None
 
         file_info = (full_path, stat, int(stat.st_mtime), stat.st_size,
                      metadata)
-        self._file_list.append(file_info)
+        return file_info, None
 
-        return
+    def _stat_a_file(self, full_path):
+        """Return the stat of a file, following links inside the volume
 
-    def _scan_a_directory(self):
-        dir_path = self._pending_directories.pop(0)
+        Returns None for files that vanished or that should be skipped.
+
+        """
+        try:
+            stat = os.lstat(full_path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                logging.exception(
+                    'Error reading metadata of file %r', full_path)
+            return None
+
+        if S_IFMT(stat.st_mode) == S_IFLNK:
+            try:
+                link = os.readlink(full_path)
+            except OSError, e:
+                logging.exception(
+                    'Error reading target of link %r', full_path)
+                return None
+
+            if not os.path.abspath(link).startswith(self._mount_point):
+                return None
+
+            try:
+                stat = os.stat(full_path)
+
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    logging.exception(
+                        'Error reading metadata of linked file %r', full_path)
+                return None
+
+        return stat
+
+    def _scan_a_directory(self, dir_path):
+        """Return the (path, cached entry) pairs of a directory's files
+        """
+        try:
+            dir_stat = os.stat(dir_path)
+        except OSError, e:
+            if e.errno not in (errno.ENOENT, errno.EACCES):
+                logging.exception('Error reading directory %r', dir_path)
+            return []
+
+        id_tuple = (dir_stat.st_ino, dir_stat.st_dev)
+        with self._lock:
+            cached_entries = self._index.lookup_directory(dir_path, dir_stat)
+            if cached_entries is not None:
+                self._scanned_directories.append((dir_path, id_tuple))
+        if cached_entries is not None:
+            return [(dir_path + '/' + name, (stat, mime_type, metadata))
+                    for name, stat, mime_type, metadata in cached_entries]
 
         try:
             entries = os.listdir(dir_path)
         except OSError, e:
             if e.errno != errno.EACCES:
                 logging.exception('Error reading directory %r', dir_path)
-            return
+            return []
 
-        for entry in entries:
-            if entry.startswith('.'):
-                continue
-            self._pending_files.append(dir_path + '/' + entry)
-        return
+        with self._lock:
+            self._index.add_directory(dir_path, dir_stat)
+            self._scanned_directories.append((dir_path, id_tuple))
+        return [(dir_path + '/' + entry, None) for entry in entries
+                if not entry.startswith('.')]
 
 
 def _get_file_metadata(path, stat, fetch_preview=True):
@@ -437,8 +843,15 @@ def _get_file_metadata(path, stat, fetch_preview=True):
             metadata['filesize'] = stat.st_size
         return metadata
 
-    mime_type, uncertain_result_ = Gio.content_type_guess(filename=path,
-                                                          data=None)
+    return _get_file_metadata_from_stat(path, stat)
+
+
+def _get_file_metadata_from_stat(path, stat, mime_type=None):
+    """Create the metadata of a file without journal metadata
+    """
+    if mime_type is None:
+        mime_type, uncertain_result_ = Gio.content_type_guess(filename=path,
+                                                              data=None)
     return {'uid': path,
             'title': os.path.basename(path),
             'timestamp': stat.st_mtime,
@@ -506,18 +919,152 @@ def _get_datastore():
     return _datastore
 
 
+def _get_datastore_timeout():
+    global _datastore_timeout
+    if _datastore_timeout is None:
+        client = GConf.Client.get_default()
+        _datastore_timeout = client.get_int(_DATASTORE_TIMEOUT_KEY) or \
+                _DEFAULT_DATASTORE_TIMEOUT
+    return _datastore_timeout
+
+
+def _call_async(reply_cb, error_cb, function, *args, **kwargs):
+    """Run a local operation from the main loop and report its result
+    the way the asynchronous datastore calls do
+    """
+    def idle_cb():
+        try:
+            result = function(*args, **kwargs)
+        except Exception, e:
+            error_cb(e)
+        else:
+            reply_cb(result)
+        return False
+
+    GObject.idle_add(idle_cb)
+
+
+def _invalidate_datastore_page_cache():
+    if _datastore_page_cache is not None:
+        _datastore_page_cache.clear()
+
+
 def _datastore_created_cb(object_id):
+    _invalidate_datastore_page_cache()
     created.send(None, object_id=object_id)
 
 
 def _datastore_updated_cb(object_id):
+    _invalidate_datastore_page_cache()
+    # Later requests must not share the reply of an outdated one
+    _gets_in_flight.pop(object_id, None)
     updated.send(None, object_id=object_id)
 
 
 def _datastore_deleted_cb(object_id):
+    _invalidate_datastore_page_cache()
     deleted.send(None, object_id=object_id)
 
 
+class _ChangeAggregator(object):
+    """Gather created, updated and deleted notifications into batches
+
+    Notifications arriving within _CHANGES_BATCH_DELAY of the first one
+    are merged per object id and delivered together on the changes
+    signal, with the created, updated and deleted object ids as lists. An
+    object created and deleted within the same batch is not reported.
+
+    """
+
+    def __init__(self):
+        self.received = 0
+        self.delivered = 0
+        self.batches = 0
+        self._changes = OrderedDict()
+        self._timeout_sid = None
+
+        created.connect(self.__created_cb)
+        updated.connect(self.__updated_cb)
+        deleted.connect(self.__deleted_cb)
+
+    def __created_cb(self, sender, signal, object_id):
+        self._add_change(object_id, 'created')
+
+    def __updated_cb(self, sender, signal, object_id):
+        self._add_change(object_id, 'updated')
+
+    def __deleted_cb(self, sender, signal, object_id):
+        self._add_change(object_id, 'deleted')
+
+    def _add_change(self, object_id, change):
+        self.received += 1
+
+        previous = self._changes.get(object_id)
+        if previous == 'created':
+            if change == 'deleted':
+                del self._changes[object_id]
+                change = None
+            else:
+                change = 'created'
+        elif previous == 'deleted' and change != 'deleted':
+            change = 'updated'
+
+        if change is not None:
+            self._changes[object_id] = change
+
+        if self._timeout_sid is None:
+            self._timeout_sid = GObject.timeout_add(_CHANGES_BATCH_DELAY,
+                                                    self.__timeout_cb)
+
+    def __timeout_cb(self):
+        self._timeout_sid = None
+        self.flush()
+        return False
+
+    def flush(self):
+        if self._timeout_sid is not None:
+            GObject.source_remove(self._timeout_sid)
+            self._timeout_sid = None
+
+        if not self._changes:
+            return
+
+        batch = {'created': [], 'updated': [], 'deleted': []}
+        for object_id, change in self._changes.iteritems():
+            batch[change].append(object_id)
+        count = len(self._changes)
+        self._changes = OrderedDict()
+
+        self.batches += 1
+        self.delivered += count
+        logging.debug('Delivering %d journal changes, %d coalesced so far',
+                      count, self.received - self.delivered)
+
+        changes.send(None, **batch)
+
+    def get_statistics(self):
+        return {'received': self.received,
+                'delivered': self.delivered,
+                'coalesced': self.received - self.delivered,
+                'batches': self.batches}
+
+
+_change_aggregator = _ChangeAggregator()
+
+
+def flush_changes():
+    """Deliver the pending change notifications right away
+    """
+    _change_aggregator.flush()
+
+
+def get_change_statistics():
+    """Returns how many change notifications were received, delivered and
+    coalesced, and in how many batches they were delivered
+    """
+    return _change_aggregator.get_statistics()
+
+
 def find(query_, page_size):
     """Returns a ResultSet
     """
@@ -556,6 +1103,46 @@ def get(object_id):
     return metadata
 
 
+def get_async(object_id, reply_cb, error_cb):
+    """Asynchronous version of get()
+
+    reply_cb is called with the metadata and error_cb with the error.
+    Concurrent requests for the same object share one datastore call.
+    """
+    if os.path.exists(object_id):
+        _call_async(reply_cb, error_cb, get, object_id)
+        return
+
+    callbacks = _gets_in_flight.get(object_id)
+    if callbacks is not None:
+        callbacks.append((reply_cb, error_cb))
+        return
+
+    callbacks = [(reply_cb, error_cb)]
+    _gets_in_flight[object_id] = callbacks
+    _get_datastore().get_properties(
+        object_id, byte_arrays=True, timeout=_get_datastore_timeout(),
+        reply_handler=partial(_get_reply_cb, object_id, callbacks),
+        error_handler=partial(_get_error_cb, object_id, callbacks))
+
+
+def _get_reply_cb(object_id, callbacks, metadata):
+    if _gets_in_flight.get(object_id) is callbacks:
+        del _gets_in_flight[object_id]
+
+    metadata['mountpoint'] = '/'
+    for reply_cb, error_cb_ in callbacks:
+        reply_cb(metadata.copy())
+
+
+def _get_error_cb(object_id, callbacks, error):
+    if _gets_in_flight.get(object_id) is callbacks:
+        del _gets_in_flight[object_id]
+
+    for reply_cb_, error_cb in callbacks:
+        error_cb(error)
+
+
 def get_file(object_id):
     """Returns the file for an object
     """
@@ -571,13 +1158,55 @@ def get_file(object_id):
             return None
 
 
-def get_file_size(object_id):
-    """Return the file size for an object
+def get_file_async(object_id, reply_cb, error_cb):
+    """Asynchronous version of get_file()
     """
-    logging.debug('get_file_size %r', object_id)
     if os.path.exists(object_id):
-        return os.stat(object_id).st_size
+        _call_async(reply_cb, error_cb, get_file, object_id)
+        return
+
+    def get_filename_reply_cb(file_path):
+        if file_path:
+            reply_cb(util.TempFilePath(file_path))
+        else:
+            reply_cb(None)
 
+    _get_datastore().get_filename(object_id,
+                                  timeout=_get_datastore_timeout(),
+                                  reply_handler=get_filename_reply_cb,
+                                  error_handler=error_cb)
+
+
+def get_filesize_property(metadata):
+    """Returns the filesize property of an entry as an int, or None if it
+    is not known
+    """
+    if metadata is None:
+        return None
+    try:
+        return int(metadata['filesize'])
+    except (KeyError, ValueError, TypeError):
+        return None
+
+
+def _get_datastore_data_path(object_id):
+    # The datastore keeps the file of an entry in
+    # <datastore>/<first two characters of the uid>/<uid>/data
+    return os.path.join(env.get_profile_path('datastore'), object_id[:2],
+                        object_id, 'data')
+
+
+def _stat_datastore_file(object_id):
+    try:
+        return os.stat(_get_datastore_data_path(object_id)).st_size
+    except OSError, e:
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+            logging.exception('Error reading the datastore file of %r',
+                              object_id)
+        return None
+
+
+def _get_file_size_from_copy(object_id):
     file_path = _get_datastore().get_filename(object_id)
     if file_path:
         size = os.stat(file_path).st_size
@@ -587,6 +1216,73 @@ def get_file_size(object_id):
     return 0
 
 
+def get_file_size(object_id, metadata=None):
+    """Return the file size for an object
+
+    The size comes from the filesize property (of metadata, if given, or
+    else of the entry in the datastore) or from a stat of the file in the
+    datastore directory. Only if neither is available is the datastore
+    asked for a copy of the file.
+    """
+    logging.debug('get_file_size %r', object_id)
+    if os.path.exists(object_id):
+        return os.stat(object_id).st_size
+
+    size = get_filesize_property(metadata)
+    if size is None:
+        entries, total_count_ = _get_datastore().find(
+            {'uid': object_id}, ['filesize'], byte_arrays=True)
+        if entries:
+            size = get_filesize_property(entries[0])
+    if size is None:
+        size = _stat_datastore_file(object_id)
+    if size is None:
+        size = _get_file_size_from_copy(object_id)
+    return size
+
+
+def get_file_size_async(object_id, reply_cb, error_cb, metadata=None):
+    """Asynchronous version of get_file_size()
+    """
+    if os.path.exists(object_id) or \
+            get_filesize_property(metadata) is not None:
+        _call_async(reply_cb, error_cb, get_file_size, object_id, metadata)
+        return
+
+    def get_filename_reply_cb(file_path):
+        if not file_path:
+            reply_cb(0)
+            return
+
+        try:
+            size = os.stat(file_path).st_size
+            os.remove(file_path)
+        except EnvironmentError, e:
+            error_cb(e)
+        else:
+            reply_cb(size)
+
+    def find_reply_cb(entries, total_count):
+        size = None
+        if entries:
+            size = get_filesize_property(entries[0])
+        if size is None:
+            size = _stat_datastore_file(object_id)
+        if size is not None:
+            reply_cb(size)
+            return
+
+        _get_datastore().get_filename(object_id,
+                                      timeout=_get_datastore_timeout(),
+                                      reply_handler=get_filename_reply_cb,
+                                      error_handler=error_cb)
+
+    _get_datastore().find({'uid': object_id}, ['filesize'], byte_arrays=True,
+                          timeout=_get_datastore_timeout(),
+                          reply_handler=find_reply_cb,
+                          error_handler=error_cb)
+
+
 def get_unique_values(key):
     """Returns a list with the different values a property has taken
     """
@@ -594,6 +1290,16 @@ def get_unique_values(key):
     return _get_datastore().get_uniquevaluesfor(key, empty_dict)
 
 
+def get_unique_values_async(key, reply_cb, error_cb):
+    """Asynchronous version of get_unique_values()
+    """
+    empty_dict = dbus.Dictionary({}, signature='ss')
+    _get_datastore().get_uniquevaluesfor(key, empty_dict,
+                                         timeout=_get_datastore_timeout(),
+                                         reply_handler=reply_cb,
+                                         error_handler=error_cb)
+
+
 def delete(object_id):
     """Removes an object from persistent storage
     """
@@ -617,6 +1323,19 @@ def delete(object_id):
         deleted.send(None, object_id=object_id)
 
 
+def delete_async(object_id, reply_cb, error_cb):
+    """Asynchronous version of delete()
+
+    reply_cb is called without arguments once the object is removed.
+    """
+    if os.path.exists(object_id):
+        _call_async(lambda result: reply_cb(), error_cb, delete, object_id)
+        return
+
+    _get_datastore().delete(object_id, timeout=_get_datastore_timeout(),
+                            reply_handler=reply_cb, error_handler=error_cb)
+
+
 def copy(metadata, mount_point):
     """Copies an object to another mount point
     """
@@ -659,6 +1378,38 @@ def write(metadata, file_path='', update_mtime=True, transfer_ownership=True):
     return object_id
 
 
+def write_async(metadata, reply_cb, error_cb, file_path='',
+                update_mtime=True, transfer_ownership=True):
+    """Asynchronous version of write()
+
+    reply_cb is called with the id of the object written.
+    """
+    if metadata.get('mountpoint', '/') != '/':
+        _call_async(reply_cb, error_cb, write, metadata, file_path,
+                    update_mtime, transfer_ownership)
+        return
+
+    logging.debug('model.write_async %r %r %r', metadata.get('uid', ''),
+                  file_path, update_mtime)
+    if update_mtime:
+        metadata['mtime'] = datetime.now().isoformat()
+        metadata['timestamp'] = int(time.time())
+
+    if metadata.get('uid', ''):
+        object_id = metadata['uid']
+        _get_datastore().update(object_id, dbus.Dictionary(metadata),
+                                file_path, transfer_ownership,
+                                timeout=_get_datastore_timeout(),
+                                reply_handler=lambda: reply_cb(object_id),
+                                error_handler=error_cb)
+    else:
+        _get_datastore().create(dbus.Dictionary(metadata), file_path,
+                                transfer_ownership,
+                                timeout=_get_datastore_timeout(),
+                                reply_handler=reply_cb,
+                                error_handler=error_cb)
+
+
 def _rename_entry_on_external_device(file_path, destination_path,
                                      metadata_dir_path):
     """Rename an entry with the associated metadata on an external device."""
@@ -779,13 +1530,23 @@ def get_file_name(title, mime_type):
     return file_name
 
 
-def get_unique_file_name(mount_point, file_name):
-    if os.path.exists(os.path.join(mount_point, file_name)):
+def get_unique_file_name(mount_point, file_name, file_names=None):
+    """Returns a name, based on file_name, that is not taken in mount_point
+
+    file_names, if given, is the set of names in mount_point and is used
+    instead of checking on disk for every candidate.
+    """
+    if file_names is None:
+        exists = lambda name: os.path.exists(os.path.join(mount_point, name))
+    else:
+        exists = lambda name: name in file_names
+
+    if exists(file_name):
         i = 1
         name, extension = os.path.splitext(file_name)
         while len(file_name) <= 255:
             file_name = name + '_' + str(i) + extension
-            if not os.path.exists(os.path.join(mount_point, file_name)):
+            if not exists(file_name):
                 break
             i += 1
 
@@ -17,6 +17,7 @@
 from gettext import gettext as _
 import logging
 import os
+from functools import partial
 
 from gi.repository import GObject
 from gi.repository import Gtk
@@ -38,6 +39,7 @@ from jarabe.model import filetransfer
 from jarabe.model import mimeregistry
 from jarabe.journal import misc
 from jarabe.journal import model
+from jarabe.journal import copyjob
 from jarabe.journal import journalwindow
 
 
@@ -135,7 +137,6 @@ class ObjectPalette(Palette):
         misc.resume(self._metadata)
 
     def __duplicate_activate_cb(self, menu_item):
-        file_path = model.get_file(self._metadata['uid'])
         try:
             model.copy(self._metadata, '/')
         except IOError, e:
@@ -163,7 +164,16 @@ class ObjectPalette(Palette):
     def __erase_alert_response_cb(self, alert, response_id):
         journalwindow.get_journal_window().remove_alert(alert)
         if response_id is Gtk.ResponseType.OK:
-            model.delete(self._metadata['uid'])
+            model.delete_async(self._metadata['uid'], self.__delete_reply_cb,
+                               self.__delete_error_cb)
+
+    def __delete_reply_cb(self):
+        logging.debug('Erased %r', self._metadata['uid'])
+
+    def __delete_error_cb(self, error):
+        logging.error('Could not erase %r: %s', self._metadata['uid'], error)
+        self.emit('volume-error', _('Error while erasing the entry.'),
+                  _('Error'))
 
     def __detail_activate_cb(self, menu_item):
         self.emit('detail-clicked', self._metadata['uid'])
@@ -173,8 +183,17 @@ class ObjectPalette(Palette):
 
     def __friend_selected_cb(self, menu_item, buddy):
         logging.debug('__friend_selected_cb')
-        file_name = model.get_file(self._metadata['uid'])
+        model.get_file_async(self._metadata['uid'],
+                             partial(self.__send_get_file_reply_cb, buddy),
+                             self.__get_file_error_cb)
+
+    def __get_file_error_cb(self, error):
+        logging.error('Could not get the file of %r: %s',
+                      self._metadata['uid'], error)
+        self.emit('volume-error', _('Error while reading the entry.'),
+                  _('Error'))
 
+    def __send_get_file_reply_cb(self, buddy, file_name):
         if not file_name or not os.path.exists(file_name):
             logging.warn('Entries without a file cannot be sent.')
             self.emit('volume-error',
@@ -269,8 +288,25 @@ class VolumeMenu(MenuItem):
         self.connect('activate', self.__copy_to_volume_cb, mount_point)
 
     def __copy_to_volume_cb(self, menu_item, mount_point):
-        file_path = model.get_file(self._metadata['uid'])
+        if mount_point != '/':
+            job = copyjob.copy_entries([self._metadata['uid']], mount_point)
+            job.connect('entry-failed', self.__copy_job_entry_failed_cb)
+            return
+
+        model.get_file_async(self._metadata['uid'],
+                             partial(self.__get_file_reply_cb, mount_point),
+                             self.__get_file_error_cb)
+
+    def __get_file_error_cb(self, error):
+        logging.error('Could not get the file of %r: %s',
+                      self._metadata['uid'], error)
+        self.emit('volume-error', _('Error while copying the entry.'),
+                  _('Error'))
 
+    def __copy_job_entry_failed_cb(self, job, uid, message):
+        self.emit('volume-error', message, _('Error'))
+
+    def __get_file_reply_cb(self, mount_point, file_path):
         if not file_path or not os.path.exists(file_path):
             logging.warn('Entries without a file cannot be copied.')
             self.emit('volume-error',
@@ -303,7 +339,16 @@ class ClipboardMenu(MenuItem):
         self.connect('activate', self.__copy_to_clipboard_cb)
 
     def __copy_to_clipboard_cb(self, menu_item):
-        file_path = model.get_file(self._metadata['uid'])
+        model.get_file_async(self._metadata['uid'], self.__get_file_reply_cb,
+                             self.__get_file_error_cb)
+
+    def __get_file_error_cb(self, error):
+        logging.error('Could not get the file of %r: %s',
+                      self._metadata['uid'], error)
+        self.emit('volume-error', _('Error while copying the entry.'),
+                  _('Error'))
+
+    def __get_file_reply_cb(self, file_path):
         if not file_path or not os.path.exists(file_path):
             logging.warn('Entries without a file cannot be copied.')
             self.emit('volume-error',
@@ -315,10 +360,12 @@ class ClipboardMenu(MenuItem):
         clipboard.set_with_data([Gtk.TargetEntry.new('text/uri-list', 0, 0)],
                                 self.__clipboard_get_func_cb,
                                 self.__clipboard_clear_func_cb, None)
+        # Get hold of a reference so the temp file doesn't get deleted
+        self._temp_file_path = file_path
 
     def __clipboard_get_func_cb(self, clipboard, selection_data, info, data):
-        # Get hold of a reference so the temp file doesn't get deleted
-        self._temp_file_path = model.get_file(self._metadata['uid'])
+        if self._temp_file_path is None:
+            self._temp_file_path = model.get_file(self._metadata['uid'])
         logging.debug('__clipboard_get_func_cb %r', self._temp_file_path)
         selection_data.set_uris(['file://' + self._temp_file_path])
 
@@ -0,0 +1,246 @@
+# Copyright (C) 2012, One Laptop per Child
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Persistent index of the files found on a mounted volume
+
+The index lives in the profile, one file per volume, and remembers for
+every directory that has been scanned its modification time and the
+stat, mime type and journal metadata of its entries. A directory whose
+mtime (and the mtime of its metadata directory) did not change since the
+last scan can be restored from the index without stat'ing its files or
+parsing their metadata again.
+
+"""
+
+import logging
+import os
+import errno
+import hashlib
+import json
+import tempfile
+
+from gi.repository import Gio
+
+from sugar3 import env
+
+
+_INDEX_VERSION = 2
+_INDEX_DIR = 'journal-index'
+
+
+def _get_volume_id(mount_point):
+    volume_monitor = Gio.VolumeMonitor.get()
+    for mount in volume_monitor.get_mounts():
+        if mount.get_root().get_path() != mount_point:
+            continue
+
+        uuid = mount.get_uuid()
+        if not uuid and mount.get_volume() is not None:
+            uuid = mount.get_volume().get_identifier('uuid')
+        if uuid:
+            return uuid
+        break
+
+    return mount_point
+
+
+def _get_index_path(mount_point):
+    volume_id = _get_volume_id(mount_point)
+    file_name = hashlib.sha1(volume_id).hexdigest() + '.json'
+    return os.path.join(env.get_profile_path(_INDEX_DIR), file_name)
+
+
+def _name_to_json(name):
+    # File names are byte strings in no particular encoding, map each byte
+    # to a code point so that any name survives the round trip through JSON
+    return name.decode('latin-1')
+
+
+def _name_from_json(name):
+    return name.encode('latin-1')
+
+
+def _directories_to_json(directories):
+    json_directories = {}
+    for key, record in directories.iteritems():
+        entries = {}
+        for name, entry in record['entries'].iteritems():
+            entries[_name_to_json(name)] = entry
+        json_directories[_name_to_json(key)] = dict(record, entries=entries)
+    return json_directories
+
+
+def _directories_from_json(json_directories):
+    directories = {}
+    for key, record in json_directories.iteritems():
+        entries = {}
+        for name, entry in record['entries'].iteritems():
+            entries[_name_from_json(name)] = entry
+        record['entries'] = entries
+        directories[_name_from_json(key)] = record
+    return directories
+
+
+def _stat_to_list(stat):
+    return list(stat[:7]) + [stat.st_atime, stat.st_mtime, stat.st_ctime]
+
+
+def _get_metadata_mtime(dir_path, metadata_dir_name):
+    try:
+        return os.stat(os.path.join(dir_path, metadata_dir_name)).st_mtime
+    except OSError, e:
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+            logging.exception('Error reading metadata directory of %r',
+                              dir_path)
+        return None
+
+
+class VolumeIndex(object):
+    """Cache of the scan results of a mount point
+
+    Directories are looked up (and validated) with lookup_directory(); a
+    directory that has to be scanned again is registered with
+    add_directory() and its entries with add_entry(). Only the
+    directories seen during the current scan are kept when saving, so
+    directories removed from the volume drop out of the index.
+
+    The index has to be created in the main loop, it can be loaded and
+    used from a worker thread afterwards.
+
+    """
+
+    def __init__(self, mount_point, metadata_dir_name):
+        self._mount_point = mount_point
+        self._metadata_dir_name = metadata_dir_name
+        # The volume monitor can only be used from the main loop, while
+        # loading and saving may happen in a worker thread
+        self._path = _get_index_path(mount_point)
+        self._directories = {}
+        self._scanned_directories = {}
+        self._dirty = False
+
+    def _get_key(self, path):
+        return os.path.relpath(path, self._mount_point)
+
+    def load(self):
+        self._directories = {}
+        self._scanned_directories = {}
+        self._dirty = False
+
+        if not os.path.exists(self._path):
+            return
+
+        try:
+            data = json.load(open(self._path))
+        except (ValueError, EnvironmentError):
+            logging.exception('Could not read the index of volume %r',
+                              self._mount_point)
+            return
+
+        if not isinstance(data, dict) or \
+                data.get('version') != _INDEX_VERSION:
+            logging.debug('Discarding outdated index of volume %r',
+                          self._mount_point)
+            return
+
+        try:
+            self._directories = _directories_from_json(
+                data.get('directories', {}))
+        except (AttributeError, KeyError, TypeError, UnicodeError):
+            logging.exception('Could not read the index of volume %r',
+                              self._mount_point)
+
+    def save(self):
+        if not self._dirty and \
+                len(self._scanned_directories) == len(self._directories):
+            return
+
+        try:
+            data = {'version': _INDEX_VERSION,
+                    'directories': _directories_to_json(
+                        self._scanned_directories)}
+            index_dir = os.path.dirname(self._path)
+            if not os.path.exists(index_dir):
+                os.makedirs(index_dir)
+            fd, temp_path = tempfile.mkstemp(dir=index_dir)
+            os.write(fd, json.dumps(data))
+            os.close(fd)
+            os.rename(temp_path, self._path)
+        except (EnvironmentError, TypeError, ValueError):
+            logging.exception('Could not write the index of volume %r',
+                              self._mount_point)
+            return
+
+        self._directories = self._scanned_directories
+        self._scanned_directories = {}
+        self._dirty = False
+
+    def lookup_directory(self, dir_path, stat):
+        """Return the cached entries of a directory
+
+        Returns a list of (file name, stat, mime type, metadata) tuples, or
+        None if the directory is unknown or changed since it was indexed.
+        The stat is None for entries that are to be skipped.
+
+        """
+        key = self._get_key(dir_path)
+        record = self._directories.get(key)
+        if record is None or record['mtime'] != stat.st_mtime:
+            return None
+
+        metadata_mtime = _get_metadata_mtime(dir_path,
+                                             self._metadata_dir_name)
+        if record['metadata_mtime'] != metadata_mtime:
+            return None
+
+        self._scanned_directories[key] = record
+
+        entries = []
+        for name, (stat_list, mime_type, metadata) in \
+                record['entries'].iteritems():
+            if stat_list is not None:
+                entry_stat = os.stat_result(stat_list)
+            else:
+                entry_stat = None
+            if metadata is not None:
+                metadata = metadata.copy()
+                metadata['uid'] = os.path.join(dir_path, name)
+            entries.append((name, entry_stat, mime_type, metadata))
+        return entries
+
+    def add_directory(self, dir_path, stat):
+        key = self._get_key(dir_path)
+        metadata_mtime = _get_metadata_mtime(dir_path,
+                                             self._metadata_dir_name)
+        self._scanned_directories[key] = {'mtime': stat.st_mtime,
+                                          'metadata_mtime': metadata_mtime,
+                                          'entries': {}}
+        self._dirty = True
+
+    def add_entry(self, file_path, stat, mime_type=None, metadata=None):
+        record = self._scanned_directories.get(
+            self._get_key(os.path.dirname(file_path)))
+        if record is None:
+            return
+
+        if stat is not None:
+            stat = _stat_to_list(stat)
+        if metadata is not None:
+            metadata = metadata.copy()
+            metadata.pop('uid', None)
+            metadata.pop('preview', None)
+        record['entries'][os.path.basename(file_path)] = \
+                [stat, mime_type, metadata]
@@ -37,6 +37,7 @@ from sugar3.graphics.xocolor import XoColor
 from sugar3 import env
 
 from jarabe.journal import model
+from jarabe.journal import copyjob
 from jarabe.view.palettes import VolumePalette
 
 
@@ -292,6 +293,11 @@ class BaseButton(RadioToolButton):
     def _drag_data_received_cb(self, widget, drag_context, x, y,
                                selection_data, info, timestamp):
         object_id = selection_data.get_data()
+        if self.mount_point != '/':
+            job = copyjob.copy_entries([object_id], self.mount_point)
+            job.connect('entry-failed', self.__copy_job_entry_failed_cb)
+            return
+
         metadata = model.get(object_id)
         file_path = model.get_file(metadata['uid'])
         if not file_path or not os.path.exists(file_path):
@@ -309,6 +315,9 @@ class BaseButton(RadioToolButton):
                       _('Error while copying the entry. %s') % e.strerror,
                       _('Error'))
 
+    def __copy_job_entry_failed_cb(self, job, uid, message):
+        self.emit('volume-error', message, _('Error'))
+
 
 class VolumeButton(BaseButton):
     def __init__(self, mount):
@@ -58,13 +58,18 @@ class AdHocManager(GObject.GObject):
     def __init__(self):
         GObject.GObject.__init__(self)
 
-        self._bus = dbus.SystemBus()
+        self._state = network.get_manager_state()
+        self._state_changed_sid = None
+        self._properties_changed_sid = None
+        self._ap_added_sid = None
         self._device = None
         self._idle_source = 0
         self._listening_called = 0
         self._device_state = network.NM_DEVICE_STATE_UNKNOWN
 
         self._current_channel = None
+        # Active access point whose properties are not known yet
+        self._pending_ap_o = None
         self._networks = {self._CHANNEL_1: None,
                           self._CHANNEL_6: None,
                           self._CHANNEL_11: None}
@@ -80,56 +85,65 @@ class AdHocManager(GObject.GObject):
                                    ' only be called once.')
 
         self._device = device
-        props = dbus.Interface(device, dbus.PROPERTIES_IFACE)
-        self._device_state = props.Get(network.NM_DEVICE_IFACE, 'State')
+        self._device_state = self._state.get_property(
+            device.object_path, network.NM_DEVICE_IFACE, 'State',
+            network.NM_DEVICE_STATE_UNKNOWN)
 
-        self._bus.add_signal_receiver(self.__device_state_changed_cb,
-                                      signal_name='StateChanged',
-                                      path=self._device.object_path,
-                                      dbus_interface=network.NM_DEVICE_IFACE)
-
-        self._bus.add_signal_receiver(self.__wireless_properties_changed_cb,
-                                      signal_name='PropertiesChanged',
-                                      path=self._device.object_path,
-                                      dbus_interface=network.NM_WIRELESS_IFACE)
+        self._state_changed_sid = self._state.connect(
+            'device-state-changed', self.__device_state_changed_cb)
+        self._properties_changed_sid = self._state.connect(
+            'properties-changed', self.__properties_changed_cb)
+        self._ap_added_sid = self._state.connect(
+            'access-point-added', self.__access_point_added_cb)
 
     def stop_listening(self):
         self._listening_called = 0
-        self._bus.remove_signal_receiver(self.__device_state_changed_cb,
-                                         signal_name='StateChanged',
-                                         path=self._device.object_path,
-                                         dbus_interface=network.NM_DEVICE_IFACE)
-        self._bus.remove_signal_receiver(self.__wireless_properties_changed_cb,
-                                         signal_name='PropertiesChanged',
-                                         path=self._device.object_path,
-                                         dbus_interface=network.NM_WIRELESS_IFACE)
-
-    def __device_state_changed_cb(self, new_state, old_state, reason):
+        self._pending_ap_o = None
+        self._state.disconnect(self._state_changed_sid)
+        self._state.disconnect(self._properties_changed_sid)
+        self._state.disconnect(self._ap_added_sid)
+
+    def __device_state_changed_cb(self, state, device_o, new_state, old_state,
+                                  reason):
+        if device_o != self._device.object_path:
+            return
         self._device_state = new_state
         self._update_state()
 
-    def __wireless_properties_changed_cb(self, properties):
-        if 'ActiveAccessPoint' in properties and \
-                properties['ActiveAccessPoint'] != '/':
-            active_ap = self._bus.get_object(network.NM_SERVICE,
-                                             properties['ActiveAccessPoint'])
-            props = dbus.Interface(active_ap, dbus.PROPERTIES_IFACE)
-            props.GetAll(network.NM_ACCESSPOINT_IFACE, byte_arrays=True,
-                         reply_handler=self.__get_all_ap_props_reply_cb,
-                         error_handler=self.__get_all_ap_props_error_cb)
-
-    def __get_all_ap_props_reply_cb(self, properties):
-        if properties['Mode'] == network.NM_802_11_MODE_ADHOC and \
-                'Frequency' in properties:
-            frequency = properties['Frequency']
+    def __properties_changed_cb(self, state, path, interface, properties):
+        if path != self._device.object_path or \
+                interface != network.NM_WIRELESS_IFACE:
+            return
+
+        if 'ActiveAccessPoint' not in properties:
+            return
+        self._pending_ap_o = None
+        if properties['ActiveAccessPoint'] != '/':
+            self._update_channel(properties['ActiveAccessPoint'])
+
+    def __access_point_added_cb(self, state, device_o, ap_o):
+        if ap_o == self._pending_ap_o:
+            self._pending_ap_o = None
+            self._update_channel(ap_o)
+
+    def _update_channel(self, ap_o):
+        ap_properties = self._state.get_properties(
+            ap_o, network.NM_ACCESSPOINT_IFACE)
+        if ap_properties is None:
+            # A network we just created is active before the state has
+            # got its properties, finish once it announces the access point
+            logging.debug('Waiting for the properties of %s', ap_o)
+            self._pending_ap_o = ap_o
+            return
+
+        if ap_properties['Mode'] == network.NM_802_11_MODE_ADHOC and \
+                'Frequency' in ap_properties:
+            frequency = ap_properties['Frequency']
             self._current_channel = network.frequency_to_channel(frequency)
         else:
             self._current_channel = None
         self._update_state()
 
-    def __get_all_ap_props_error_cb(self, err):
-        logging.error('Error getting the access point properties: %s', err)
-
     def _update_state(self):
         self.emit('state-changed', self._current_channel, self._device_state)
 
@@ -204,29 +218,23 @@ class AdHocManager(GObject.GObject):
 
     def deactivate_active_channel(self):
         """Deactivate the current active channel."""
-        obj = self._bus.get_object(network.NM_SERVICE, network.NM_PATH)
-        netmgr = dbus.Interface(obj, network.NM_IFACE)
-
-        netmgr_props = dbus.Interface(netmgr, dbus.PROPERTIES_IFACE)
-        netmgr_props.Get(network.NM_IFACE, 'ActiveConnections', \
-                reply_handler=self.__get_active_connections_reply_cb,
-                error_handler=self.__get_active_connections_error_cb)
-
-    def __get_active_connections_reply_cb(self, active_connections_o):
-        for connection_o in active_connections_o:
-            obj = self._bus.get_object(network.NM_IFACE, connection_o)
-            props = dbus.Interface(obj, dbus.PROPERTIES_IFACE)
-            state = props.Get(network.NM_ACTIVE_CONN_IFACE, 'State')
-            if state == network.NM_ACTIVE_CONNECTION_STATE_ACTIVATED:
-                access_point_o = props.Get(network.NM_ACTIVE_CONN_IFACE,
-                                           'SpecificObject')
+        for connection_o in self._state.get_active_connections():
+            props = self._state.get_properties(connection_o,
+                                               network.NM_ACTIVE_CONN_IFACE)
+            if props['State'] == network.NM_ACTIVE_CONNECTION_STATE_ACTIVATED:
+                access_point_o = props['SpecificObject']
                 if access_point_o != '/':
-                    obj = self._bus.get_object(network.NM_SERVICE, network.NM_PATH)
-                    netmgr = dbus.Interface(obj, network.NM_IFACE)
-                    netmgr.DeactivateConnection(connection_o)
+                    netmgr = network.get_manager()
+                    netmgr.DeactivateConnection(
+                        connection_o,
+                        reply_handler=self.__deactivate_reply_cb,
+                        error_handler=self.__deactivate_error_cb)
+
+    def __deactivate_reply_cb(self):
+        logging.debug('Ad-hoc network deactivated')
 
-    def __get_active_connections_error_cb(self, err):
-        logging.error('Error getting the active connections: %s', err)
+    def __deactivate_error_cb(self, err):
+        logging.error('Failed to deactivate Ad-hoc network: %s', err)
 
     def __activate_reply_cb(self, connection):
         logging.debug('Ad-hoc network created: %s', connection)
@@ -16,7 +16,14 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import os
+import sys
+import errno
+import locale
 import logging
+import threading
+import Queue
+import cPickle
+import tempfile
 
 from gi.repository import GConf
 from gi.repository import GObject
@@ -37,6 +44,11 @@ from jarabe.model import mimeregistry
 
 _instance = None
 
+_BUNDLE_CACHE_VERSION = 2
+
+# Number of threads parsing the bundles missing from the cache at startup
+_PARSE_THREADS = 4
+
 
 class BundleRegistry(GObject.GObject):
     """Tracks the available activity bundles"""
@@ -57,6 +69,11 @@ class BundleRegistry(GObject.GObject):
         self._mime_defaults = self._load_mime_defaults()
 
         self._bundles = []
+        # indexes on self._bundles, see _index_bundle()
+        self._bundles_by_id = {}
+        self._bundles_by_version = {}
+        self._bundles_by_path = {}
+        self._bundles_by_mime_type = {}
         # hold a reference to the monitors so they don't get disposed
         self._gio_monitors = []
 
@@ -65,17 +82,18 @@ class BundleRegistry(GObject.GObject):
         for data_dir in GLib.get_system_data_dirs():
             dirs.append(os.path.join(data_dir, "sugar", "activities"))
 
+        self._last_defaults_mtime = -1
+        self._favorite_bundles = {}
+
+        bundle_dirs = []
         for activity_dir in dirs:
-            self._scan_directory(activity_dir)
+            bundle_dirs.extend(self._scan_directory(activity_dir))
             directory = Gio.File.new_for_path(activity_dir)
             monitor = directory.monitor_directory( \
                 flags=Gio.FileMonitorFlags.NONE, cancellable=None)
             monitor.connect('changed', self.__file_monitor_changed_cb)
             self._gio_monitors.append(monitor)
 
-        self._last_defaults_mtime = -1
-        self._favorite_bundles = {}
-
         client = GConf.Client.get_default()
         self._protected_activities = []
 
@@ -94,7 +112,7 @@ class BundleRegistry(GObject.GObject):
         except Exception:
             logging.exception('Error while loading favorite_activities.')
 
-        self._merge_default_favorites()
+        self._load_bundles(bundle_dirs)
 
     def __file_monitor_changed_cb(self, monitor, one_file, other_file,
                                   event_type):
@@ -164,31 +182,52 @@ class BundleRegistry(GObject.GObject):
                 self._last_defaults_mtime = file_mtime
 
         if not default_activities:
-            return
+            return []
 
+        changed_bundles = []
         for bundle_id in default_activities:
             max_version = '0'
-            for bundle in self._bundles:
-                if bundle.get_bundle_id() == bundle_id and \
-                        NormalizedVersion(max_version) < \
-                        NormalizedVersion(bundle.get_activity_version()):
-                    max_version = bundle.get_activity_version()
+            bundle = self.get_bundle(bundle_id)
+            if bundle is not None and \
+                    NormalizedVersion(max_version) < \
+                    NormalizedVersion(bundle.get_activity_version()):
+                max_version = bundle.get_activity_version()
 
             key = self._get_favorite_key(bundle_id, max_version)
             if NormalizedVersion(max_version) > NormalizedVersion('0') and \
                     key not in self._favorite_bundles:
                 self._favorite_bundles[key] = None
+                changed_bundles.append(bundle)
 
         logging.debug('After merging: %r', self._favorite_bundles)
 
         self._write_favorites_file()
+        return changed_bundles
 
     def get_bundle(self, bundle_id):
         """Returns an bundle given his service name"""
-        for bundle in self._bundles:
-            if bundle.get_bundle_id() == bundle_id:
-                return bundle
-        return None
+        return self._bundles_by_id.get(bundle_id)
+
+    def _index_bundle(self, bundle):
+        self._bundles_by_id[bundle.get_bundle_id()] = bundle
+        self._bundles_by_version[(bundle.get_bundle_id(),
+                                  bundle.get_activity_version())] = bundle
+        self._bundles_by_path[bundle.get_path()] = bundle
+        for mime_type in bundle.get_mime_types() or []:
+            self._bundles_by_mime_type.setdefault(mime_type, []).append(bundle)
+
+    def _unindex_bundle(self, bundle):
+        if self._bundles_by_id.get(bundle.get_bundle_id()) is bundle:
+            del self._bundles_by_id[bundle.get_bundle_id()]
+        self._bundles_by_version.pop((bundle.get_bundle_id(),
+                                      bundle.get_activity_version()), None)
+        self._bundles_by_path.pop(bundle.get_path(), None)
+        for mime_type in bundle.get_mime_types() or []:
+            bundles = self._bundles_by_mime_type.get(mime_type, [])
+            if bundle in bundles:
+                bundles.remove(bundle)
+            if not bundles:
+                self._bundles_by_mime_type.pop(mime_type, None)
 
     def __iter__(self):
         return self._bundles.__iter__()
@@ -197,8 +236,9 @@ class BundleRegistry(GObject.GObject):
         return len(self._bundles)
 
     def _scan_directory(self, path):
+        """Return the bundle directories in path, sorted by mtime"""
         if not os.path.isdir(path):
-            return
+            return []
 
         # Sort by mtime to ensure a stable activity order
         bundles = {}
@@ -215,13 +255,127 @@ class BundleRegistry(GObject.GObject):
 
         bundle_dirs = bundles.keys()
         bundle_dirs.sort(lambda d1, d2: cmp(bundles[d1], bundles[d2]))
-        for folder in bundle_dirs:
+        return bundle_dirs
+
+    def _load_bundles(self, bundle_dirs):
+        """Load the installed bundles
+
+        Bundles that did not change since the last run are restored from
+        the bundle cache. The rest get parsed in worker threads and are
+        added from the main loop as they become ready, in their original
+        order, emitting bundle-added, so views can show the bundles
+        available so far.
+
+        """
+        cache = self._read_bundle_cache()
+        self._new_bundle_cache = {}
+        self._loading_bundles = []
+        self._next_loading_bundle = 0
+        bundles_to_parse = Queue.Queue()
+
+        for index, bundle_dir in enumerate(bundle_dirs):
+            cache_key = _get_bundle_cache_key(bundle_dir)
+            cached = cache.get(bundle_dir)
+            if cache_key is not None and cached is not None and \
+                    cached[0] == cache_key:
+                bundle = ActivityBundle.__new__(ActivityBundle)
+                bundle.__dict__.update(cached[1])
+                self._loading_bundles.append([True, bundle, cache_key])
+            else:
+                self._loading_bundles.append([False, None, cache_key])
+                bundles_to_parse.put((index, bundle_dir))
+
+        self._add_loaded_bundles(emit=False)
+        if self._loading_bundles is None:
+            return
+
+        logging.debug('STARTUP: Parsing %d bundles', bundles_to_parse.qsize())
+        for i_ in range(min(_PARSE_THREADS, bundles_to_parse.qsize())):
+            worker = threading.Thread(target=self._parse_bundles,
+                                      args=(bundles_to_parse, ))
+            worker.daemon = True
+            worker.start()
+
+    def _parse_bundles(self, bundles_to_parse):
+        while True:
+            try:
+                index, bundle_dir = bundles_to_parse.get_nowait()
+            except Queue.Empty:
+                return
+
             try:
-                self._add_bundle(folder)
-            except:
-                # pylint: disable=W0702
+                bundle = ActivityBundle(bundle_dir)
+            except Exception:
                 logging.exception('Error while processing installed activity'
-                                  ' bundle %s:', folder)
+                                  ' bundle %s:', bundle_dir)
+                bundle = None
+            GObject.idle_add(self.__bundle_parsed_cb, index, bundle)
+
+    def __bundle_parsed_cb(self, index, bundle):
+        self._loading_bundles[index][:2] = [True, bundle]
+        self._add_loaded_bundles(emit=True)
+        return False
+
+    def _add_loaded_bundles(self, emit):
+        while self._next_loading_bundle < len(self._loading_bundles):
+            loaded, bundle, cache_key = \
+                    self._loading_bundles[self._next_loading_bundle]
+            if not loaded:
+                return
+            self._next_loading_bundle += 1
+            if bundle is None:
+                continue
+
+            self._new_bundle_cache[bundle.get_path()] = \
+                    (cache_key, bundle.__dict__.copy())
+            try:
+                bundle = self._register_bundle(bundle)
+            except Exception:
+                logging.exception('Error while processing installed activity'
+                                  ' bundle %s:', bundle.get_path())
+                continue
+            if bundle is not None and emit:
+                self.emit('bundle-added', bundle)
+
+        logging.debug('STARTUP: Bundle registry loaded')
+        self._loading_bundles = None
+        self._write_bundle_cache(self._new_bundle_cache)
+        self._new_bundle_cache = None
+
+        for bundle in self._merge_default_favorites():
+            if emit:
+                self.emit('bundle-changed', bundle)
+
+    def _read_bundle_cache(self):
+        path = env.get_profile_path('bundle_cache')
+        if not os.path.exists(path):
+            return {}
+
+        try:
+            data = cPickle.load(open(path, 'rb'))
+        except Exception:
+            logging.exception('Error while reading the bundle cache')
+            return {}
+
+        if data.get('version') != _BUNDLE_CACHE_VERSION or \
+                data.get('lang') != os.environ.get('LANG') or \
+                data.get('class_stamp') != _get_bundle_class_stamp():
+            return {}
+        return data['bundles']
+
+    def _write_bundle_cache(self, bundles):
+        path = env.get_profile_path('bundle_cache')
+        data = {'version': _BUNDLE_CACHE_VERSION,
+                'lang': os.environ.get('LANG'),
+                'class_stamp': _get_bundle_class_stamp(),
+                'bundles': bundles}
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            os.write(fd, cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL))
+            os.close(fd)
+            os.rename(temp_path, path)
+        except Exception:
+            logging.exception('Error while writing the bundle cache')
 
     def add_bundle(self, bundle_path, install_mime_type=False):
         bundle = self._add_bundle(bundle_path, install_mime_type)
@@ -244,6 +398,9 @@ class BundleRegistry(GObject.GObject):
             logging.exception('Error loading bundle %r', bundle_path)
             return None
 
+        return self._register_bundle(bundle)
+
+    def _register_bundle(self, bundle):
         bundle_id = bundle.get_bundle_id()
         installed = self.get_bundle(bundle_id)
 
@@ -257,15 +414,18 @@ class BundleRegistry(GObject.GObject):
                 self.remove_bundle(installed.get_path())
 
         self._bundles.append(bundle)
+        self._index_bundle(bundle)
         return bundle
 
     def remove_bundle(self, bundle_path):
-        for bundle in self._bundles:
-            if bundle.get_path() == bundle_path:
-                self._bundles.remove(bundle)
-                self.emit('bundle-removed', bundle)
-                return True
-        return False
+        bundle = self._bundles_by_path.get(bundle_path)
+        if bundle is None:
+            return False
+
+        self._bundles.remove(bundle)
+        self._unindex_bundle(bundle)
+        self.emit('bundle-removed', bundle)
+        return True
 
     def get_activities_for_type(self, mime_type):
         result = []
@@ -274,15 +434,14 @@ class BundleRegistry(GObject.GObject):
         default_bundle_id = mime.get_default_activity(mime_type)
         default_bundle = None
 
-        for bundle in self._bundles:
-            if mime_type in (bundle.get_mime_types() or []):
-                if bundle.get_bundle_id() == default_bundle_id:
-                    default_bundle = bundle
-                elif self.get_default_for_type(mime_type) == \
-                        bundle.get_bundle_id():
-                    result.insert(0, bundle)
-                else:
-                    result.append(bundle)
+        for bundle in self._bundles_by_mime_type.get(mime_type, []):
+            if bundle.get_bundle_id() == default_bundle_id:
+                default_bundle = bundle
+            elif self.get_default_for_type(mime_type) == \
+                    bundle.get_bundle_id():
+                result.insert(0, bundle)
+            else:
+                result.append(bundle)
 
         if default_bundle is not None:
             result.insert(0, default_bundle)
@@ -293,10 +452,9 @@ class BundleRegistry(GObject.GObject):
         return self._mime_defaults.get(mime_type)
 
     def _find_bundle(self, bundle_id, version):
-        for bundle in self._bundles:
-            if bundle.get_bundle_id() == bundle_id and \
-                    bundle.get_activity_version() == version:
-                return bundle
+        bundle = self._bundles_by_version.get((bundle_id, version))
+        if bundle is not None:
+            return bundle
         raise ValueError('No bundle %r with version %r exists.' % \
                 (bundle_id, version))
 
@@ -368,25 +526,23 @@ class BundleRegistry(GObject.GObject):
                 isinstance(bundle, JournalEntryBundle):
             return bundle.is_installed()
 
-        for installed_bundle in self._bundles:
-            if bundle.get_bundle_id() == installed_bundle.get_bundle_id() and \
-                    NormalizedVersion(bundle.get_activity_version()) == \
-                    NormalizedVersion(installed_bundle.get_activity_version()):
-                return True
-        return False
+        installed_bundle = self.get_bundle(bundle.get_bundle_id())
+        return installed_bundle is not None and \
+                NormalizedVersion(bundle.get_activity_version()) == \
+                NormalizedVersion(installed_bundle.get_activity_version())
 
     def install(self, bundle, uid=None, force_downgrade=False):
         activities_path = env.get_user_activities_path()
 
-        for installed_bundle in self._bundles:
-            if bundle.get_bundle_id() == installed_bundle.get_bundle_id() and \
-                    NormalizedVersion(bundle.get_activity_version()) <= \
+        installed_bundle = self.get_bundle(bundle.get_bundle_id())
+        if installed_bundle is not None:
+            if NormalizedVersion(bundle.get_activity_version()) <= \
                     NormalizedVersion(installed_bundle.get_activity_version()):
                 if not force_downgrade:
                     raise AlreadyInstalledException
                 else:
                     self.uninstall(installed_bundle, force=True)
-            elif bundle.get_bundle_id() == installed_bundle.get_bundle_id():
+            else:
                 self.uninstall(installed_bundle, force=True)
 
         install_dir = env.get_user_activities_path()
@@ -453,6 +609,47 @@ class BundleRegistry(GObject.GObject):
         self.install(bundle)
 
 
+def _get_bundle_class_stamp():
+    """Return what changes when the toolkit providing the bundles changes
+
+    Cached bundles are restored from the attributes of the ActivityBundle
+    instances that were parsed, they cannot be restored into a different
+    version of the class.
+
+    """
+    module_path = sys.modules[ActivityBundle.__module__].__file__
+    if module_path.endswith('.pyc') or module_path.endswith('.pyo'):
+        module_path = module_path[:-1]
+    try:
+        return (module_path, os.stat(module_path).st_mtime)
+    except OSError:
+        return (module_path, None)
+
+
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+
+
+def _get_bundle_cache_key(bundle_dir):
+    """Return what tells whether a cached bundle is still valid"""
+    # The translations ActivityBundle picks for the current locale
+    lang = locale.getdefaultlocale()[0] or 'C'
+    linfo_paths = [os.path.join(bundle_dir, 'locale', locale_name,
+                                'activity.linfo')
+                   for locale_name in [lang, lang[:2]]]
+    try:
+        info_path = os.path.join(bundle_dir, 'activity', 'activity.info')
+        return (os.stat(bundle_dir).st_mtime, os.stat(info_path).st_mtime) + \
+                tuple(_get_mtime(path) for path in linfo_paths)
+    except OSError:
+        return None
+
+
 def get_registry():
     global _instance
     if not _instance:
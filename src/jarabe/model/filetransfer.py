@@ -17,6 +17,8 @@
 import os
 import logging
 import socket
+import time
+from collections import deque
 
 from gi.repository import GObject
 from gi.repository import Gio
@@ -57,13 +59,41 @@ CHANNEL_TYPE_FILE_TRANSFER = \
 new_file_transfer = dispatch.Signal()
 
 
-# TODO Move to use splice_async() in Sugar 0.88
 class StreamSplicer(GObject.GObject):
-    _CHUNK_SIZE = 10240  # 10K
+    """Copy an input stream to an output stream
+
+    Chunks are read ahead of the writes into a buffer of at most
+    _MAX_BUFFERED_BYTES; reading stops while the buffer is full and
+    resumes as the writes drain it, so a fast sender cannot fill the
+    memory when the receiver is slow. The chunk size adapts between
+    _MIN_CHUNK_SIZE and _MAX_CHUNK_SIZE: it doubles when a read fills a
+    chunk and halves when reads come back short.
+
+    The progress signal reports bytes_spliced, transfer_rate (bytes per
+    second) and latency (milliseconds a write takes) periodically. Either
+    finished or failed, with an error message, is emitted at the end.
+
+    Gio.OutputStream.splice_async() is not used: it copies through small
+    buffers in a thread and reports no progress.
+
+    """
+    _MIN_CHUNK_SIZE = 64 * 1024
+    _MAX_CHUNK_SIZE = 1024 * 1024
+    _MAX_BUFFERED_BYTES = 4 * 1024 * 1024
+
+    # Seconds between progress signals
+    _PROGRESS_INTERVAL = 0.5
+
     __gsignals__ = {
         'finished': (GObject.SignalFlags.RUN_FIRST,
                      None,
                      ([])),
+        'progress': (GObject.SignalFlags.RUN_FIRST,
+                     None,
+                     ([])),
+        'failed': (GObject.SignalFlags.RUN_FIRST,
+                   None,
+                   ([str])),
     }
 
     def __init__(self, input_stream, output_stream):
@@ -71,50 +101,142 @@ class StreamSplicer(GObject.GObject):
 
         self._input_stream = input_stream
         self._output_stream = output_stream
-        self._pending_buffers = []
+        self._buffers = deque()
+        self._buffered_bytes = 0
+        self._chunk_size = self._MIN_CHUNK_SIZE
+        self._reading = False
+        self._writing = False
+        self._input_finished = False
+        self._failed = False
+        self._write_start = None
+        self._progress_time = None
+        self._progress_bytes = 0
+
+        self.bytes_spliced = 0
+        self.transfer_rate = 0
+        self.latency = 0
 
     def start(self):
+        self._progress_time = time.time()
+        self._read_next_chunk()
+
+    def _read_next_chunk(self):
+        if self._reading or self._input_finished or self._failed or \
+                self._buffered_bytes >= self._MAX_BUFFERED_BYTES:
+            return
+
+        self._reading = True
         self._input_stream.read_bytes_async(
-            self._CHUNK_SIZE, GLib.PRIORITY_LOW,
+            self._chunk_size, GLib.PRIORITY_LOW,
             None, self.__read_async_cb, None)
 
     def __read_async_cb(self, input_stream, result, user_data):
-        data = input_stream.read_bytes_finish(result)
-
+        self._reading = False
+        if self._failed:
+            input_stream.close(None)
+            return
+        try:
+            data = input_stream.read_bytes_finish(result)
+        except GLib.GError, e:
+            self._fail('Error reading: %s' % e)
+            return
         if data is None:
-            # TODO: an error occured. Report something
-            logging.error('An error occured in the file transfer.')
-        elif data.get_size() == 0:
+            self._fail('Error reading')
+            return
+
+        size = data.get_size()
+        if size == 0:
             # We read the file completely
             logging.debug('Closing input stream. Reading finished.')
-            self._input_stream.close(None)
+            self._input_finished = True
+            input_stream.close(None)
         else:
-            logging.debug('Data received (bytes): %s', data.get_size())
-            self._pending_buffers.append(data)
-            self._input_stream.read_bytes_async(
-                self._CHUNK_SIZE, GLib.PRIORITY_LOW,
-                None, self.__read_async_cb, None)
+            if size == self._chunk_size:
+                self._chunk_size = min(self._chunk_size * 2,
+                                       self._MAX_CHUNK_SIZE)
+            elif size < self._chunk_size / 2:
+                self._chunk_size = max(self._chunk_size / 2,
+                                       self._MIN_CHUNK_SIZE)
+            self._buffers.append(data)
+            self._buffered_bytes += size
+            self._read_next_chunk()
+
         self._write_next_buffer()
 
-    def __write_async_cb(self, output_stream, result, user_data):
-        size = output_stream.write_bytes_finish(result)
-        logging.debug('Size written (bytes): %s', size)
+    def _write_next_buffer(self):
+        if self._writing or self._failed:
+            return
 
-        if not self._pending_buffers and \
-                not self._output_stream.has_pending() and \
-                not self._input_stream.has_pending():
-            logging.debug('Closing output stream. Writing finished.')
+        if not self._buffers:
+            if self._input_finished:
+                self._finish()
+            return
+
+        self._writing = True
+        self._write_start = time.time()
+        self._output_stream.write_bytes_async(
+            self._buffers[0], GLib.PRIORITY_LOW, None,
+            self.__write_async_cb, None)
+
+    def __write_async_cb(self, output_stream, result, user_data):
+        self._writing = False
+        if self._failed:
             output_stream.close(None)
-            self.emit('finished')
+            return
+        try:
+            written = output_stream.write_bytes_finish(result)
+        except GLib.GError, e:
+            self._fail('Error writing: %s' % e)
+            return
+
+        # Smoothed, a single slow write should not make it jump
+        latency = (time.time() - self._write_start) * 1000
+        self.latency = int(self.latency * 0.8 + latency * 0.2)
+
+        data = self._buffers[0]
+        if written < data.get_size():
+            self._buffers[0] = GLib.Bytes.new_from_bytes(
+                data, written, data.get_size() - written)
         else:
-            self._write_next_buffer()
+            self._buffers.popleft()
+        self._buffered_bytes -= written
+        self.bytes_spliced += written
 
-    def _write_next_buffer(self):
-        if self._pending_buffers and not self._output_stream.has_pending():
-            data = self._pending_buffers.pop(0)
-            self._output_stream.write_bytes_async(
-                data, GLib.PRIORITY_LOW, None,
-                self.__write_async_cb, None)
+        now = time.time()
+        if now - self._progress_time >= self._PROGRESS_INTERVAL:
+            self._update_progress(now)
+
+        # There may be room in the buffer again
+        self._read_next_chunk()
+        self._write_next_buffer()
+
+    def _update_progress(self, now):
+        elapsed = now - self._progress_time
+        if elapsed > 0:
+            self.transfer_rate = int(
+                (self.bytes_spliced - self._progress_bytes) / elapsed)
+        self._progress_time = now
+        self._progress_bytes = self.bytes_spliced
+        self.emit('progress')
+
+    def _finish(self):
+        logging.debug('Closing output stream. Writing finished, %d bytes '
+                      'at %d bytes/s', self.bytes_spliced, self.transfer_rate)
+        self._output_stream.close(None)
+        self._update_progress(time.time())
+        self.emit('finished')
+
+    def _fail(self, message):
+        logging.error('An error occured in the file transfer. %s', message)
+        self._failed = True
+        self._buffers.clear()
+        self._buffered_bytes = 0
+        # Streams with an operation pending are closed when it completes
+        if not self._reading:
+            self._input_stream.close(None)
+        if not self._writing:
+            self._output_stream.close(None)
+        self.emit('failed', message)
 
 
 class BaseFileTransfer(GObject.GObject):
@@ -133,6 +255,7 @@ class BaseFileTransfer(GObject.GObject):
         self.mime_type = None
         self.initial_offset = 0
         self.reason_last_change = FT_REASON_NONE
+        self._splicer = None
 
     def set_channel(self, channel):
         self.channel = channel
@@ -174,6 +297,9 @@ class BaseFileTransfer(GObject.GObject):
 
     def __state_changed_cb(self, state, reason):
         logging.debug('__state_changed_cb %r %r', state, reason)
+        if self._state == FT_STATE_CANCELLED:
+            # Already failed locally, keep the reason of the failure
+            return
         self.reason_last_change = reason
         self.props.state = state
 
@@ -185,6 +311,30 @@ class BaseFileTransfer(GObject.GObject):
 
     state = GObject.property(type=int, getter=_get_state, setter=_set_state)
 
+    # Bytes per second going through the socket of the transfer
+    transfer_rate = GObject.property(type=int, default=0)
+
+    # Milliseconds a chunk takes to be written out
+    latency = GObject.property(type=int, default=0)
+
+    def _splice(self, input_stream, output_stream):
+        self._splicer = StreamSplicer(input_stream, output_stream)
+        self._splicer.connect('progress', self.__splicer_progress_cb)
+        self._splicer.connect('failed', self.__splicer_failed_cb)
+        self._splicer.start()
+
+    def __splicer_progress_cb(self, splicer):
+        self.props.transfer_rate = splicer.transfer_rate
+        self.props.latency = splicer.latency
+
+    def __splicer_failed_cb(self, splicer, message):
+        self.reason_last_change = FT_REASON_LOCAL_ERROR
+        self.props.state = FT_STATE_CANCELLED
+        try:
+            self.channel[CHANNEL].Close()
+        except dbus.DBusException:
+            logging.exception('Could not close the file transfer channel')
+
     def cancel(self):
         self.channel[CHANNEL].Close()
 
@@ -201,7 +351,6 @@ class IncomingFileTransfer(BaseFileTransfer):
         self.destination_path = None
         self._socket_address = None
         self._socket = None
-        self._splicer = None
 
     def accept(self, destination_path):
         if os.path.exists(destination_path):
@@ -230,9 +379,7 @@ class IncomingFileTransfer(BaseFileTransfer):
             else:
                 output_stream = destination_file.append_to()
 
-            # TODO: Use splice_async when it gets implemented
-            self._splicer = StreamSplicer(input_stream, output_stream)
-            self._splicer.start()
+            self._splice(input_stream, output_stream)
 
 
 class OutgoingFileTransfer(BaseFileTransfer):
@@ -249,7 +396,6 @@ class OutgoingFileTransfer(BaseFileTransfer):
         self._file_name = file_name
         self._socket_address = None
         self._socket = None
-        self._splicer = None
         self._output_stream = None
 
         self.buddy = buddy
@@ -292,9 +438,7 @@ class OutgoingFileTransfer(BaseFileTransfer):
             if self.initial_offset > 0:
                 input_stream.skip(self.initial_offset)
 
-            # TODO: Use splice_async when it gets implemented
-            self._splicer = StreamSplicer(input_stream, output_stream)
-            self._splicer.start()
+            self._splice(input_stream, output_stream)
 
     def cancel(self):
         self.channel[CHANNEL].Close()
@@ -371,7 +515,6 @@ if __name__ == '__main__':
     test_output_stream = Gio.File.new_for_path(test_temp_file)\
         .append_to(Gio.FileCreateFlags.PRIVATE, None)
 
-    # TODO: Use splice_async when it gets implemented
     splicer = StreamSplicer(test_input_stream, test_output_stream)
     splicer.start()
 
@@ -15,6 +15,8 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import logging
+import time
+from collections import deque
 from functools import partial
 from hashlib import sha1
 
@@ -67,6 +69,14 @@ Time in seconds to wait when querying contact properties. Some jabber servers
 will be very slow in returning these queries, so just be patient.
 """
 
+# Milliseconds new contact handles are gathered before their attributes
+# are requested, and the most handles requested in one call
+_HANDLES_BATCH_DELAY = 100
+_HANDLES_PER_REQUEST = 100
+
+# Queries to the connection manager waiting for a reply at any time
+_MAX_QUERIES_IN_FLIGHT = 8
+
 _model = None
 
 
@@ -159,6 +169,63 @@ class ActivityModel(GObject.GObject):
     current_buddies = GObject.property(type=object, getter=get_current_buddies)
 
 
+class _QueryQueue(object):
+    """Make D-Bus calls with at most max_in_flight of them waiting for a
+    reply at any time
+
+    Calls are made with call(), passing the method and its arguments
+    including reply_handler and error_handler. idle_cb is called when the
+    last reply has been handled.
+
+    """
+
+    def __init__(self, max_in_flight, idle_cb):
+        self._max_in_flight = max_in_flight
+        self._idle_cb = idle_cb
+        self._queue = deque()
+        self._in_flight = 0
+        self._generation = 0
+        self.n_calls = 0
+
+    def call(self, method, *args, **kwargs):
+        self._queue.append((method, args, kwargs))
+        self._run()
+
+    def clear(self):
+        """Drop the queued calls, replies to the ones made are ignored"""
+        self._queue.clear()
+        self._in_flight = 0
+        self._generation += 1
+
+    def is_idle(self):
+        return not self._queue and self._in_flight == 0
+
+    def _run(self):
+        while self._queue and self._in_flight < self._max_in_flight:
+            method, args, kwargs = self._queue.popleft()
+            kwargs['reply_handler'] = partial(self.__reply_cb,
+                                              self._generation,
+                                              kwargs['reply_handler'])
+            kwargs['error_handler'] = partial(self.__reply_cb,
+                                              self._generation,
+                                              kwargs['error_handler'])
+            self._in_flight += 1
+            self.n_calls += 1
+            method(*args, **kwargs)
+
+    def __reply_cb(self, generation, handler, *args):
+        if generation != self._generation:
+            return
+
+        self._in_flight -= 1
+        try:
+            handler(*args)
+        finally:
+            self._run()
+            if self.is_idle():
+                self._idle_cb()
+
+
 class _Account(GObject.GObject):
     __gsignals__ = {
         'activity-added': (GObject.SignalFlags.RUN_FIRST, None,
@@ -191,11 +258,22 @@ class _Account(GObject.GObject):
         self._connection = None
         self._buddy_handles = {}
         self._activity_handles = {}
+        # activity id -> room handle, the reverse of _activity_handles
+        self._activity_rooms = {}
         self._self_handle = None
 
         self._buddies_per_activity = {}
         self._activities_per_buddy = {}
 
+        self._pending_handles = set()
+        self._handles_timeout_sid = None
+        self._contact_attribute_interfaces = []
+        self._queries = _QueryQueue(_MAX_QUERIES_IN_FLIGHT,
+                                    self.__queries_done_cb)
+        self._busy_since = None
+        # Seconds it took the last burst of queries to be answered
+        self.settle_time = None
+
         self._start_listening()
 
     def _start_listening(self):
@@ -298,9 +376,17 @@ class _Account(GObject.GObject):
 
             self._buddy_handles = {}
             self._activity_handles = {}
+            self._activity_rooms = {}
             self._buddies_per_activity = {}
             self._activities_per_buddy = {}
 
+            self._pending_handles.clear()
+            if self._handles_timeout_sid is not None:
+                GObject.source_remove(self._handles_timeout_sid)
+                self._handles_timeout_sid = None
+            self._queries.clear()
+            self._busy_since = None
+
             self.emit('disconnected')
 
         if status == CONNECTION_STATUS_DISCONNECTED:
@@ -309,6 +395,12 @@ class _Account(GObject.GObject):
     def __get_self_handle_cb(self, self_handle):
         self._self_handle = self_handle
 
+        self._connection[PROPERTIES_IFACE].Get(CONNECTION_INTERFACE_CONTACTS,
+                'ContactAttributeInterfaces',
+                reply_handler=self.__get_contact_attribute_interfaces_cb,
+                error_handler=partial(self.__error_handler_cb,
+                                      'Contacts.ContactAttributeInterfaces'))
+
         if CONNECTION_INTERFACE_CONTACT_CAPABILITIES in self._connection:
             interface = CONNECTION_INTERFACE_CONTACT_CAPABILITIES
             connection = self._connection[interface]
@@ -380,12 +472,8 @@ class _Account(GObject.GObject):
                                       'Connection.GetMembers'))
 
     def __active_activity_changed_cb(self, model, home_activity):
-        room_handle = 0
         home_activity_id = home_activity.get_activity_id()
-        for handle, activity_id in self._activity_handles.items():
-            if home_activity_id == activity_id:
-                room_handle = handle
-                break
+        room_handle = self._activity_rooms.get(home_activity_id, 0)
         if room_handle == 0:
             home_activity_id = ''
 
@@ -402,6 +490,24 @@ class _Account(GObject.GObject):
     def __set_current_activity_error_cb(self, error):
         logging.debug('_Account.__set_current_activity__error_cb %r', error)
 
+    def __get_contact_attribute_interfaces_cb(self, interfaces):
+        self._contact_attribute_interfaces = interfaces
+
+    def _query(self, method, *args, **kwargs):
+        if self._busy_since is None:
+            self._busy_since = time.time()
+        self._queries.call(method, *args, **kwargs)
+
+    def __queries_done_cb(self):
+        if self._pending_handles or self._busy_since is None:
+            return
+
+        self.settle_time = time.time() - self._busy_since
+        self._busy_since = None
+        logging.debug('_Account: neighborhood of %s settled in %.2f s, '
+                      '%d queries made so far', self.object_path,
+                      self.settle_time, self._queries.n_calls)
+
     def __update_capabilities_cb(self):
         pass
 
@@ -462,6 +568,7 @@ class _Account(GObject.GObject):
         for activity_id, room_handle in activities:
             if room_handle not in self._activity_handles:
                 self._activity_handles[room_handle] = activity_id
+                self._activity_rooms[activity_id] = room_handle
 
                 if buddy_handle == self._self_handle:
                     home_model = shell.get_model()
@@ -479,7 +586,7 @@ class _Account(GObject.GObject):
 
                 connection = self._connection[
                         CONNECTION_INTERFACE_ACTIVITY_PROPERTIES]
-                connection.GetProperties(room_handle,
+                self._query(connection.GetProperties, room_handle,
                      reply_handler=partial(self.__get_properties_cb,
                                            room_handle),
                      error_handler=partial(self.__error_handler_cb,
@@ -491,7 +598,7 @@ class _Account(GObject.GObject):
                     # case, request again the current activity for this buddy.
                     connection = self._connection[
                         CONNECTION_INTERFACE_BUDDY_INFO]
-                    connection.GetCurrentActivity(
+                    self._query(connection.GetCurrentActivity,
                         buddy_handle,
                         reply_handler=partial(self.__get_current_activity_cb,
                                               buddy_handle),
@@ -535,10 +642,9 @@ class _Account(GObject.GObject):
         if not self._buddies_per_activity[activity_id]:
             del self._buddies_per_activity[activity_id]
 
-            for room_handle in self._activity_handles.copy():
-                if self._activity_handles[room_handle] == activity_id:
-                    del self._activity_handles[room_handle]
-                    break
+            room_handle = self._activity_rooms.pop(activity_id, None)
+            if room_handle is not None:
+                del self._activity_handles[room_handle]
 
             self.emit('activity-removed', activity_id)
 
@@ -578,12 +684,34 @@ class _Account(GObject.GObject):
 
     def _add_buddy_handles(self, handles):
         logging.debug('_Account._add_buddy_handles %r', handles)
+        if self._busy_since is None:
+            self._busy_since = time.time()
+
+        # Handles arriving close together are asked about in one call
+        self._pending_handles.update(handles)
+        if self._handles_timeout_sid is None:
+            self._handles_timeout_sid = GObject.timeout_add(
+                _HANDLES_BATCH_DELAY, self.__handles_timeout_cb)
+
+    def __handles_timeout_cb(self):
+        self._handles_timeout_sid = None
+
+        handles = list(self._pending_handles)
+        self._pending_handles.clear()
+
         interfaces = [CONNECTION, CONNECTION_INTERFACE_ALIASING]
-        self._connection[CONNECTION_INTERFACE_CONTACTS].GetContactAttributes(
-                handles, interfaces, False,
-                reply_handler=self.__get_contact_attributes_cb,
-                error_handler=partial(self.__error_handler_cb,
-                                      'Contacts.GetContactAttributes'))
+        if CONNECTION_INTERFACE_BUDDY_INFO in \
+                self._contact_attribute_interfaces:
+            interfaces.append(CONNECTION_INTERFACE_BUDDY_INFO)
+
+        connection = self._connection[CONNECTION_INTERFACE_CONTACTS]
+        for i in range(0, len(handles), _HANDLES_PER_REQUEST):
+            self._query(connection.GetContactAttributes,
+                    handles[i:i + _HANDLES_PER_REQUEST], interfaces, False,
+                    reply_handler=self.__get_contact_attributes_cb,
+                    error_handler=partial(self.__error_handler_cb,
+                                          'Contacts.GetContactAttributes'))
+        return False
 
     def __got_buddy_info_cb(self, handle, nick, properties):
         logging.debug('_Account.__got_buddy_info_cb %r', handle)
@@ -614,36 +742,56 @@ class _Account(GObject.GObject):
                 contact_id = attributes[handle][CONNECTION + '/contact-id']
                 self._buddy_handles[handle] = contact_id
 
+                self.emit('buddy-added', contact_id, nick, handle)
+
                 if CONNECTION_INTERFACE_BUDDY_INFO in self._connection:
-                    connection = \
-                            self._connection[CONNECTION_INTERFACE_BUDDY_INFO]
+                    self._query_buddy_info(handle, nick, attributes[handle])
 
-                    connection.GetProperties(
-                        handle,
-                        reply_handler=partial(self.__got_buddy_info_cb, handle,
-                                              nick),
-                        error_handler=partial(self.__error_handler_cb,
-                                              'BuddyInfo.GetProperties'),
-                        byte_arrays=True,
-                        timeout=_QUERY_DBUS_TIMEOUT)
-
-                    connection.GetActivities(
-                        handle,
-                        reply_handler=partial(self.__got_activities_cb,
-                                              handle),
-                        error_handler=partial(self.__error_handler_cb,
-                                              'BuddyInfo.GetActivities'),
-                        timeout=_QUERY_DBUS_TIMEOUT)
+    def _query_buddy_info(self, handle, nick, attributes):
+        """Get the buddy info of a new contact
 
-                    connection.GetCurrentActivity(
-                        handle,
-                        reply_handler=partial(self.__get_current_activity_cb,
-                                              handle),
-                        error_handler=partial(self.__error_handler_cb,
-                                              'BuddyInfo.GetCurrentActivity'),
-                        timeout=_QUERY_DBUS_TIMEOUT)
+        Connection managers that provide the buddy info as contact
+        attributes have already sent it along with the other attributes;
+        only what is missing there is asked for.
+        """
+        connection = self._connection[CONNECTION_INTERFACE_BUDDY_INFO]
 
-                self.emit('buddy-added', contact_id, nick, handle)
+        key = CONNECTION_INTERFACE_BUDDY_INFO + '/properties'
+        if key in attributes:
+            self.__got_buddy_info_cb(handle, nick, attributes[key])
+        else:
+            self._query(connection.GetProperties,
+                handle,
+                reply_handler=partial(self.__got_buddy_info_cb, handle,
+                                      nick),
+                error_handler=partial(self.__error_handler_cb,
+                                      'BuddyInfo.GetProperties'),
+                byte_arrays=True,
+                timeout=_QUERY_DBUS_TIMEOUT)
+
+        key = CONNECTION_INTERFACE_BUDDY_INFO + '/activities'
+        if key in attributes:
+            self.__got_activities_cb(handle, attributes[key])
+        else:
+            self._query(connection.GetActivities,
+                handle,
+                reply_handler=partial(self.__got_activities_cb, handle),
+                error_handler=partial(self.__error_handler_cb,
+                                      'BuddyInfo.GetActivities'),
+                timeout=_QUERY_DBUS_TIMEOUT)
+
+        key = CONNECTION_INTERFACE_BUDDY_INFO + '/current-activity'
+        if key in attributes:
+            activity_id, room_handle = attributes[key]
+            self.__get_current_activity_cb(handle, activity_id, room_handle)
+        else:
+            self._query(connection.GetCurrentActivity,
+                handle,
+                reply_handler=partial(self.__get_current_activity_cb,
+                                      handle),
+                error_handler=partial(self.__error_handler_cb,
+                                      'BuddyInfo.GetCurrentActivity'),
+                timeout=_QUERY_DBUS_TIMEOUT)
 
     def __got_activities_cb(self, buddy_handle, activities):
         logging.debug('_Account.__got_activities_cb %r %r', buddy_handle,
@@ -687,8 +835,14 @@ class Neighborhood(GObject.GObject):
     def __init__(self):
         GObject.GObject.__init__(self)
 
-        self._buddies = {None: get_owner_instance()}
+        owner = get_owner_instance()
+        self._buddies = {None: owner}
         self._activities = {}
+
+        # Secondary indexes of the buddies and activities above
+        self._buddies_by_key = {owner.props.key: owner}
+        self._buddies_by_handle = {}
+        self._activities_by_room = {}
         self._link_local_account = None
         self._server_account = None
         self._shell_model = shell.get_model()
@@ -907,6 +1061,7 @@ class Neighborhood(GObject.GObject):
                 contact_id=contact_id,
                 handle=handle)
         self._buddies[contact_id] = buddy
+        self._buddies_by_handle[(account.object_path, handle)] = buddy
 
     def __buddy_updated_cb(self, account, contact_id, properties):
         logging.debug('__buddy_updated_cb %r', contact_id)
@@ -928,7 +1083,10 @@ class Neighborhood(GObject.GObject):
             buddy.props.color = XoColor(str(properties['color']))
 
         if 'key' in properties:
+            if self._buddies_by_key.get(buddy.props.key) is buddy:
+                del self._buddies_by_key[buddy.props.key]
             buddy.props.key = properties['key']
+            self._buddies_by_key[buddy.props.key] = buddy
 
         nick_key = CONNECTION_INTERFACE_ALIASING + '/alias'
         if nick_key in properties:
@@ -947,6 +1105,12 @@ class Neighborhood(GObject.GObject):
         buddy = self._buddies[contact_id]
         del self._buddies[contact_id]
 
+        if self._buddies_by_key.get(buddy.props.key) is buddy:
+            del self._buddies_by_key[buddy.props.key]
+        handle_key = (buddy.props.account, buddy.props.handle)
+        if self._buddies_by_handle.get(handle_key) is buddy:
+            del self._buddies_by_handle[handle_key]
+
         if buddy.props.key is not None:
             self.emit('buddy-removed', buddy)
 
@@ -958,6 +1122,7 @@ class Neighborhood(GObject.GObject):
 
         activity = ActivityModel(activity_id, room_handle)
         self._activities[activity_id] = activity
+        self._activities_by_room[room_handle] = activity
 
     def __activity_updated_cb(self, account, activity_id, properties):
         logging.debug('__activity_updated_cb %r %r', activity_id, properties)
@@ -995,6 +1160,8 @@ class Neighborhood(GObject.GObject):
             return
         activity = self._activities[activity_id]
         del self._activities[activity_id]
+        if self._activities_by_room.get(activity.room_handle) is activity:
+            del self._activities_by_room[activity.room_handle]
         self._shell_model.remove_shared_activity(activity_id)
 
         if activity.props.bundle is not None:
@@ -1055,14 +1222,19 @@ class Neighborhood(GObject.GObject):
         return self._buddies.values()
 
     def get_buddy_by_key(self, key):
-        for buddy in self._buddies.values():
-            if buddy.key == key:
-                return buddy
-        return None
+        return self._buddies_by_key.get(key, None)
+
+    def get_buddy_by_handle(self, contact_handle, account_path=None):
+        if account_path is not None:
+            return self._buddies_by_handle.get((account_path, contact_handle),
+                                               None)
 
-    def get_buddy_by_handle(self, contact_handle):
-        for buddy in self._buddies.values():
-            if not buddy.is_owner() and buddy.handle == contact_handle:
+        for account in [self._link_local_account, self._server_account]:
+            if account is None:
+                continue
+            buddy = self._buddies_by_handle.get(
+                (account.object_path, contact_handle))
+            if buddy is not None:
                 return buddy
         return None
 
@@ -1070,10 +1242,7 @@ class Neighborhood(GObject.GObject):
         return self._activities.get(activity_id, None)
 
     def get_activity_by_room(self, room_handle):
-        for activity in self._activities.values():
-            if activity.room_handle == room_handle:
-                return activity
-        return None
+        return self._activities_by_room.get(room_handle, None)
 
     def get_activities(self):
         return self._activities.values()
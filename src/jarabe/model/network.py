@@ -19,6 +19,7 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 from gettext import gettext as _
+from functools import partial
 import logging
 import os
 import uuid
@@ -181,6 +182,14 @@ NM_AGENT_MANAGER_PATH = '/org/freedesktop/NetworkManager/AgentManager'
 
 NM_AGENT_MANAGER_ERR_NO_SECRETS = 'org.freedesktop.NetworkManager.AgentManager.NoSecrets'
 
+# The interface with the properties specific to each type of device
+_DEVICE_TYPE_IFACES = {
+    NM_DEVICE_TYPE_ETHERNET: NM_WIRED_IFACE,
+    NM_DEVICE_TYPE_WIFI: NM_WIRELESS_IFACE,
+    NM_DEVICE_TYPE_OLPC_MESH: NM_OLPC_MESH_IFACE,
+    NM_DEVICE_TYPE_MODEM: NM_MODEM_IFACE,
+}
+
 GSM_CONNECTION_ID = 'Sugar Modem Connection'
 GSM_BAUD_RATE = 115200
 GSM_USERNAME_PATH = '/desktop/sugar/network/gsm/username'
@@ -198,6 +207,7 @@ _network_manager = None
 _nm_settings = None
 _secret_agent = None
 _connections = None
+_manager_state = None
 
 _nm_device_state_reason_description = None
 
@@ -607,7 +617,6 @@ class AccessPoint(GObject.GObject):
         self.model = model
 
         self._initialized = False
-        self._bus = dbus.SystemBus()
 
         self.ssid = ''
         self.strength = 0
@@ -618,16 +627,12 @@ class AccessPoint(GObject.GObject):
         self.channel = 0
 
     def initialize(self):
-        model_props = dbus.Interface(self.model, dbus.PROPERTIES_IFACE)
-        model_props.GetAll(NM_ACCESSPOINT_IFACE, byte_arrays=True,
-                           reply_handler=self._ap_properties_changed_cb,
-                           error_handler=self._get_all_props_error_cb)
-
-        self._bus.add_signal_receiver(self._ap_properties_changed_cb,
-                                      signal_name='PropertiesChanged',
-                                      path=self.model.object_path,
-                                      dbus_interface=NM_ACCESSPOINT_IFACE,
-                                      byte_arrays=True)
+        properties = get_manager_state().get_properties(
+            self.model.object_path, NM_ACCESSPOINT_IFACE)
+        if properties is None:
+            logging.error('Unknown access point %s', self.model.object_path)
+            return
+        self._update_properties(properties)
 
     def network_hash(self):
         """
@@ -690,17 +695,328 @@ class AccessPoint(GObject.GObject):
         self._initialized = True
         self.emit('props-changed', old_hash)
 
-    def _get_all_props_error_cb(self, err):
-        logging.error('Error getting the access point properties: %s', err)
+    def update_properties(self, properties):
+        """Apply a change of the properties of the access point
 
-    def _ap_properties_changed_cb(self, properties):
+        The owner of the access point forwards the properties-changed
+        signals of the NetworkManagerState for its object path.
+
+        """
         self._update_properties(properties)
 
-    def disconnect(self):
-        self._bus.remove_signal_receiver(self._ap_properties_changed_cb,
-                                         signal_name='PropertiesChanged',
-                                         path=self.model.object_path,
-                                         dbus_interface=NM_ACCESSPOINT_IFACE)
+
+class NetworkManagerState(GObject.GObject):
+    """In-memory mirror of the state of NetworkManager
+
+    Tracks the devices of NetworkManager, the access points seen by the
+    wireless ones and the active connections, subscribing once to their
+    signals for the whole shell, so that views can read their properties
+    without calling NetworkManager and react to the typed signals below
+    instead of each listening on the system bus.
+
+    A device is announced with device-added once the properties of its
+    generic and type specific interfaces are known, an access point with
+    access-point-added once its properties are, and device-state-changed
+    is emitted once the properties of the device have been refreshed for
+    its new state.
+
+    """
+
+    __gsignals__ = {
+        'device-added': (GObject.SignalFlags.RUN_FIRST, None,
+                         ([GObject.TYPE_PYOBJECT])),
+        'device-removed': (GObject.SignalFlags.RUN_FIRST, None,
+                           ([GObject.TYPE_PYOBJECT])),
+        'device-state-changed': (GObject.SignalFlags.RUN_FIRST, None,
+                                 ([GObject.TYPE_PYOBJECT,
+                                   GObject.TYPE_PYOBJECT,
+                                   GObject.TYPE_PYOBJECT,
+                                   GObject.TYPE_PYOBJECT])),
+        'access-point-added': (GObject.SignalFlags.RUN_FIRST, None,
+                               ([GObject.TYPE_PYOBJECT,
+                                 GObject.TYPE_PYOBJECT])),
+        'access-point-removed': (GObject.SignalFlags.RUN_FIRST, None,
+                                 ([GObject.TYPE_PYOBJECT,
+                                   GObject.TYPE_PYOBJECT])),
+        'properties-changed': (GObject.SignalFlags.RUN_FIRST, None,
+                               ([GObject.TYPE_PYOBJECT,
+                                 GObject.TYPE_PYOBJECT,
+                                 GObject.TYPE_PYOBJECT])),
+        'active-connections-changed': (GObject.SignalFlags.RUN_FIRST, None,
+                                       ()),
+    }
+
+    def __init__(self):
+        GObject.GObject.__init__(self)
+
+        self._bus = dbus.SystemBus()
+
+        # (object path, interface) -> properties
+        self._properties = {}
+        # device path -> device type, for the devices announced
+        self._devices = {}
+        self._pending_devices = set()
+        # device path -> paths of the access points announced
+        self._access_points = {}
+        # access point path -> device path, while getting its properties
+        self._pending_access_points = {}
+        self._active_connections = []
+
+        try:
+            self._bus.get_object(NM_SERVICE, NM_PATH)
+        except dbus.DBusException:
+            logging.error('%s service not available', NM_SERVICE)
+            return
+
+        self._bus.add_signal_receiver(self.__device_added_cb,
+                                      signal_name='DeviceAdded',
+                                      dbus_interface=NM_IFACE)
+        self._bus.add_signal_receiver(self.__device_removed_cb,
+                                      signal_name='DeviceRemoved',
+                                      dbus_interface=NM_IFACE)
+        self._bus.add_signal_receiver(self.__device_state_changed_cb,
+                                      signal_name='StateChanged',
+                                      dbus_interface=NM_DEVICE_IFACE,
+                                      path_keyword='path')
+        self._bus.add_signal_receiver(self.__access_point_added_cb,
+                                      signal_name='AccessPointAdded',
+                                      dbus_interface=NM_WIRELESS_IFACE,
+                                      path_keyword='path')
+        self._bus.add_signal_receiver(self.__access_point_removed_cb,
+                                      signal_name='AccessPointRemoved',
+                                      dbus_interface=NM_WIRELESS_IFACE,
+                                      path_keyword='path')
+        self._bus.add_signal_receiver(self.__properties_changed_cb,
+                                      signal_name='PropertiesChanged',
+                                      bus_name=NM_SERVICE,
+                                      path_keyword='path',
+                                      interface_keyword='interface',
+                                      byte_arrays=True)
+
+        self._get_all(NM_PATH, NM_IFACE, self.__get_manager_props_reply_cb)
+        get_manager().GetDevices(reply_handler=self.__get_devices_reply_cb,
+                                 error_handler=self.__get_devices_error_cb)
+
+    def _get_all(self, path, interface, reply_handler, error_handler=None):
+        if error_handler is None:
+            error_handler = partial(self.__get_all_error_cb, path, interface)
+        obj = self._bus.get_object(NM_SERVICE, path, introspect=False)
+        props = dbus.Interface(obj, dbus.PROPERTIES_IFACE)
+        props.GetAll(interface, byte_arrays=True,
+                     reply_handler=reply_handler,
+                     error_handler=error_handler)
+
+    def __get_all_error_cb(self, path, interface, err):
+        logging.error('Error getting the properties of %s %s: %s', interface,
+                      path, err)
+        self._pending_devices.discard(path)
+        self._pending_access_points.pop(path, None)
+
+    def __get_manager_props_reply_cb(self, properties):
+        self._properties[(NM_PATH, NM_IFACE)] = properties
+        self._update_active_connections(properties['ActiveConnections'])
+
+    def __get_devices_reply_cb(self, devices_o):
+        for device_o in devices_o:
+            self._add_device(device_o)
+
+    def __get_devices_error_cb(self, err):
+        logging.error('Failed to get devices: %s', err)
+
+    def _add_device(self, device_o):
+        if device_o in self._devices or device_o in self._pending_devices:
+            return
+        self._pending_devices.add(device_o)
+        self._get_all(device_o, NM_DEVICE_IFACE,
+                      partial(self.__get_device_props_reply_cb, device_o))
+
+    def __get_device_props_reply_cb(self, device_o, properties):
+        if device_o not in self._pending_devices:
+            # removed in the meantime
+            return
+        self._properties[(device_o, NM_DEVICE_IFACE)] = properties
+
+        interface = _DEVICE_TYPE_IFACES.get(properties['DeviceType'])
+        if interface is None:
+            self._announce_device(device_o)
+            return
+        self._get_all(device_o, interface,
+                      partial(self.__get_device_type_props_reply_cb,
+                              device_o, interface))
+
+    def __get_device_type_props_reply_cb(self, device_o, interface,
+                                         properties):
+        if device_o not in self._pending_devices:
+            return
+        self._properties[(device_o, interface)] = properties
+        self._announce_device(device_o)
+
+    def _announce_device(self, device_o):
+        self._pending_devices.remove(device_o)
+        device_type = self.get_property(device_o, NM_DEVICE_IFACE,
+                                        'DeviceType')
+        self._devices[device_o] = device_type
+        if device_type == NM_DEVICE_TYPE_WIFI:
+            self._access_points[device_o] = set()
+
+        self.emit('device-added', device_o)
+
+        if device_type == NM_DEVICE_TYPE_WIFI:
+            obj = self._bus.get_object(NM_SERVICE, device_o,
+                                       introspect=False)
+            device = dbus.Interface(obj, NM_WIRELESS_IFACE)
+            device.GetAccessPoints(
+                reply_handler=partial(self.__get_access_points_reply_cb,
+                                      device_o),
+                error_handler=self.__get_access_points_error_cb)
+
+    def __device_added_cb(self, device_o):
+        self._add_device(device_o)
+
+    def __device_removed_cb(self, device_o):
+        self._pending_devices.discard(device_o)
+        if device_o not in self._devices:
+            return
+
+        for ap_o in self._access_points.pop(device_o, set()):
+            del self._properties[(ap_o, NM_ACCESSPOINT_IFACE)]
+            self.emit('access-point-removed', device_o, ap_o)
+
+        device_type = self._devices.pop(device_o)
+        del self._properties[(device_o, NM_DEVICE_IFACE)]
+        self._properties.pop((device_o, _DEVICE_TYPE_IFACES.get(device_type)),
+                             None)
+
+        self.emit('device-removed', device_o)
+
+    def __device_state_changed_cb(self, new_state, old_state, reason,
+                                  path=None):
+        if path not in self._devices:
+            return
+        self._properties[(path, NM_DEVICE_IFACE)]['State'] = new_state
+
+        # The addresses and the like change along with the state but the
+        # generic device interface does not notify about them
+        state_args = (path, new_state, old_state, reason)
+        self._get_all(path, NM_DEVICE_IFACE,
+                      partial(self.__refresh_device_props_reply_cb,
+                              state_args),
+                      partial(self.__refresh_device_props_error_cb,
+                              state_args))
+
+    def __refresh_device_props_reply_cb(self, state_args, properties):
+        device_o = state_args[0]
+        if device_o not in self._devices:
+            return
+        self._properties[(device_o, NM_DEVICE_IFACE)] = properties
+        self.emit('device-state-changed', *state_args)
+
+    def __refresh_device_props_error_cb(self, state_args, err):
+        logging.error('Error refreshing the properties of device %s: %s',
+                      state_args[0], err)
+        if state_args[0] in self._devices:
+            self.emit('device-state-changed', *state_args)
+
+    def __get_access_points_reply_cb(self, device_o, access_points_o):
+        for ap_o in access_points_o:
+            self._add_access_point(device_o, ap_o)
+
+    def __get_access_points_error_cb(self, err):
+        logging.error('Failed to get access points: %s', err)
+
+    def _add_access_point(self, device_o, ap_o):
+        if device_o not in self._access_points:
+            return
+        if ap_o in self._access_points[device_o] or \
+                ap_o in self._pending_access_points:
+            return
+        self._pending_access_points[ap_o] = device_o
+        self._get_all(ap_o, NM_ACCESSPOINT_IFACE,
+                      partial(self.__get_access_point_props_reply_cb, ap_o))
+
+    def __get_access_point_props_reply_cb(self, ap_o, properties):
+        device_o = self._pending_access_points.pop(ap_o, None)
+        if device_o not in self._access_points:
+            return
+        self._properties[(ap_o, NM_ACCESSPOINT_IFACE)] = properties
+        self._access_points[device_o].add(ap_o)
+        self.emit('access-point-added', device_o, ap_o)
+
+    def __access_point_added_cb(self, ap_o, path=None):
+        self._add_access_point(path, ap_o)
+
+    def __access_point_removed_cb(self, ap_o, path=None):
+        self._pending_access_points.pop(ap_o, None)
+        if ap_o not in self._access_points.get(path, ()):
+            return
+        self._access_points[path].remove(ap_o)
+        del self._properties[(ap_o, NM_ACCESSPOINT_IFACE)]
+        self.emit('access-point-removed', path, ap_o)
+
+    def _update_active_connections(self, connections_o):
+        removed = set(self._active_connections) - set(connections_o)
+        for connection_o in removed:
+            self._properties.pop((connection_o, NM_ACTIVE_CONN_IFACE), None)
+        self._active_connections = list(connections_o)
+
+        for connection_o in connections_o:
+            if (connection_o, NM_ACTIVE_CONN_IFACE) not in self._properties:
+                self._get_all(connection_o, NM_ACTIVE_CONN_IFACE,
+                              partial(self.__get_connection_props_reply_cb,
+                                      connection_o))
+
+        if removed:
+            self.emit('active-connections-changed')
+
+    def __get_connection_props_reply_cb(self, connection_o, properties):
+        if connection_o not in self._active_connections:
+            return
+        self._properties[(connection_o, NM_ACTIVE_CONN_IFACE)] = properties
+        self.emit('active-connections-changed')
+
+    def __properties_changed_cb(self, *args, **kwargs):
+        key = (kwargs['path'], kwargs['interface'])
+        # also catches org.freedesktop.DBus.Properties.PropertiesChanged,
+        # which newer versions of NetworkManager emit as well
+        if key not in self._properties:
+            return
+
+        properties = args[0]
+        self._properties[key].update(properties)
+        if key == (NM_PATH, NM_IFACE) and 'ActiveConnections' in properties:
+            self._update_active_connections(properties['ActiveConnections'])
+
+        self.emit('properties-changed', key[0], key[1], properties)
+
+    def get_devices(self):
+        """Return the object paths of the devices announced so far"""
+        return self._devices.keys()
+
+    def get_device_type(self, device_o):
+        return self._devices.get(device_o, NM_DEVICE_TYPE_UNKNOWN)
+
+    def get_access_points(self, device_o):
+        return list(self._access_points.get(device_o, ()))
+
+    def get_active_connections(self):
+        """Return the paths of the active connections whose properties
+        are known"""
+        return [connection_o for connection_o in self._active_connections
+                if (connection_o, NM_ACTIVE_CONN_IFACE) in self._properties]
+
+    def get_properties(self, path, interface):
+        """Return a copy of the properties of an interface of an object,
+        or None if the object is not known"""
+        properties = self._properties.get((path, interface))
+        if properties is None:
+            return None
+        return dict(properties)
+
+    def get_property(self, path, interface, name, default=None):
+        properties = self._properties.get((path, interface))
+        if properties is None:
+            return default
+        return properties.get(name, default)
 
 
 def get_manager():
@@ -728,6 +1044,13 @@ def get_secret_agent():
     return _secret_agent
 
 
+def get_manager_state():
+    global _manager_state
+    if _manager_state is None:
+        _manager_state = NetworkManagerState()
+    return _manager_state
+
+
 def _activate_reply_cb(connection_path):
     logging.debug('Activated connection: %s', connection_path)
 
@@ -1034,19 +1357,16 @@ def disconnect_access_points(ap_paths):
     Disconnect all devices connected to any of the given access points.
     """
     bus = dbus.SystemBus()
-    netmgr_obj = bus.get_object(NM_SERVICE, NM_PATH)
-    netmgr = dbus.Interface(netmgr_obj, NM_IFACE)
-    netmgr_props = dbus.Interface(netmgr, dbus.PROPERTIES_IFACE)
-    active_connection_paths = netmgr_props.Get(NM_IFACE, 'ActiveConnections')
-
-    for conn_path in active_connection_paths:
-        conn_obj = bus.get_object(NM_IFACE, conn_path)
-        conn_props = dbus.Interface(conn_obj, dbus.PROPERTIES_IFACE)
-        ap_path = conn_props.Get(NM_ACTIVE_CONN_IFACE, 'SpecificObject')
+    state = get_manager_state()
+
+    for conn_path in state.get_active_connections():
+        ap_path = state.get_property(conn_path, NM_ACTIVE_CONN_IFACE,
+                                     'SpecificObject')
         if ap_path == '/' or ap_path not in ap_paths:
             continue
 
-        dev_paths = conn_props.Get(NM_ACTIVE_CONN_IFACE, 'Devices')
+        dev_paths = state.get_property(conn_path, NM_ACTIVE_CONN_IFACE,
+                                       'Devices', [])
         for dev_path in dev_paths:
             dev_obj = bus.get_object(NM_SERVICE, dev_path)
             dev = dbus.Interface(dev_obj, NM_DEVICE_IFACE)
@@ -30,6 +30,7 @@ _XS_ANYCAST = '\xc0\x27\xc0\x27\xc0\x00'
 class OlpcMeshManager(object):
     def __init__(self, mesh_device):
         self._bus = dbus.SystemBus()
+        self._state = network.get_manager_state()
 
         # counter for how many asynchronous connection additions we are
         # waiting for
@@ -48,32 +49,17 @@ class OlpcMeshManager(object):
             self._ensure_connection_exists(channel, xs_hosted=True)
             self._ensure_connection_exists(channel, xs_hosted=False)
 
-        props = dbus.Interface(self.mesh_device, dbus.PROPERTIES_IFACE)
-        props.Get(network.NM_DEVICE_IFACE, 'State',
-                  reply_handler=self.__get_mesh_state_reply_cb,
-                  error_handler=self.__get_state_error_cb)
-
-        props = dbus.Interface(self.eth_device, dbus.PROPERTIES_IFACE)
-        props.Get(network.NM_DEVICE_IFACE, 'State',
-                  reply_handler=self.__get_eth_state_reply_cb,
-                  error_handler=self.__get_state_error_cb)
-
-        self._bus.add_signal_receiver(self.__eth_device_state_changed_cb,
-                                      signal_name='StateChanged',
-                                      path=self.eth_device.object_path,
-                                      dbus_interface=network.NM_DEVICE_IFACE)
-
-        self._bus.add_signal_receiver(self.__mshdev_state_changed_cb,
-                                      signal_name='StateChanged',
-                                      path=self.mesh_device.object_path,
-                                      dbus_interface=network.NM_DEVICE_IFACE)
+        self._state.connect('device-state-changed',
+                            self.__device_state_changed_cb)
+        self._state.connect('device-added', self.__device_added_cb)
 
         self._idle_source = 0
-        self._mesh_device_state = network.NM_DEVICE_STATE_UNKNOWN
-        self._eth_device_state = network.NM_DEVICE_STATE_UNKNOWN
+        self._mesh_device_state = self._get_device_state(self.mesh_device)
+        self._eth_device_state = self._get_device_state(self.eth_device)
 
         if self._add_connections_pending == 0:
             self.ready()
+        self._maybe_schedule_idle_check()
 
     def ready(self):
         """Called when all connections have been added (if they were not
@@ -85,10 +71,16 @@ class OlpcMeshManager(object):
             self._start_automesh()
 
     def _get_companion_device(self):
-        props = dbus.Interface(self.mesh_device, dbus.PROPERTIES_IFACE)
-        eth_device_o = props.Get(network.NM_OLPC_MESH_IFACE, 'Companion')
+        eth_device_o = self._state.get_property(
+            self.mesh_device.object_path, network.NM_OLPC_MESH_IFACE,
+            'Companion')
         return self._bus.get_object(network.NM_SERVICE, eth_device_o)
 
+    def _get_device_state(self, device):
+        return self._state.get_property(device.object_path,
+                                        network.NM_DEVICE_IFACE, 'State',
+                                        network.NM_DEVICE_STATE_UNKNOWN)
+
     def _have_configured_connections(self):
         return len(network.get_connections().get_list()) > 0
 
@@ -101,18 +93,21 @@ class OlpcMeshManager(object):
             GObject.source_remove(self._idle_source)
         self._idle_source = GObject.timeout_add_seconds(10, self._idle_check)
 
-    def __get_state_error_cb(self, err):
-        logging.debug('Error getting the device state: %s', err)
-
-    def __get_mesh_state_reply_cb(self, state):
-        self._mesh_device_state = state
-        self._maybe_schedule_idle_check()
-
-    def __get_eth_state_reply_cb(self, state):
-        self._eth_device_state = state
-        self._maybe_schedule_idle_check()
-
-    def __eth_device_state_changed_cb(self, new_state, old_state, reason):
+    def __device_added_cb(self, state, device_o):
+        # The companion device may be announced after the mesh device, its
+        # state is not known before
+        if device_o == self.eth_device.object_path:
+            self._eth_device_state_changed(
+                self._get_device_state(self.eth_device))
+
+    def __device_state_changed_cb(self, state, device_o, new_state,
+                                  old_state, reason):
+        if device_o == self.eth_device.object_path:
+            self._eth_device_state_changed(new_state)
+        elif device_o == self.mesh_device.object_path:
+            self._mesh_device_state_changed(new_state)
+
+    def _eth_device_state_changed(self, new_state):
         """If a connection is activated on the eth device, stop trying our
         automatic connections.
 
@@ -125,7 +120,7 @@ class OlpcMeshManager(object):
                 and len(self._connection_queue) > 0:
             self._connection_queue = []
 
-    def __mshdev_state_changed_cb(self, new_state, old_state, reason):
+    def _mesh_device_state_changed(self, new_state):
         self._mesh_device_state = new_state
         self._maybe_schedule_idle_check()
 
@@ -0,0 +1,103 @@
+# Copyright (C) 2012, One Laptop per Child
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Measure how long the journal takes to find out the size of an entry
+
+Creates a datastore entry with a large file (200 MB by default) in a
+temporary profile and compares the stat of the file in the datastore
+directory with asking the datastore for a copy of the file, which is what
+it does when it cannot hard link it.
+
+    python bench_get_file_size.py [size in MB] [repetitions]
+
+"""
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+base_dir = os.path.dirname(tests_dir)
+sys.path.insert(0, os.path.join(base_dir, 'src'))
+
+_UID = 'c0ffee00-0000-4000-8000-000000000000'
+_CHUNK_SIZE = 1024 * 1024
+
+
+class _DataStore(object):
+    """Answers the calls get_file_size makes the way the datastore does"""
+
+    def __init__(self, data_path, temp_dir):
+        self._data_path = data_path
+        self._temp_dir = temp_dir
+
+    def find(self, query, properties, byte_arrays=False):
+        # entries written by old activities may lack the filesize property
+        return [{'uid': query['uid']}], 1
+
+    def get_filename(self, object_id):
+        fd, file_path = tempfile.mkstemp(dir=self._temp_dir)
+        os.close(fd)
+        shutil.copy(self._data_path, file_path)
+        return file_path
+
+
+def _create_entry(data_path, size_mb):
+    os.makedirs(os.path.dirname(data_path))
+    chunk = 'x' * _CHUNK_SIZE
+    data_file = open(data_path, 'w')
+    for i_ in xrange(size_mb):
+        data_file.write(chunk)
+    data_file.close()
+
+
+def _time(function, repetitions):
+    start = time.time()
+    for i_ in xrange(repetitions):
+        size = function(_UID)
+    return size, (time.time() - start) / repetitions
+
+
+def main():
+    size_mb = 200
+    if len(sys.argv) > 1:
+        size_mb = int(sys.argv[1])
+    repetitions = 5
+    if len(sys.argv) > 2:
+        repetitions = int(sys.argv[2])
+
+    temp_dir = tempfile.mkdtemp()
+    os.environ['SUGAR_HOME'] = os.path.join(temp_dir, 'home')
+
+    from jarabe.journal import model
+
+    try:
+        data_path = model._get_datastore_data_path(_UID)
+        _create_entry(data_path, size_mb)
+        model._datastore = _DataStore(data_path, temp_dir)
+
+        for label, function in [('copy', model._get_file_size_from_copy),
+                                ('stat', model.get_file_size)]:
+            size, elapsed = _time(function, repetitions)
+            print '%s: %d bytes in %.6f s' % (label, size, elapsed)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
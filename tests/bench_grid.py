@@ -0,0 +1,79 @@
+# Copyright (C) 2012, One Laptop per Child
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Measure how long the neighborhood view takes to lay out its icons
+
+Places buddy icons (1000 by default) in the grid of a 1200x900 screen the
+way the spread layout of the neighborhood view does, then solves the
+collisions until the layout is stable, and reports the time spent on
+each step.
+
+    python bench_grid.py [number of buddies]
+
+"""
+
+import sys
+import os
+import time
+import random
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+base_dir = os.path.dirname(tests_dir)
+sys.path.insert(0, os.path.join(base_dir, 'src'))
+
+_SCREEN_WIDTH = 1200
+_SCREEN_HEIGHT = 900
+# Same as in jarabe.desktop.favoriteslayout
+_CELL_SIZE = 4
+# A buddy icon of standard size, in grid cells
+_ICON_SIZE = 14
+
+
+class _Buddy(object):
+    pass
+
+
+def main():
+    n_buddies = 1000
+    if len(sys.argv) > 1:
+        n_buddies = int(sys.argv[1])
+
+    from jarabe.desktop.grid import Grid
+
+    random.seed(0)
+    grid = Grid(_SCREEN_WIDTH / _CELL_SIZE, _SCREEN_HEIGHT / _CELL_SIZE)
+
+    start = time.time()
+    for i_ in xrange(n_buddies):
+        grid.add(_Buddy(), _ICON_SIZE, _ICON_SIZE)
+    placed = time.time()
+
+    # Run the collision solving the grid schedules on a timeout until
+    # there is nothing left to solve
+    n_rounds = 0
+    while not grid.is_stable():
+        n_rounds += 1
+        grid.solve_collisions()
+    stable = time.time()
+
+    print 'placing %d buddies: %.2f s' % (n_buddies, placed - start)
+    print 'solving collisions: %.2f s in %d rounds' % (stable - placed,
+                                                      n_rounds)
+    print 'time to stable layout: %.2f s' % (stable - start)
+
+
+if __name__ == '__main__':
+    main()
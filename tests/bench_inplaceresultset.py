@@ -0,0 +1,85 @@
+# Copyright (C) 2012, One Laptop per Child
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Measure how fast the journal scans a volume
+
+Creates a synthetic tree of files (100000 by default) and reports the
+files per second InplaceResultSet scans it at, first with an empty volume
+index and then with the index written by the first run.
+
+    python bench_inplaceresultset.py [number of files]
+
+"""
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+base_dir = os.path.dirname(tests_dir)
+sys.path.insert(0, os.path.join(base_dir, 'src'))
+
+_FILES_PER_DIRECTORY = 500
+
+
+def _create_tree(root, n_files):
+    for i in xrange(n_files):
+        dir_path = os.path.join(root, 'dir%d' % (i / _FILES_PER_DIRECTORY))
+        if i % _FILES_PER_DIRECTORY == 0:
+            os.mkdir(dir_path)
+        open(os.path.join(dir_path, 'file%d.txt' % i), 'w').close()
+
+
+def _scan(mount_point):
+    from gi.repository import GObject
+    from jarabe.journal import model
+
+    main_loop = GObject.MainLoop()
+    result_set = model.InplaceResultSet({}, 10, mount_point)
+    result_set.ready.connect(lambda **kwargs: main_loop.quit())
+
+    start = time.time()
+    result_set.setup()
+    main_loop.run()
+    elapsed = time.time() - start
+
+    return result_set.length, elapsed
+
+
+def main():
+    n_files = 100000
+    if len(sys.argv) > 1:
+        n_files = int(sys.argv[1])
+
+    temp_dir = tempfile.mkdtemp()
+    os.environ['SUGAR_HOME'] = os.path.join(temp_dir, 'home')
+    mount_point = os.path.join(temp_dir, 'volume')
+    os.mkdir(mount_point)
+
+    try:
+        _create_tree(mount_point, n_files)
+        for label in ['cold index', 'warm index']:
+            length, elapsed = _scan(mount_point)
+            print '%s: %d files in %.2f s, %.0f files/s' % \
+                (label, length, elapsed, length / elapsed)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
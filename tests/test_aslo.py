@@ -0,0 +1,209 @@
+# Copyright (C) 2012, One Laptop per Child
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import sys
+import os
+import time
+import unittest
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+base_dir = os.path.dirname(tests_dir)
+sys.path.insert(0, os.path.join(base_dir, 'src'))
+sys.path.insert(0, os.path.join(base_dir, 'extensions', 'cpsection',
+                                'updater'))
+
+_N_BUNDLES = 12
+
+# Seconds the server takes to answer, long enough for requests to overlap
+_SERVER_DELAY = 0.2
+
+_UPDATE_INFO = '''<?xml version="1.0" encoding="UTF-8"?>
+<RDF:RDF xmlns:RDF="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+        xmlns:em="http://www.mozilla.org/2004/em-rdf#">
+<RDF:Description about="urn:mozilla:extension:%(id)s">
+    <em:updates>
+        <RDF:Seq>
+            <RDF:li resource="urn:mozilla:extension:%(id)s:%(version)s"/>
+        </RDF:Seq>
+    </em:updates>
+</RDF:Description>
+
+<RDF:Description about="urn:mozilla:extension:%(id)s:%(version)s">
+    <em:version>%(version)s</em:version>
+    <em:targetApplication>
+        <RDF:Description>
+            <em:updateLink>http://localhost/%(id)s.xo</em:updateLink>
+            <em:updateSize>%(version)s</em:updateSize>
+        </RDF:Description>
+    </em:targetApplication>
+</RDF:Description></RDF:RDF>
+'''
+
+_NOT_FOUND_INFO = '''<?xml version="1.0" encoding="UTF-8"?>
+<RDF:RDF xmlns:RDF="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+        xmlns:em="http://www.mozilla.org/2004/em-rdf#">
+</RDF:RDF>
+'''
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Stand-in for activities.sugarlabs.org
+
+    The version of bundle org.sugarlabs.TestN is N + 1, the bundles with
+    an id that does not end with a number are unknown.
+
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           _RequestHandler)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.max_parallel_requests = 0
+        self._parallel_requests = 0
+
+    def request_started(self):
+        with self.lock:
+            self.requests += 1
+            self._parallel_requests += 1
+            self.max_parallel_requests = max(self.max_parallel_requests,
+                                             self._parallel_requests)
+
+    def request_finished(self):
+        with self.lock:
+            self._parallel_requests -= 1
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.request_started()
+        try:
+            time.sleep(_SERVER_DELAY)
+
+            query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+            bundle_id = query['id'][0]
+            number = bundle_id.rsplit('Test', 1)[-1]
+            if number.isdigit():
+                body = _UPDATE_INFO % {'id': bundle_id,
+                                       'version': int(number) + 1}
+            else:
+                body = _NOT_FOUND_INFO
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/xml')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            self.server.request_finished()
+
+    def log_message(self, format_, *args):
+        pass
+
+
+class _MockBundle(object):
+
+    def __init__(self, bundle_id):
+        self._bundle_id = bundle_id
+
+    def get_bundle_id(self):
+        return self._bundle_id
+
+    def get_name(self):
+        return self._bundle_id
+
+    def get_activity_version(self):
+        return '1'
+
+
+class TestAslo(unittest.TestCase):
+
+    def setUp(self):
+        from backends import aslo
+
+        self._server = _Server()
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self._aslo = aslo
+        self._update_path = aslo._UPDATE_PATH
+        aslo._UPDATE_PATH = 'http://127.0.0.1:%d/update-aslo.php' % \
+                self._server.server_address[1]
+
+    def tearDown(self):
+        self._aslo._UPDATE_PATH = self._update_path
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _fetch(self, bundles):
+        from gi.repository import GLib
+
+        main_loop = GLib.MainLoop()
+        results = {}
+
+        def completion_cb(bundle, version, link, size, error_message):
+            results[bundle.get_bundle_id()] = (version, link, size,
+                                               error_message)
+            if len(results) == len(bundles):
+                main_loop.quit()
+
+        for bundle in bundles:
+            self._aslo.fetch_update_info(bundle, completion_cb)
+
+        timeout_sid = GLib.timeout_add_seconds(30, main_loop.quit)
+        main_loop.run()
+        GLib.source_remove(timeout_sid)
+        return results
+
+    def test_parallel_fetches(self):
+        bundles = [_MockBundle('org.sugarlabs.Test%d' % i)
+                   for i in range(_N_BUNDLES)]
+
+        start = time.time()
+        results = self._fetch(bundles)
+        elapsed = time.time() - start
+
+        self.assertEqual(len(results), _N_BUNDLES)
+        for i in range(_N_BUNDLES):
+            version, link, size, error_message = \
+                    results['org.sugarlabs.Test%d' % i]
+            self.assertIsNone(error_message)
+            self.assertEqual(str(version), str(i + 1))
+            self.assertEqual(link,
+                             'http://localhost/org.sugarlabs.Test%d.xo' % i)
+            self.assertEqual(size, (i + 1) * 1024)
+
+        self.assertEqual(self._server.requests, _N_BUNDLES)
+        self.assertGreater(self._server.max_parallel_requests, 1)
+        self.assertLessEqual(self._server.max_parallel_requests,
+                             self._aslo._MAX_PARALLEL_FETCHES)
+        self.assertLess(elapsed, _N_BUNDLES * _SERVER_DELAY)
+
+    def test_unknown_bundle(self):
+        results = self._fetch([_MockBundle('org.sugarlabs.Unknown')])
+
+        version, link, size, error_message = \
+                results['org.sugarlabs.Unknown']
+        self.assertIsNone(error_message)
+        self.assertIsNone(version)
+        self.assertIsNone(link)